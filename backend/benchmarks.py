@@ -0,0 +1,394 @@
+"""
+Performance benchmarks for the Quantum IA backend.
+
+Run against a local MongoDB only - benchmarks seed and drop their own data.
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python benchmarks.py <name> [--size N]
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+import bson
+import httpx
+import orjson
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+from pymongo import monitoring
+from pydantic import TypeAdapter
+
+import server
+from mlm_dataset import DatasetShape, generate_mlm_dataset, top_affiliates
+
+
+def report(label: str, seconds: float, extra: str = ""):
+    print(f"  {label:<40} {seconds * 1000:>10.1f} ms {extra}")
+
+
+async def seed_notifications(wallet: str, count: int):
+    """Insert `count` unread notifications for a wallet with bulk writes"""
+    base = datetime.now(timezone.utc) - timedelta(seconds=count)
+    batch = []
+    for i in range(count):
+        batch.append({
+            "notification_id": str(uuid.uuid4()),
+            "wallet": wallet,
+            "type": "commission_received",
+            "title": "Commission Niveau 1 !",
+            "body": "Benchmark notification",
+            "data": {},
+            "read": False,
+            "created_at": base + timedelta(seconds=i),
+        })
+        if len(batch) == 10000:
+            await server.notifications_collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await server.notifications_collection.insert_many(batch, ordered=False)
+
+
+async def bench_notifications(size: int):
+    """Mark-all-read: legacy update_many vs read_through watermark"""
+    await server.ensure_indexes()
+    wallet = f"BENCH_notif_{uuid.uuid4().hex[:8]}"
+    print(f"notifications: {size} unread notifications for {wallet}")
+
+    try:
+        await seed_notifications(wallet, size)
+
+        start = time.perf_counter()
+        await server.get_notifications(wallet, limit=50)
+        report("get_notifications (all unread)", time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = await server.mark_notifications_read(wallet)
+        report("mark-read (watermark)", time.perf_counter() - start, f"marked={result['marked_read']}")
+
+        start = time.perf_counter()
+        page = orjson.loads((await server.get_notifications(wallet, limit=50)).body)
+        report("get_notifications (after watermark)", time.perf_counter() - start, f"unread={page['unread_count']}")
+
+        start = time.perf_counter()
+        result = await server.notifications_collection.update_many(
+            {"wallet": wallet},
+            {"$set": {"read": True}}
+        )
+        report("mark-read (legacy update_many)", time.perf_counter() - start, f"modified={result.modified_count}")
+    finally:
+        await server.notifications_collection.delete_many({"wallet": wallet})
+        await server.notification_state_collection.delete_many({"wallet": wallet})
+
+
+def legacy_encode(model_type, content) -> bytes:
+    """What FastAPI does with a response_model: validate, dump to JSON types, json.dumps"""
+    adapter = TypeAdapter(model_type)
+    validated = adapter.validate_python(content)
+    return json.dumps(adapter.dump_python(validated, mode="json")).encode()
+
+
+def time_best(fn, repeat: int = 20) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def bench_serialization(size: int):
+    """Per-endpoint encoding cost: Pydantic models + response_model vs dict rows + orjson"""
+    now = datetime.utcnow()
+    print(f"serialization: {size} rows per response (best of 20)")
+
+    commissions = [{
+        "commission_id": str(uuid.uuid4()),
+        "source_user_id": f"wallet_{i}",
+        "level": i % 5 + 1,
+        "percentage": 20.0,
+        "amount": 12.5,
+        "event_type": "presale_purchase",
+        "event_id": str(uuid.uuid4()),
+        "status": "pending",
+        "created_at": now,
+    } for i in range(size)]
+
+    def legacy_commissions():
+        entries = [server.CommissionEntry(
+            id=c["commission_id"], source_user_wallet=c["source_user_id"], level=c["level"],
+            percentage=c["percentage"], amount=c["amount"], event_type=c["event_type"],
+            event_id=c["event_id"], status=c["status"], created_at=c["created_at"].isoformat()
+        ) for c in commissions]
+        legacy_encode(server.CommissionHistoryResponse, server.CommissionHistoryResponse(
+            wallet_public_key="w", commissions=entries, total_count=size
+        ))
+
+    def fast_commissions():
+        orjson.dumps({
+            "wallet_public_key": "w",
+            "commissions": [server.commission_entry_row(c) for c in commissions],
+            "total_count": size
+        })
+
+    notifications = [{
+        "notification_id": str(uuid.uuid4()),
+        "type": "commission_received",
+        "title": "Commission Niveau 1 !",
+        "body": "Vous avez gagné $40.00 (20.0%) sur un achat de $200.00",
+        "data": {"source_wallet": f"wallet_{i}", "level": 1, "commission_amount": 40.0, "purchase_amount": 200.0},
+        "read": False,
+        "created_at": now,
+    } for i in range(size)]
+
+    def legacy_notifications():
+        result = [server.NotificationResponse(
+            id=n["notification_id"], type=n["type"], title=n["title"], body=n["body"],
+            data=n["data"], read=n["read"], created_at=n["created_at"].isoformat()
+        ) for n in notifications]
+        legacy_encode(server.NotificationListResponse, {"notifications": result, "unread_count": size})
+
+    def fast_notifications():
+        orjson.dumps({"notifications": [{
+            "id": n["notification_id"], "type": n["type"], "title": n["title"], "body": n["body"],
+            "data": n["data"], "read": n["read"], "created_at": n["created_at"]
+        } for n in notifications], "unread_count": size})
+
+    def tree_row(i: int) -> dict:
+        return {"wallet_public_key": f"wallet_{i}", "referral_code": "QTMABCDE", "level": 1,
+                "direct_referrals": 3, "total_generated": 120.0}
+
+    def legacy_tree():
+        tree = [server.AffiliateTreeNode(**tree_row(i), children=[
+            server.AffiliateTreeNode(**tree_row(i * 10 + j)) for j in range(3)
+        ]) for i in range(size // 4)]
+        legacy_encode(server.AffiliateTreeResponse, server.AffiliateTreeResponse(
+            wallet_public_key="w", tree=tree, total_network_size=size
+        ))
+
+    def fast_tree():
+        tree = [{**tree_row(i), "children": [
+            {**tree_row(i * 10 + j), "children": []} for j in range(3)
+        ]} for i in range(size // 4)]
+        orjson.dumps({"wallet_public_key": "w", "tree": tree, "total_network_size": size})
+
+    for endpoint, legacy, fast in [
+        ("get_commission_history", legacy_commissions, fast_commissions),
+        ("get_notifications", legacy_notifications, fast_notifications),
+        ("get_affiliate_tree", legacy_tree, fast_tree),
+    ]:
+        legacy_s = time_best(legacy)
+        fast_s = time_best(fast)
+        report(f"{endpoint} (models)", legacy_s)
+        report(f"{endpoint} (orjson)", fast_s, f"x{legacy_s / fast_s:.1f}")
+
+
+async def fetched_bytes(collection, query: dict, projection: Optional[dict]) -> int:
+    """Total BSON size of the documents a read returns"""
+    total = 0
+    async for doc in collection.find(query, projection):
+        total += len(bson.encode(doc))
+    return total
+
+
+async def bench_projection(size: int):
+    """Bytes transferred per endpoint read, full documents vs registered projections"""
+    tag = uuid.uuid4().hex[:8]
+    wallet = f"BENCH_proj_{tag}"
+    purchase_id = f"bench-{tag}"
+    now = datetime.now(timezone.utc)
+    print(f"projection: {size} commissions for {wallet}")
+
+    await server.users_collection.insert_one({
+        "wallet_public_key": wallet, "referral_code": f"QTM{tag[:5].upper()}",
+        "referrer_id": None, "created_at": now
+    })
+    await server.affiliate_commissions.insert_many([{
+        "commission_id": str(uuid.uuid4()), "source_user_id": f"BENCH_src_{i}",
+        "beneficiary_user_id": wallet, "level": i % 5 + 1, "percentage": 20.0, "amount": 40.0,
+        "event_type": "presale_purchase", "event_id": str(uuid.uuid4()),
+        "status": "pending", "created_at": now
+    } for i in range(size)])
+    await server.presale_purchases.insert_one({
+        "purchase_id": purchase_id, "firstName": "Bench", "lastName": "User", "email": "bench@quantum.io",
+        "walletAddress": wallet, "tokenAmount": 1000, "totalPrice": 200.0, "paymentMethod": "card",
+        "paymentStatus": "pending", "card2crypto_address_in": "x" * 200, "card2crypto_polygon_address": "0x" + "a" * 40,
+        "referralCode": None, "createdAt": now, "updatedAt": now
+    })
+
+    reads = [
+        ("stats: commissions", server.affiliate_commissions, {"beneficiary_user_id": wallet}, "commission_totals"),
+        ("tree: commission amounts", server.affiliate_commissions, {"beneficiary_user_id": wallet}, "commission_amount"),
+        ("stats: user lookup", server.users_collection, {"wallet_public_key": wallet}, "user_referral_code"),
+        ("purchase: user exists", server.users_collection, {"wallet_public_key": wallet}, "exists"),
+        ("callback: purchase", server.presale_purchases, {"purchase_id": purchase_id}, "purchase_callback"),
+        ("status: purchase", server.presale_purchases, {"purchase_id": purchase_id}, "purchase_status"),
+    ]
+
+    try:
+        for label, collection, query, projection in reads:
+            before = await fetched_bytes(collection, query, None)
+            after = await fetched_bytes(collection, query, server.PROJECTIONS[projection])
+            print(f"  {label:<30} {before:>12,} B -> {after:>12,} B  (-{100 - after * 100 / before:.0f}%)")
+    finally:
+        await server.users_collection.delete_many({"wallet_public_key": wallet})
+        await server.affiliate_commissions.delete_many({"beneficiary_user_id": wallet})
+        await server.presale_purchases.delete_many({"purchase_id": purchase_id})
+
+
+WRITE_COMMANDS = {"insert", "update", "delete", "findAndModify"}
+
+
+class WriteCounter(monitoring.CommandListener):
+    """Counts write commands per (command, collection)"""
+
+    def __init__(self):
+        self.writes = Counter()
+
+    def started(self, event):
+        if event.command_name in WRITE_COMMANDS:
+            self.writes[(event.command_name, event.command[event.command_name])] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def use_instrumented_client(listener: monitoring.CommandListener):
+    """Rebind every server collection to a client reporting to `listener`"""
+    client = AsyncIOMotorClient(server.MONGO_URL, event_listeners=[listener])
+    database = client[server.db.name]
+    for name, value in list(vars(server).items()):
+        if isinstance(value, AsyncIOMotorCollection):
+            setattr(server, name, database[value.name])
+
+
+async def bench_purchase_writes(size: int):
+    """Write commands per card purchase + callback (embedded transaction, one document path)"""
+    counter = WriteCounter()
+    use_instrumented_client(counter)
+    tag = uuid.uuid4().hex[:8]
+    print(f"purchase_writes: {size} card purchases + callbacks")
+
+    async def fake_wallet(purchase_id: str, host_url: str) -> dict:
+        return {"address_in": f"enc-{purchase_id}", "polygon_address_in": "0xbench"}
+
+    server.generate_card2crypto_wallet = fake_wallet
+    wallets = [f"BENCH_buyer_{tag}_{i}" for i in range(size)]
+    for wallet in wallets:
+        await server.register_affiliate(server.UserCreate(wallet_public_key=wallet))
+
+    class CallbackRequest:
+        def __init__(self, **params):
+            self.query_params = params
+
+    try:
+        counter.writes.clear()
+        start = time.perf_counter()
+        purchase_ids = []
+        for wallet in wallets:
+            response = await server.create_presale_purchase(server.PreSalePurchaseRequest(
+                firstName="Bench", lastName="User", walletAddress=wallet, tokenAmount=500,
+                paymentMethod="card", hostUrl="http://bench.local"
+            ))
+            purchase_ids.append(response.sessionId)
+        purchase_writes = Counter(counter.writes)
+        report("create_presale_purchase", time.perf_counter() - start)
+
+        counter.writes.clear()
+        start = time.perf_counter()
+        for purchase_id in purchase_ids:
+            await server.card2crypto_callback(CallbackRequest(pid=purchase_id, value_coin="100"))
+        callback_writes = Counter(counter.writes)
+        report("card2crypto_callback", time.perf_counter() - start)
+
+        for label, writes in [("purchase", purchase_writes), ("callback", callback_writes)]:
+            total = sum(writes.values())
+            print(f"  {label}: {total / size:.2f} writes per purchase")
+            for (command, collection), count in sorted(writes.items()):
+                print(f"    {command:<14} {collection:<22} {count / size:.2f}")
+    finally:
+        await server.users_collection.delete_many({"wallet_public_key": {"$in": wallets}})
+        await server.presale_purchases.delete_many({"walletAddress": {"$in": wallets}})
+
+
+async def bench_metrics_overhead(size: int):
+    """Per-request cost of the metrics middleware and Mongo command listener, on vs off"""
+    purchase_id = f"bench-{uuid.uuid4().hex[:8]}"
+    await server.presale_purchases.insert_one({
+        "purchase_id": purchase_id, "walletAddress": "BENCH", "tokenAmount": 1000, "totalPrice": 200.0,
+        "paymentMethod": "card", "paymentStatus": "pending"
+    })
+    print(f"metrics_overhead: {size} requests per run, best of 3")
+
+    transport = httpx.ASGITransport(app=server.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            for label, path in [("affiliate_config", "/api/affiliate/config"), ("presale_status", f"/api/presale/status/{purchase_id}")]:
+                for _ in range(100):
+                    await http.get(path)
+
+                best = {}
+                for enabled in [False, True] * 3:
+                    server.METRICS_ENABLED = enabled
+                    start = time.perf_counter()
+                    for _ in range(size):
+                        await http.get(path)
+                    elapsed = time.perf_counter() - start
+                    best[enabled] = min(best.get(enabled, elapsed), elapsed)
+
+                overhead = (best[True] - best[False]) / best[False] * 100
+                report(f"{label} metrics off", best[False], f"{best[False] / size * 1e6:.0f} us/request")
+                report(f"{label} metrics on", best[True], f"{best[True] / size * 1e6:.0f} us/request ({overhead:+.1f}%)")
+    finally:
+        server.METRICS_ENABLED = True
+        await server.presale_purchases.delete_one({"purchase_id": purchase_id})
+
+
+async def bench_affiliate_reads(size: int):
+    """Affiliate read endpoints for the largest downlines of a synthetic dataset of `size` users"""
+    print(f"affiliate_reads: synthetic dataset of {size} users")
+    await generate_mlm_dataset(server.client["quantum_bench"], DatasetShape(size))
+
+    class StatsRequest:
+        base_url = "http://bench.local/"
+        query_params = {}
+
+    try:
+        for row in await top_affiliates(3):
+            wallet = row["_id"]
+            print(f"  {wallet}: {row['direct_referrals']} direct referrals")
+            for label, call in [
+                ("stats", lambda: server.get_affiliate_stats(wallet, StatsRequest())),
+                ("commission history", lambda: server.get_commission_history(wallet)),
+                ("tree (depth 2)", lambda: server.get_affiliate_tree(wallet, max_depth=2)),
+            ]:
+                start = time.perf_counter()
+                with server.user_lookup_scope():
+                    await call()
+                report(label, time.perf_counter() - start)
+    finally:
+        await server.client.drop_database("quantum_bench")
+
+
+BENCHMARKS = {
+    "notifications": (bench_notifications, 100000),
+    "serialization": (bench_serialization, 1000),
+    "projection": (bench_projection, 10000),
+    "purchase_writes": (bench_purchase_writes, 200),
+    "metrics_overhead": (bench_metrics_overhead, 2000),
+    "affiliate_reads": (bench_affiliate_reads, 100000),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a backend benchmark")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--size", type=int, default=None)
+    args = parser.parse_args()
+    benchmark, default_size = BENCHMARKS[args.name]
+    asyncio.run(benchmark(args.size or default_size))
@@ -0,0 +1,324 @@
+"""
+Load test for the Quantum IA backend, modelling real presale traffic.
+
+Starts local stubs for every upstream (upstream_stubs.py) and a local server instance
+pointed at them, on its own database, seeds an affiliate network through the API, then
+runs closed-loop virtual users over the production traffic mix. Reports throughput,
+p50/p95/p99 latency and error rate per endpoint and compares them to a saved baseline.
+
+Run against a local MongoDB only - the instance uses (and drops) its own database.
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python loadtest.py run [--users 50] [--duration 60]
+    MONGO_URL=mongodb://localhost:27017 python loadtest.py run --save-baseline
+    python loadtest.py run --base-url http://staging.local:8001   # existing instance, no stubs
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+
+import httpx
+
+from upstream_stubs import StubBehaviour, StubPack
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_baseline.json")
+LOADTEST_DATABASE = "quantum_loadtest"
+
+
+# ============== LOCAL INSTANCE ==============
+
+def serve(port: int, database: str):
+    """Run the app on a fresh database (upstream base URLs come from the environment)"""
+    import uvicorn
+    from pymongo import MongoClient
+    import server
+    from mlm_dataset import use_database
+
+    MongoClient(server.MONGO_URL).drop_database(database)
+    use_database(server.client[database])
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+async def wait_until_healthy(base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2.0) as http:
+        while True:
+            try:
+                if (await http.get("/api/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Server at {base_url} did not become healthy within {timeout:.0f}s")
+            await asyncio.sleep(0.2)
+
+
+# ============== TRAFFIC MIX ==============
+
+class TrafficState:
+    """Seeded wallets and in-flight card purchases shared by all virtual users"""
+
+    def __init__(self):
+        self.wallets: List[str] = []
+        self.referral_codes: List[str] = []
+        self.pending_purchases: deque = deque()
+        self.purchase_ids: List[str] = []
+
+
+async def seed_network(http: httpx.AsyncClient, state: TrafficState, size: int, rng: random.Random):
+    """Register `size` affiliates through the API, 80% of them referred by an earlier one"""
+    tag = uuid.uuid4().hex[:6]
+    for i in range(size):
+        wallet = f"LOAD{tag}{i:06d}"
+        referrer = rng.choice(state.referral_codes) if state.referral_codes and rng.random() < 0.8 else None
+        response = await http.post("/api/affiliate/register", json={
+            "wallet_public_key": wallet, "referral_code_used": referrer
+        })
+        response.raise_for_status()
+        state.wallets.append(wallet)
+        state.referral_codes.append(response.json()["referral_code"])
+
+
+async def portfolio_balance(http, state, rng):
+    return await http.get(f"/api/solana/balance/{rng.choice(state.wallets)}")
+
+
+async def notification_poll(http, state, rng):
+    return await http.get(f"/api/notifications/{rng.choice(state.wallets)}", params={"limit": 20})
+
+
+async def affiliate_stats(http, state, rng):
+    return await http.get(f"/api/affiliate/{rng.choice(state.wallets)}/stats")
+
+
+async def affiliate_tree(http, state, rng):
+    return await http.get(f"/api/affiliate/{rng.choice(state.wallets)}/tree")
+
+
+async def presale_progress(http, state, rng):
+    return await http.get("/api/presale/progress")
+
+
+async def card_purchase(http, state, rng):
+    index = rng.randrange(len(state.wallets))
+    response = await http.post("/api/presale/purchase", json={
+        "firstName": "Load", "lastName": "Test", "walletAddress": state.wallets[index],
+        "tokenAmount": rng.choice([500, 1000, 5000]), "paymentMethod": "card",
+        "referralCode": state.referral_codes[index], "hostUrl": str(http.base_url).rstrip("/"),
+    })
+    if response.status_code == 200 and response.json().get("sessionId"):
+        state.pending_purchases.append(response.json()["sessionId"])
+        state.purchase_ids.append(response.json()["sessionId"])
+    return response
+
+
+async def purchase_status(http, state, rng):
+    if not state.purchase_ids:
+        return None
+    return await http.get(f"/api/presale/status/{rng.choice(state.purchase_ids)}")
+
+
+async def payment_callback(http, state, rng):
+    if not state.pending_purchases:
+        return None
+    purchase_id = state.pending_purchases.popleft()
+    return await http.get("/api/payments/callback", params={
+        "pid": purchase_id, "value_coin": "100", "coin": "polygon_usdc",
+        "txid_in": f"0xin{uuid.uuid4().hex}", "txid_out": f"0xout{uuid.uuid4().hex}",
+    })
+
+
+# (endpoint, weight, request) - weights follow production request counts per endpoint
+TRAFFIC_MIX = [
+    ("GET /api/solana/balance/{wallet}", 30, portfolio_balance),
+    ("GET /api/notifications/{wallet}", 25, notification_poll),
+    ("GET /api/affiliate/{wallet}/stats", 12, affiliate_stats),
+    ("GET /api/presale/progress", 10, presale_progress),
+    ("GET /api/affiliate/{wallet}/tree", 5, affiliate_tree),
+    ("POST /api/presale/purchase", 6, card_purchase),
+    ("GET /api/presale/status/{purchase_id}", 7, purchase_status),
+    ("GET /api/payments/callback", 5, payment_callback),
+]
+
+
+# ============== RESULTS ==============
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+
+    def record(self, seconds: float, ok: bool):
+        self.latencies.append(seconds)
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, p: float) -> float:
+        """Nearest-rank percentile, in milliseconds"""
+        ordered = sorted(self.latencies)
+        return ordered[max(0, int(round(p / 100 * len(ordered))) - 1)] * 1000 if ordered else 0.0
+
+    def summary(self, duration: float) -> dict:
+        count = len(self.latencies)
+        return {
+            "requests": count,
+            "rps": round(count / duration, 2),
+            "p50_ms": round(self.percentile(50), 1),
+            "p95_ms": round(self.percentile(95), 1),
+            "p99_ms": round(self.percentile(99), 1),
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+        }
+
+
+async def virtual_user(http, state, stats: Dict[str, EndpointStats], deadline: float, think_time: float, seed: int):
+    rng = random.Random(seed)
+    endpoints = [name for name, _, _ in TRAFFIC_MIX]
+    weights = [weight for _, weight, _ in TRAFFIC_MIX]
+    requests = {name: request for name, _, request in TRAFFIC_MIX}
+
+    while time.monotonic() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = await requests[endpoint](http, state, rng)
+        except httpx.HTTPError:
+            stats[endpoint].record(time.perf_counter() - start, False)
+        else:
+            if response is not None:  # nothing to request yet (no purchase to check or pay)
+                stats[endpoint].record(time.perf_counter() - start, response.status_code < 400)
+        await asyncio.sleep(rng.expovariate(1 / think_time) if think_time > 0 else 0)
+
+
+def print_report(results: dict, baseline: Optional[dict]):
+    print(f"  {'endpoint':<42} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for endpoint, row in results["endpoints"].items():
+        line = (
+            f"  {endpoint:<42} {row['requests']:>7} {row['rps']:>8.1f} {row['p50_ms']:>8.1f} "
+            f"{row['p95_ms']:>8.1f} {row['p99_ms']:>8.1f} {row['error_rate'] * 100:>6.2f}%"
+        )
+        base = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if base and base["p95_ms"]:
+            line += f"  (p95 {(row['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100:+.0f}% vs baseline)"
+        print(line)
+    print(f"  total {results['total_rps']:.1f} req/s over {results['duration']:.0f}s with {results['users']} users")
+
+
+def find_regressions(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Endpoints slower, less productive or failing more than the baseline allows"""
+    regressions = []
+    for endpoint, base in baseline.get("endpoints", {}).items():
+        row = results["endpoints"].get(endpoint)
+        if row is None or not row["requests"]:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            if base[key] and row[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{endpoint}: {key} {row[key]:.1f} > {base[key]:.1f} (+{tolerance:.0%} allowed)")
+        if row["error_rate"] > base["error_rate"] + 0.01:
+            regressions.append(f"{endpoint}: error rate {row['error_rate']:.2%} > {base['error_rate']:.2%}")
+        if base["rps"] and row["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{endpoint}: {row['rps']:.1f} req/s < {base['rps']:.1f}")
+    return regressions
+
+
+# ============== RUNNER ==============
+
+async def run_load(base_url: str, users: int, duration: float, think_time: float, wallets: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    state = TrafficState()
+    limits = httpx.Limits(max_connections=users, max_keepalive_connections=users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0, limits=limits) as http:
+        print(f"Seeding {wallets} affiliates...")
+        await seed_network(http, state, wallets, rng)
+
+        print(f"Running {users} users for {duration:.0f}s (mean think time {think_time:.2f}s)...")
+        stats = {endpoint: EndpointStats() for endpoint, _, _ in TRAFFIC_MIX}
+        deadline = time.monotonic() + duration
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            virtual_user(http, state, stats, deadline, think_time, seed + i) for i in range(users)
+        ])
+        elapsed = time.perf_counter() - start
+
+    endpoints = {endpoint: s.summary(elapsed) for endpoint, s in stats.items()}
+    return {
+        "users": users,
+        "duration": round(elapsed, 1),
+        "think_time": think_time,
+        "total_rps": round(sum(e["requests"] for e in endpoints.values()) / elapsed, 2),
+        "endpoints": endpoints,
+    }
+
+
+async def run(args) -> int:
+    if args.base_url:
+        results = await run_load(args.base_url, args.users, args.duration, args.think_time, args.wallets, args.seed)
+    else:
+        behaviour = StubBehaviour(args.stub_latency, args.stub_error_rate, seed=args.seed)
+        async with StubPack(behaviour) as stubs:
+            port = args.port
+            instance = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port)],
+                stdout=subprocess.DEVNULL, env={**os.environ, **stubs.env()},
+            )
+            try:
+                base_url = f"http://127.0.0.1:{port}"
+                await wait_until_healthy(base_url)
+                results = await run_load(base_url, args.users, args.duration, args.think_time, args.wallets, args.seed)
+            finally:
+                instance.terminate()
+                instance.wait()
+            stubs.report()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if baseline:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the backend with the production traffic mix")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the load test and report per-endpoint latency")
+    run_parser.add_argument("--base-url", default=None, help="existing instance to target (default: start one locally)")
+    run_parser.add_argument("--users", type=int, default=50)
+    run_parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    run_parser.add_argument("--think-time", type=float, default=0.5, help="mean seconds between a user's requests")
+    run_parser.add_argument("--wallets", type=int, default=500, help="affiliates seeded before the run")
+    run_parser.add_argument("--seed", type=int, default=42)
+    run_parser.add_argument("--port", type=int, default=8765)
+    run_parser.add_argument("--stub-latency", default="lognormal:20:0.5", help="stub upstream latency spec (ms)")
+    run_parser.add_argument("--stub-error-rate", type=float, default=0.0, help="share of stub upstream calls failing")
+    run_parser.add_argument("--baseline", default=BASELINE_FILE)
+    run_parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    run_parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression vs the baseline")
+
+    serve_parser = commands.add_parser("serve", help="run a local instance on its own database")
+    serve_parser.add_argument("--port", type=int, required=True)
+    serve_parser.add_argument("--database", default=LOADTEST_DATABASE)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args.port, args.database)
+    else:
+        sys.exit(asyncio.run(run(args)))
@@ -0,0 +1,115 @@
+"""
+Data migrations for the Quantum IA backend.
+
+Usage (from backend/, with MONGO_URL set):
+    python migrations.py <name>
+
+Every migration is idempotent and can be re-run safely.
+"""
+import argparse
+import asyncio
+from datetime import timedelta
+
+from pymongo import UpdateOne
+
+from server import (
+    db,
+    notifications_collection,
+    notification_state_collection,
+    presale_purchases,
+    payment_transactions,
+    ensure_indexes,
+    rebuild_affiliate_leaderboard,
+)
+
+# payment_transactions compatibility view: one row per purchase with an embedded transaction
+PAYMENT_TRANSACTIONS_VIEW = [
+    {"$match": {"transaction": {"$exists": True}}},
+    {"$replaceWith": {"$mergeObjects": ["$transaction", {"_id": "$_id", "purchase_id": "$purchase_id"}]}},
+]
+
+
+async def notification_read_watermarks():
+    """
+    Fold per-document read flags into per-wallet read_through watermarks.
+    Every notification older than a wallet's oldest unread one is read, so the
+    watermark is set just before it (or to the newest notification if none is unread).
+    """
+    await ensure_indexes()
+
+    pipeline = [
+        {"$group": {
+            "_id": "$wallet",
+            "newest": {"$max": "$created_at"},
+            "oldest_unread": {"$min": {"$cond": [{"$eq": ["$read", False]}, "$created_at", None]}},
+        }},
+    ]
+
+    wallets = 0
+    async for row in notifications_collection.aggregate(pipeline, allowDiskUse=True):
+        if row["oldest_unread"]:
+            read_through = row["oldest_unread"] - timedelta(milliseconds=1)
+        else:
+            read_through = row["newest"]
+
+        await notification_state_collection.update_one(
+            {"wallet": row["_id"]},
+            {"$max": {"read_through": read_through}},
+            upsert=True
+        )
+        wallets += 1
+
+    print(f"[Migration] notification_read_watermarks: {wallets} wallets updated")
+
+
+async def fold_payment_transactions():
+    """
+    Embed each payment_transactions document into its purchase as `transaction`, keep the
+    old collection as payment_transactions_legacy and replace it with a read-only view.
+    """
+    existing = await db.list_collections(filter={"name": "payment_transactions"}).to_list(length=1)
+    if existing and existing[0].get("type") == "view":
+        print("[Migration] fold_payment_transactions: already a view, nothing to do")
+        return
+
+    folded = 0
+    batch = []
+    async for transaction in payment_transactions.find({}, {"_id": 0}):
+        purchase_id = transaction.pop("purchase_id", None)
+        if not purchase_id:
+            continue
+        batch.append(UpdateOne(
+            {"purchase_id": purchase_id, "transaction": {"$exists": False}},
+            {"$set": {"transaction": transaction}}
+        ))
+        if len(batch) == 1000:
+            folded += (await presale_purchases.bulk_write(batch, ordered=False)).modified_count
+            batch = []
+    if batch:
+        folded += (await presale_purchases.bulk_write(batch, ordered=False)).modified_count
+
+    if existing:
+        await payment_transactions.rename("payment_transactions_legacy", dropTarget=True)
+    await db.command({"create": "payment_transactions", "viewOn": "presale_purchases", "pipeline": PAYMENT_TRANSACTIONS_VIEW})
+
+    print(f"[Migration] fold_payment_transactions: {folded} transactions folded into purchases")
+
+
+async def affiliate_leaderboard():
+    """Build the affiliate leaderboard from existing commissions and relations"""
+    await ensure_indexes()
+    await rebuild_affiliate_leaderboard()
+
+
+MIGRATIONS = {
+    "notification_read_watermarks": notification_read_watermarks,
+    "fold_payment_transactions": fold_payment_transactions,
+    "affiliate_leaderboard": affiliate_leaderboard,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a data migration")
+    parser.add_argument("name", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+    asyncio.run(MIGRATIONS[args.name]())
@@ -0,0 +1,229 @@
+"""
+Synthetic MLM dataset generator for scale benchmarks.
+
+Builds a referral forest with power-law fan-out (preferential attachment: a user is picked
+as referrer with probability proportional to 1 + their direct referrals), so a few affiliates
+own huge downlines and long commission histories, as in production. Relations, commissions
+and notifications are produced by the same document builders as register_affiliate and
+distribute_commissions, and loaded with unordered bulk inserts.
+
+Run against a local MongoDB only - the target database is dropped first.
+Usage (from backend/):
+    MONGO_URL=mongodb://localhost:27017 python mlm_dataset.py --users 1000000 [--database quantum_bench]
+"""
+import argparse
+import asyncio
+import math
+import random
+import string
+import time
+from array import array
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection, AsyncIOMotorDatabase
+
+import server
+
+BATCH_SIZE = 10000
+MAX_IN_FLIGHT = 4  # concurrent insert_many batches
+CODE_ALPHABET = string.digits + string.ascii_uppercase
+
+
+class DatasetShape:
+    """Parameters of the generated forest and purchase history"""
+
+    def __init__(
+        self,
+        users: int,
+        root_share: float = 0.02,
+        max_depth: int = 12,
+        purchase_probability: float = 0.6,
+        purchases_alpha: float = 1.8,
+        mean_purchase_usd: float = 150.0,
+        history_days: int = 365,
+        notifications: bool = False,
+        seed: int = 42,
+    ):
+        self.users = users
+        self.root_share = root_share  # users registering without a referral code
+        self.max_depth = max_depth  # referral chains are capped here (relations still stop at MAX_AFFILIATE_LEVEL)
+        self.purchase_probability = purchase_probability
+        self.purchases_alpha = purchases_alpha  # Pareto tail of purchases per buyer
+        self.mean_purchase_usd = mean_purchase_usd
+        self.history_days = history_days
+        self.notifications = notifications  # also write one commission notification per commission
+        self.seed = seed
+
+
+def synthetic_wallet(index: int) -> str:
+    return f"SYN{index:010d}"
+
+
+def synthetic_referral_code(index: int) -> str:
+    """Unique QTM + 5 base-36 characters, the shape of generate_unique_referral_code"""
+    digits = []
+    for _ in range(5):
+        index, rest = divmod(index, 36)
+        digits.append(CODE_ALPHABET[rest])
+    return "QTM" + "".join(reversed(digits))
+
+
+def build_forest(shape: DatasetShape, rng: random.Random) -> Tuple[array, array]:
+    """
+    Referrer index per user (-1 for roots) and depth per user.
+    Preferential attachment: every user enters the candidate pool once, plus once per referral.
+    """
+    referrers = array("i", [-1]) * shape.users
+    depths = array("b", [0]) * shape.users
+    candidates = array("i")
+    for user in range(shape.users):
+        if candidates and rng.random() >= shape.root_share:
+            referrer = candidates[int(rng.random() * len(candidates))]
+            while depths[referrer] >= shape.max_depth:
+                referrer = referrers[referrer]
+            referrers[user] = referrer
+            depths[user] = depths[referrer] + 1
+            candidates.append(referrer)
+        candidates.append(user)
+    return referrers, depths
+
+
+def ancestors_of(user: int, referrers: array) -> List[int]:
+    """Nearest first, up to MAX_AFFILIATE_LEVEL (the relations create_affiliate_relations writes)"""
+    chain = []
+    ancestor = referrers[user]
+    while ancestor >= 0 and len(chain) < server.MAX_AFFILIATE_LEVEL:
+        chain.append(ancestor)
+        ancestor = referrers[ancestor]
+    return chain
+
+
+def generate_documents(shape: DatasetShape) -> Iterator[Tuple[str, dict]]:
+    """(collection name, document) for every user, relation, commission and notification"""
+    rng = random.Random(shape.seed)
+    referrers, _ = build_forest(shape, rng)
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=shape.history_days)
+    step = timedelta(days=shape.history_days) / max(shape.users, 1)
+
+    for user in range(shape.users):
+        wallet = synthetic_wallet(user)
+        registered_at = start + user * step
+        referrer = referrers[user]
+        yield server.users_collection.name, {
+            "wallet_public_key": wallet,
+            "referral_code": synthetic_referral_code(user),
+            "referrer_id": synthetic_wallet(referrer) if referrer >= 0 else None,
+            "created_at": registered_at,
+        }
+        ancestors = ancestors_of(user, referrers)
+        for level, ancestor in enumerate(ancestors, start=1):
+            yield server.affiliate_relations.name, server.affiliate_relation_doc(
+                wallet, synthetic_wallet(ancestor), level, registered_at
+            )
+
+        if not ancestors or rng.random() >= shape.purchase_probability:
+            continue
+        purchases = min(int(rng.paretovariate(shape.purchases_alpha)), 1000)
+        for _ in range(purchases):
+            amount = round(rng.lognormvariate(math.log(shape.mean_purchase_usd) - 0.5, 1.0), 2)
+            paid_at = registered_at + (now - registered_at) * rng.random()
+            event_id = f"syn-{rng.getrandbits(64):016x}"
+            for level, ancestor in enumerate(ancestors, start=1):
+                commission = server.commission_doc(wallet, amount, level, server.EventType.PRESALE_PURCHASE.value, paid_at)
+                commission.update({"event_id": event_id, "beneficiary_user_id": synthetic_wallet(ancestor), "level": level})
+                yield server.affiliate_commissions.name, commission
+                if shape.notifications:
+                    notification = server.commission_notification_doc(synthetic_wallet(ancestor), wallet, amount, level, paid_at)
+                    notification["notification_id"] = f"{event_id}:commission:{level}"
+                    yield server.notifications_collection.name, notification
+
+
+async def load_documents(database: AsyncIOMotorDatabase, documents: Iterator[Tuple[str, dict]]) -> Dict[str, int]:
+    """Unordered insert_many per collection in BATCH_SIZE batches, MAX_IN_FLIGHT at a time"""
+    counts: Dict[str, int] = {}
+    batches: Dict[str, list] = {}
+    in_flight: set = set()
+
+    async def flush(name: str):
+        batch = batches.pop(name)
+        if len(in_flight) >= MAX_IN_FLIGHT:
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            in_flight.difference_update(done)
+            for task in done:
+                task.result()
+        in_flight.add(asyncio.create_task(database[name].insert_many(batch, ordered=False)))
+
+    for name, document in documents:
+        batches.setdefault(name, []).append(document)
+        counts[name] = counts.get(name, 0) + 1
+        if len(batches[name]) >= BATCH_SIZE:
+            await flush(name)
+    for name in list(batches):
+        await flush(name)
+    for task in in_flight:
+        await task
+    return counts
+
+
+def use_database(database: AsyncIOMotorDatabase):
+    """Point every server collection at `database`, so server code and benchmarks read the dataset"""
+    server.db = database
+    for name, value in list(vars(server).items()):
+        if isinstance(value, AsyncIOMotorCollection):
+            setattr(server, name, database[value.name])
+
+
+async def generate_mlm_dataset(database: AsyncIOMotorDatabase, shape: DatasetShape) -> Dict[str, int]:
+    """Drop `database`, load a synthetic dataset of `shape` into it and create the server indexes"""
+    await database.client.drop_database(database.name)
+    use_database(database)
+
+    start = time.perf_counter()
+    counts = await load_documents(database, generate_documents(shape))
+    loaded = time.perf_counter() - start
+    total = sum(counts.values())
+    print(f"  loaded {total:,} documents in {loaded:.1f}s ({total / loaded:,.0f}/s)")
+    for name, count in sorted(counts.items()):
+        print(f"    {name:<24} {count:>12,}")
+
+    start = time.perf_counter()
+    await server.ensure_indexes()
+    print(f"  indexes built in {time.perf_counter() - start:.1f}s")
+    return counts
+
+
+async def top_affiliates(limit: int = 5) -> List[dict]:
+    """Largest downlines in the active dataset: wallets to point benchmarks at"""
+    return await server.affiliate_relations.aggregate([
+        {"$match": {"level": 1}},
+        {"$group": {"_id": "$ancestor_id", "direct_referrals": {"$sum": 1}}},
+        {"$sort": {"direct_referrals": -1}},
+        {"$limit": limit},
+    ]).to_list(length=limit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic MLM dataset")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--database", default="quantum_bench")
+    parser.add_argument("--root-share", type=float, default=0.02)
+    parser.add_argument("--max-depth", type=int, default=12)
+    parser.add_argument("--purchase-probability", type=float, default=0.6)
+    parser.add_argument("--notifications", action="store_true", help="also write commission notifications")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    shape = DatasetShape(
+        args.users, root_share=args.root_share, max_depth=args.max_depth,
+        purchase_probability=args.purchase_probability, notifications=args.notifications, seed=args.seed,
+    )
+
+    async def main():
+        print(f"mlm_dataset: {args.users:,} users into {args.database}")
+        await generate_mlm_dataset(server.client[args.database], shape)
+        for row in await top_affiliates():
+            print(f"    top affiliate {row['_id']}: {row['direct_referrals']:,} direct referrals")
+
+    asyncio.run(main())
@@ -1,18 +1,37 @@
-from fastapi import FastAPI, HTTPException, Request, Header
+from fastapi import FastAPI, HTTPException, Request, Header, BackgroundTasks, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, ORJSONResponse, Response
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import OperationFailure, DuplicateKeyError, CollectionInvalid
 from pydantic import BaseModel, Field
 from typing import Optional, Dict, List
 from datetime import datetime, timezone, timedelta
 from enum import Enum
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import OrderedDict
+import asyncio
+import json
 import os
+import statistics
+import time
 import uuid
 import httpx
 import secrets
 import string
 import urllib.parse
+import websockets
 from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from opentelemetry import trace
+from opentelemetry.trace import SpanKind, StatusCode
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
 
 # Load environment variables
 load_dotenv()
@@ -28,14 +47,436 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def request_scoped_user_lookups(request: Request, call_next):
+    """Deduplicate and batch user lookups within each request"""
+    with user_lookup_scope():
+        return await call_next(request)
+
+
+# ============== METRICS ==============
+
+# Prometheus metrics, served at /metrics. With several workers set PROMETHEUS_MULTIPROC_DIR.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+MONGO_SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "100"))
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "API request latency per route template", ["method", "route", "status"]
+)
+MONGO_COMMAND_DURATION = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency per collection, command and calling endpoint",
+    ["collection", "command", "endpoint"]
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "mongo_command_failures_total", "Failed MongoDB commands per collection and command", ["collection", "command"]
+)
+MONGO_SLOW_COMMANDS = Counter(
+    "mongo_slow_commands_total", "MongoDB commands slower than MONGO_SLOW_QUERY_MS", ["collection", "command", "endpoint"]
+)
+MONGO_COMMANDS_PER_REQUEST = Histogram(
+    "mongo_commands_per_request", "MongoDB commands issued per API request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+)
+UPSTREAM_REQUEST_DURATION = Histogram(
+    "upstream_request_duration_seconds", "Outbound HTTP latency (to response headers) per upstream host", ["upstream", "status"]
+)
+UPSTREAM_REQUEST_ERRORS = Counter(
+    "upstream_request_errors_total", "Outbound HTTP failures and error statuses per upstream host", ["upstream", "reason"]
+)
+UPSTREAM_CIRCUIT_STATE = Gauge(
+    "upstream_circuit_state", "Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)", ["upstream"],
+    multiprocess_mode="livemax"
+)
+UPSTREAM_REJECTED = Counter(
+    "upstream_rejected_total", "Upstream calls failed fast without a request", ["upstream", "reason"]
+)
+SOL_PRICE_USD = Gauge("sol_price_usd", "SOL/USD price served by the price feed", multiprocess_mode="livemax")
+SOL_PRICE_UPDATED = Gauge(
+    "sol_price_updated_timestamp_seconds", "Unix time of the last SOL price update (age = time() - this)",
+    multiprocess_mode="livemax"
+)
+SOL_PRICE_DISAGREEMENT = Gauge(
+    "sol_price_source_disagreement_ratio", "Spread of the fresh SOL quotes relative to their median",
+    multiprocess_mode="livemax"
+)
+SOL_PRICE_OUTLIERS = Counter("sol_price_outliers_total", "SOL quotes rejected as outliers per source", ["source"])
+CACHE_REQUESTS = Counter("cache_requests_total", "In-process cache lookups", ["cache", "result"])
+USER_CACHE_HIT = CACHE_REQUESTS.labels("user", "hit")  # bound once, UserCache.get is on the hot path
+USER_CACHE_MISS = CACHE_REQUESTS.labels("user", "miss")
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware recording latency per route template (bounded label cardinality)"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        
+        status = [500]
+        
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+        
+        start = time.perf_counter()
+        with mongo_query_scope(scope=scope) as queries:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = getattr(scope.get("route"), "path", "unmatched")
+                HTTP_REQUEST_DURATION.labels(scope["method"], route, str(status[0])).observe(time.perf_counter() - start)
+                MONGO_COMMANDS_PER_REQUEST.labels(route).observe(queries.count)
+
+
+app.add_middleware(RequestMetricsMiddleware)
+
+
+class QueryCounter:
+    """MongoDB commands issued on behalf of one API request or background worker"""
+    
+    def __init__(self, endpoint: str = "background", scope: Optional[dict] = None):
+        self._endpoint = endpoint
+        self._scope = scope
+        self.count = 0
+    
+    @property
+    def endpoint(self) -> str:
+        # For requests the route template is only known once routing has run
+        if self._scope is not None:
+            return getattr(self._scope.get("route"), "path", "unmatched")
+        return self._endpoint
+
+
+# Motor runs pymongo in executor threads with a copy of the caller's context, so the
+# command listener sees the counter of the request (or worker) that issued the command
+_query_counter: ContextVar[Optional[QueryCounter]] = ContextVar("query_counter", default=None)
+
+
+@contextmanager
+def mongo_query_scope(endpoint: str = "background", scope: Optional[dict] = None):
+    """Attribute and count the MongoDB commands issued within the block"""
+    counter = QueryCounter(endpoint, scope)
+    token = _query_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _query_counter.reset(token)
+
+
+def command_collection(command_name: str, command: dict) -> str:
+    """Collection targeted by a command: the value of the command-name key for CRUD commands"""
+    target = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return target if isinstance(target, str) else "-"
+
+
+def query_shape(value):
+    """Redact every value of a filter/pipeline, keeping field names and operators"""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        shapes = []
+        for item in value:
+            shape = query_shape(item)
+            if shape not in shapes:
+                shapes.append(shape)
+        return shapes
+    return "?"
+
+
+SHAPED_COMMAND_FIELDS = ("filter", "query", "pipeline", "sort", "projection", "updates", "deletes")
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """
+    pymongo command monitoring: latency and failures per collection, command and calling endpoint,
+    per-request command counts, and a log of slow commands with their redacted shape.
+    """
+    
+    def __init__(self):
+        self._pending: Dict[tuple, tuple] = {}
+    
+    def started(self, event):
+        if not METRICS_ENABLED:
+            return
+        counter = _query_counter.get()
+        if counter is not None:
+            counter.count += 1
+        self._pending[(event.connection_id, event.request_id)] = (
+            command_collection(event.command_name, event.command),
+            counter.endpoint if counter is not None else "background",
+            event.command
+        )
+    
+    def _finished(self, event) -> Optional[tuple]:
+        pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return None
+        collection, endpoint, command = pending
+        MONGO_COMMAND_DURATION.labels(collection, event.command_name, endpoint).observe(event.duration_micros / 1e6)
+        
+        duration_ms = event.duration_micros / 1000
+        if duration_ms >= MONGO_SLOW_QUERY_MS:
+            MONGO_SLOW_COMMANDS.labels(collection, event.command_name, endpoint).inc()
+            shape = {k: query_shape(command[k]) for k in SHAPED_COMMAND_FIELDS if k in command}
+            print(f"[Mongo] Slow {event.command_name} on {collection} from {endpoint} ({duration_ms:.0f} ms): {shape}")
+        return pending
+    
+    def succeeded(self, event):
+        self._finished(event)
+    
+    def failed(self, event):
+        pending = self._finished(event)
+        if pending is not None:
+            MONGO_COMMAND_FAILURES.labels(pending[0], event.command_name).inc()
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """httpx transport recording latency and errors per upstream host"""
+    
+    def __init__(self, **kwargs):
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        upstream = request.url.host
+        guard = upstream_guard(request.url)
+        with tracer.start_as_current_span(f"HTTP {request.method}", kind=SpanKind.CLIENT, attributes={
+            "http.request.method": request.method, "server.address": upstream
+        }) as span:
+            if guard is not None:
+                guard.acquire()
+            start = time.perf_counter()
+            try:
+                response = await self._transport.handle_async_request(request)
+            except Exception as e:
+                UPSTREAM_REQUEST_ERRORS.labels(upstream, type(e).__name__).inc()
+                if guard is not None:
+                    guard.record(success=False)
+                raise
+            UPSTREAM_REQUEST_DURATION.labels(upstream, str(response.status_code)).observe(time.perf_counter() - start)
+            span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 400:
+                UPSTREAM_REQUEST_ERRORS.labels(upstream, f"http_{response.status_code}").inc()
+                span.set_status(StatusCode.ERROR)
+            if guard is not None:
+                guard.record(success=response.status_code != 429 and response.status_code < 500)
+            return response
+    
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def upstream_client(timeout: float) -> httpx.AsyncClient:
+    """httpx client for calls to external services (Solana RPC, CoinGecko, Binance, Card2Crypto)"""
+    return httpx.AsyncClient(timeout=timeout, transport=InstrumentedTransport())
+
+
+mongo_metrics_listener = MongoMetricsListener()
+mongo_event_listeners = [mongo_metrics_listener]
+
+
+# ============== TRACING ==============
+
+# OpenTelemetry spans for API routes, MongoDB commands and upstream HTTP calls.
+# TRACING_EXPORTER: "otlp" (collector at OTEL_EXPORTER_OTLP_ENDPOINT, default http://localhost:4318),
+# "file" (one JSON span per line in TRACING_FILE, for offline analysis) or "none".
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+# Share of new traces recorded; requests arriving with a sampled parent are always recorded
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "0.05"))
+
+
+def build_tracer_provider(exporter_name: str, sample_ratio: float, path: str = TRACING_FILE) -> Optional[TracerProvider]:
+    """Tracer provider batching spans to the chosen exporter, None when tracing is off"""
+    if exporter_name == "otlp":
+        exporter = OTLPSpanExporter()
+    elif exporter_name == "file":
+        exporter = ConsoleSpanExporter(out=open(path, "a"), formatter=lambda span: span.to_json(indent=None) + "\n")
+    else:
+        return None
+    
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "quantum-backend")}),
+        sampler=ParentBased(TraceIdRatioBased(sample_ratio)),
+    )
+    provider.add_span_processor(BatchSpanProcessor(exporter))
+    return provider
+
+
+def upstream_host(url: str) -> str:
+    """Host part of an upstream URL (RPC paths and queries may carry API keys)"""
+    return httpx.URL(url).host
+
+
+@contextmanager
+def rpc_span(method: str, endpoint: str, **attributes):
+    """Span for one JSON-RPC attempt against one endpoint; exceptions raised inside are recorded"""
+    with tracer.start_as_current_span(f"solana_rpc {method}", kind=SpanKind.CLIENT, attributes={
+        "rpc.system": "jsonrpc", "rpc.method": method, "rpc.endpoint": upstream_host(endpoint), **attributes
+    }) as span:
+        yield span
+
+
+class MongoTracingListener(monitoring.CommandListener):
+    """One client span per MongoDB command, child of the request or worker span that issued it"""
+    
+    def __init__(self):
+        self._spans: Dict[tuple, trace.Span] = {}
+    
+    def started(self, event):
+        span = tracer.start_span(f"mongo {event.command_name}", kind=SpanKind.CLIENT)
+        if not span.is_recording():
+            return
+        command = event.command
+        span.set_attributes({
+            "db.system": "mongodb",
+            "db.namespace": event.database_name,
+            "db.collection.name": command_collection(event.command_name, command),
+            "db.operation.name": event.command_name,
+            "db.query.text": str({k: query_shape(command[k]) for k in SHAPED_COMMAND_FIELDS if k in command}),
+            "server.address": str(event.connection_id[0]),
+        })
+        self._spans[(event.connection_id, event.request_id)] = span
+    
+    def succeeded(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end()
+    
+    def failed(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.set_status(StatusCode.ERROR, str(event.failure.get("errmsg", "")))
+            span.end()
+
+
+tracer_provider = build_tracer_provider(TRACING_EXPORTER, TRACING_SAMPLE_RATIO)
+if tracer_provider is not None:
+    trace.set_tracer_provider(tracer_provider)
+    FastAPIInstrumentor.instrument_app(
+        app, tracer_provider=tracer_provider, excluded_urls="/metrics", exclude_spans=["receive", "send"]
+    )
+    mongo_event_listeners.append(MongoTracingListener())
+tracer = trace.get_tracer("quantum.backend")
+
+
+# ============== UPSTREAM GUARDS ==============
+
+# Rate limiting and circuit breaking for the price APIs and each Solana RPC endpoint, so a
+# throttled or failing upstream is skipped at once (callers fall back to cached values)
+# instead of every request waiting for its timeout.
+UPSTREAM_RATE_LIMITS = {  # requests per second, burst
+    "coingecko": (0.5, 5),  # public API: ~30 calls/minute
+    "binance": (10, 20),
+    "coinbase": (10, 20),
+    "solana": (10, 40),  # per RPC endpoint
+}
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))  # consecutive failures to open
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))  # seconds open before a probe
+
+CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN = 0, 1, 2
+
+
+class UpstreamUnavailable(httpx.TransportError):
+    """Raised instead of sending a request the upstream's guard rejects"""
+
+
+class UpstreamGuard:
+    """
+    Token bucket plus circuit breaker for one upstream.
+    The breaker opens after `failure_threshold` consecutive failures (errors, 429, 5xx) and,
+    `reset_seconds` later, lets a single probe through: success closes it, failure re-opens it.
+    """
+    
+    def __init__(self, name: str, rate: float, burst: int, failure_threshold: int, reset_seconds: float):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.set_state(CIRCUIT_CLOSED)
+    
+    def set_state(self, state: int):
+        self.state = state
+        UPSTREAM_CIRCUIT_STATE.labels(self.name).set(state)
+    
+    def reject(self, reason: str):
+        UPSTREAM_REJECTED.labels(self.name, reason).inc()
+        raise UpstreamUnavailable(f"{self.name}: {reason}")
+    
+    def acquire(self):
+        """Admit one request or raise UpstreamUnavailable"""
+        now = time.monotonic()
+        if self.state == CIRCUIT_OPEN:
+            if now - self.opened_at < self.reset_seconds:
+                self.reject("circuit_open")
+            self.set_state(CIRCUIT_HALF_OPEN)
+        if self.state == CIRCUIT_HALF_OPEN:
+            if self.probing:
+                self.reject("circuit_open")
+            self.probing = True
+        
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if self.tokens < 1:
+            self.probing = False
+            self.reject("rate_limited")
+        self.tokens -= 1
+    
+    def record(self, success: bool):
+        self.probing = False
+        if success:
+            self.failures = 0
+            if self.state != CIRCUIT_CLOSED:
+                print(f"[Upstream] {self.name} recovered, circuit closed")
+                self.set_state(CIRCUIT_CLOSED)
+            return
+        
+        self.failures += 1
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != CIRCUIT_OPEN:
+                print(f"[Upstream] {self.name} failing ({self.failures} consecutive), circuit open for {self.reset_seconds:.0f}s")
+            self.opened_at = time.monotonic()
+            self.set_state(CIRCUIT_OPEN)
+
+
+_upstream_guards: Dict[str, Optional[UpstreamGuard]] = {}
+
+
+def upstream_guard(url: httpx.URL) -> Optional[UpstreamGuard]:
+    """Guard for the upstream serving `url` (one per Solana endpoint), None for unguarded hosts"""
+    netloc = url.netloc.decode()
+    if netloc not in _upstream_guards:
+        kinds = {httpx.URL(base).netloc.decode(): kind for kind, base in (
+            ("coingecko", COINGECKO_API_BASE), ("binance", BINANCE_API_BASE), ("coinbase", COINBASE_API_BASE)
+        )}
+        kinds.update({httpx.URL(endpoint).netloc.decode(): "solana" for endpoint in SOLANA_RPC_ENDPOINTS})
+        kind = kinds.get(netloc)
+        if kind is None:
+            _upstream_guards[netloc] = None
+        else:
+            rate, burst = UPSTREAM_RATE_LIMITS[kind]
+            name = f"solana {netloc}" if kind == "solana" else kind
+            _upstream_guards[netloc] = UpstreamGuard(name, rate, burst, UPSTREAM_BREAKER_FAILURES, UPSTREAM_BREAKER_RESET)
+    return _upstream_guards[netloc]
+
+
 # MongoDB Configuration
 MONGO_URL = os.getenv("MONGO_URL")
-client = AsyncIOMotorClient(MONGO_URL)
+client = AsyncIOMotorClient(MONGO_URL, event_listeners=mongo_event_listeners)
 db = client.quantum_db
 
 # Collections
 presale_purchases = db.presale_purchases
-payment_transactions = db.payment_transactions
+payment_transactions = db.payment_transactions  # read-only view over presale_purchases.transaction (see migrations.py)
 referral_data = db.referral_data
 wallet_sessions = db.wallet_sessions
 
@@ -43,24 +484,62 @@ wallet_sessions = db.wallet_sessions
 users_collection = db.users
 affiliate_relations = db.affiliate_relations
 affiliate_commissions = db.affiliate_commissions
+affiliate_leaderboard = db.affiliate_leaderboard  # per wallet and time window totals, see record_leaderboard
 
 # Notification & Presale Collections
 notifications_collection = db.notifications
+notification_state_collection = db.notification_state
 push_tokens_collection = db.push_tokens
 presale_config_collection = db.presale_config
+presale_progress_history = db.presale_progress_history  # time-series, one point per progress refresh
+card2crypto_wallet_pool = db.card2crypto_wallet_pool
+chain_cursors = db.chain_cursors
+treasury_balances = db.treasury_balances
+treasury_ledger = db.treasury_ledger
 
 # Card2Crypto Configuration (replaces Stripe)
 CARD2CRYPTO_PAYOUT_WALLET = "0xA4014c46D420409b5Ef2eb9862a64F74690863C7"  # USDC Polygon wallet
-CARD2CRYPTO_API_BASE = "https://api.card2crypto.org/control"
+CARD2CRYPTO_API_BASE = os.getenv("CARD2CRYPTO_API_BASE", "https://api.card2crypto.org/control")
 CARD2CRYPTO_PAY_BASE = "https://pay.card2crypto.org"
 SOLANA_WALLET_ADDRESS = "2ebxzttJ5zyLme4cBBHD8hKkVho4tJ13tUUWu3B3aG5i"
 
+# Optional pool of pre-generated Card2Crypto wallets (0 disables it).
+# Hosts must be listed since the callback URL encrypted into each wallet embeds the host.
+CARD2CRYPTO_POOL_SIZE = int(os.getenv("CARD2CRYPTO_POOL_SIZE", "0"))
+CARD2CRYPTO_POOL_HOSTS = [h.strip().rstrip('/') for h in os.getenv("CARD2CRYPTO_POOL_HOSTS", "").split(",") if h.strip()]
+CARD2CRYPTO_POOL_MAX_AGE = 86400  # discard pooled wallets older than a day
+CARD2CRYPTO_POOL_REFILL_INTERVAL = 60
+
 # Solana Configuration
 QUANTUM_MINT = "4KsZXRH3Xjd7z4CiuwgfNQstC2aHDLdJHv5u3tDixtLc"
-SOLANA_RPC_ENDPOINTS = [
-    "https://api.mainnet-beta.solana.com",
-    "https://solana-mainnet.g.alchemy.com/v2/demo",
-]
+# Tried in order; SOLANA_RPC_URLS (comma-separated) overrides them, e.g. for local stubs (upstream_stubs.py)
+SOLANA_RPC_ENDPOINTS = [u.strip() for u in os.getenv(
+    "SOLANA_RPC_URLS", "https://api.mainnet-beta.solana.com,https://solana-mainnet.g.alchemy.com/v2/demo"
+).split(",") if u.strip()]
+USDC_MINT = "EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v"
+USDT_MINT = "Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB"
+
+# Price APIs
+COINGECKO_API_BASE = os.getenv("COINGECKO_API_BASE", "https://api.coingecko.com/api/v3")
+BINANCE_API_BASE = os.getenv("BINANCE_API_BASE", "https://api.binance.com/api/v3")
+COINBASE_API_BASE = os.getenv("COINBASE_API_BASE", "https://api.coinbase.com/v2")
+
+# SOL/USD feed: every source polled concurrently in the background, median of the agreeing quotes.
+# SOL_PRICE_STREAM also subscribes to the Binance ticker so the price follows the market between polls.
+SOL_PRICE_REFRESH_INTERVAL = int(os.getenv("SOL_PRICE_REFRESH_INTERVAL", "30"))  # seconds, 0 = refresh on demand
+SOL_PRICE_MAX_AGE = 300  # quotes older than this are ignored; a price older than this is refreshed on read
+SOL_PRICE_MAX_DEVIATION = float(os.getenv("SOL_PRICE_MAX_DEVIATION", "0.02"))  # outlier distance from the median
+SOL_PRICE_STREAM = os.getenv("SOL_PRICE_STREAM", "false").lower() == "true"
+BINANCE_STREAM_URL = os.getenv("BINANCE_STREAM_URL", "wss://stream.binance.com:9443/ws/solusdt@ticker")
+
+# On-chain payment scanner (crypto purchases paid to SOLANA_WALLET_ADDRESS)
+CHAIN_SCANNER_INTERVAL = int(os.getenv("CHAIN_SCANNER_INTERVAL", "60"))  # seconds, 0 disables
+CHAIN_SCANNER_PAGE_SIZE = 100  # signatures per getSignaturesForAddress page
+CHAIN_SCANNER_TX_BATCH = 25  # getTransaction calls per JSON-RPC batch
+CHAIN_PAYMENT_TOLERANCE = {"SOL": 0.05, "USDC": 0.01, "USDT": 0.01}  # relative to the purchase price
+
+# Treasury ledger: balances maintained from scanned deltas, fully re-valued on chain periodically
+TREASURY_RECONCILE_INTERVAL = int(os.getenv("TREASURY_RECONCILE_INTERVAL", "21600"))  # 6 hours
 
 # Token Configuration
 TOKEN_PRICE = 0.20  # USD per token
@@ -76,6 +555,22 @@ COMMISSION_RATES = {
 }
 MAX_AFFILIATE_LEVEL = 5
 
+# Process-wide user cache (users are immutable once registered)
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "100000"))
+USER_CACHE_NEGATIVE_TTL = float(os.getenv("USER_CACHE_NEGATIVE_TTL", "60"))
+
+# Notifications: max documents touched per bulk write
+NOTIFICATION_BATCH_SIZE = 1000
+
+# Payment outbox worker (side effects of a confirmed payment)
+OUTBOX_POLL_INTERVAL = 5  # seconds between sweeps when not woken up
+OUTBOX_LEASE_SECONDS = 60  # a claimed event is retried once its lease expires
+OUTBOX_MAX_ATTEMPTS = 10
+
+# Long-polling of purchase status (checkout return page)
+PURCHASE_STATUS_MAX_WAIT = 30  # seconds a status request may be held
+PURCHASE_STATUS_POLL_INTERVAL = 2  # cross-worker fallback when change streams are unavailable
+
 
 # ============== ENUMS ==============
 
@@ -196,6 +691,20 @@ class CreateCommissionResponse(BaseModel):
     message: str
 
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    wallet_public_key: str
+    earnings: float
+    referrals: int
+
+
+class LeaderboardResponse(BaseModel):
+    metric: str
+    window: str
+    period: str
+    entries: List[LeaderboardEntry]
+
+
 # ============== MLM UTILITY FUNCTIONS ==============
 
 def generate_unique_referral_code() -> str:
@@ -204,20 +713,382 @@ def generate_unique_referral_code() -> str:
     return 'QTM' + ''.join(secrets.choice(chars) for _ in range(5))
 
 
-async def get_user_by_wallet(wallet: str) -> Optional[dict]:
-    """Get user by wallet address"""
-    return await users_collection.find_one(
-        {"wallet_public_key": wallet},
-        {"_id": 0}
-    )
+# Projection registry: every read names the fields it actually uses
+PROJECTIONS = {
+    # users
+    "exists": {"_id": 1},
+    "user": {"_id": 0, "wallet_public_key": 1, "referral_code": 1, "referrer_id": 1, "created_at": 1},
+    "user_wallet": {"_id": 0, "wallet_public_key": 1},
+    "user_referral_code": {"_id": 0, "referral_code": 1},
+    "user_referrer": {"_id": 0, "referrer_id": 1},
+    # affiliate_relations
+    "relation_ancestor": {"_id": 0, "ancestor_id": 1, "level": 1},
+    "relation_user": {"_id": 0, "user_id": 1},
+    # affiliate_commissions
+    "commission_entry": {
+        "_id": 0, "commission_id": 1, "source_user_id": 1, "level": 1, "percentage": 1,
+        "amount": 1, "event_type": 1, "event_id": 1, "status": 1, "created_at": 1
+    },
+    "commission_totals": {"_id": 0, "amount": 1, "status": 1},
+    "commission_amount": {"_id": 0, "amount": 1},
+    # affiliate_leaderboard
+    "leaderboard_entry": {"_id": 0, "wallet": 1, "earnings": 1, "referrals": 1},
+    # notifications
+    "notification": {
+        "_id": 0, "notification_id": 1, "type": 1, "title": 1, "body": 1,
+        "data": 1, "read": 1, "created_at": 1
+    },
+    "notification_state": {"_id": 0, "read_through": 1, "cleared_through": 1},
+    # wallet_sessions
+    "wallet_session": {"_id": 0, "keypair": 1, "expires_at": 1},
+    # presale_purchases
+    "purchase_outbox": {
+        "_id": 0, "purchase_id": 1, "walletAddress": 1, "totalPrice": 1, "tokenAmount": 1,
+        "referralCode": 1, "outbox": 1
+    },
+    "purchase_status": {
+        "_id": 0, "paymentStatus": 1, "totalPrice": 1, "tokenAmount": 1, "paymentMethod": 1,
+        "card2crypto_txid_out": 1, "firstName": 1, "walletAddress": 1
+    },
+    "purchase_payment_match": {"_id": 0, "purchase_id": 1, "walletAddress": 1, "totalPrice": 1},
+    "purchase_created": {"_id": 0, "createdAt": 1},
+    "purchase_onchain_signature": {"_id": 0, "onchain_signature": 1},
+    # chain_cursors
+    "chain_cursor": {"_id": 0, "signature": 1},
+    # treasury_balances / treasury_ledger
+    "treasury_state": {"_id": 0, "balances": 1, "prices": 1, "baseline_slot": 1, "reconciled_at": 1},
+    "treasury_history": {
+        "_id": 0, "kind": 1, "signature": 1, "block_time": 1, "usd_delta": 1, "raised_usd": 1, "drift_usd": 1
+    },
+    # card2crypto_wallet_pool
+    "card2crypto_pool_entry": {"_id": 0, "purchase_id": 1, "address_in": 1, "polygon_address_in": 1},
+    # referral_data
+    "referral_stats": {
+        "_id": 0, "walletAddress": 1, "referralCode": 1, "referrals": 1, "totalPurchased": 1,
+        "commissionEarned": 1, "commissionPending": 1, "commissionPaid": 1
+    },
+    # presale_config
+    "presale_participants": {"_id": 0, "participants": 1},
+}
 
 
-async def get_user_by_referral_code(code: str) -> Optional[dict]:
-    """Get user by referral code"""
-    return await users_collection.find_one(
-        {"referral_code": code.upper()},
-        {"_id": 0}
-    )
+def commission_entry_row(c: dict) -> dict:
+    """Map a commission document to the CommissionEntry shape (datetimes encoded by orjson)"""
+    return {
+        "id": c.get("commission_id") or str(uuid.uuid4()),
+        "source_user_wallet": c["source_user_id"],
+        "level": c["level"],
+        "percentage": c["percentage"],
+        "amount": c["amount"],
+        "event_type": c["event_type"],
+        "event_id": c["event_id"],
+        "status": c["status"],
+        "created_at": c["created_at"]
+    }
+
+
+class UserCache:
+    """
+    Process-wide LRU cache of user documents, keyed by wallet and by referral code.
+    Users are immutable once inserted (wallet, referral_code, referrer_id, created_at),
+    so positive entries never go stale and each worker can keep its own copy safely.
+    Misses are cached with a short TTL only, and are never trusted for registration
+    since another worker may have inserted the user since.
+    """
+    
+    def __init__(self, max_size: int, negative_ttl: float):
+        self.max_size = max_size
+        self.negative_ttl = negative_ttl
+        self._entries: OrderedDict = OrderedDict()  # (field, key) -> (user, expires_at)
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, field: str, key: str) -> tuple:
+        """Return (found, user); user is None for a cached miss"""
+        entry = self._entries.get((field, key))
+        if entry is None:
+            self.misses += 1
+            USER_CACHE_MISS.inc()
+            return (False, None)
+        
+        user, expires_at = entry
+        if expires_at and expires_at < time.monotonic():
+            del self._entries[(field, key)]
+            self.misses += 1
+            USER_CACHE_MISS.inc()
+            return (False, None)
+        
+        self._entries.move_to_end((field, key))
+        self.hits += 1
+        USER_CACHE_HIT.inc()
+        return (True, user)
+    
+    def _set(self, field: str, key: str, user: Optional[dict], expires_at: float):
+        if self.max_size <= 0:
+            return
+        self._entries[(field, key)] = (user, expires_at)
+        self._entries.move_to_end((field, key))
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def put(self, user: dict):
+        self._set("wallet_public_key", user["wallet_public_key"], user, 0)
+        self._set("referral_code", user["referral_code"], user, 0)
+    
+    def put_missing(self, field: str, key: str):
+        self._set(field, key, None, time.monotonic() + self.negative_ttl)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+user_cache = UserCache(USER_CACHE_MAX_SIZE, USER_CACHE_NEGATIVE_TTL)
+
+
+class UserLoader:
+    """
+    Request-scoped identity map for users, keyed by wallet and by referral code.
+    Repeated lookups of a key are served from memory (including misses confirmed by
+    Mongo in this request), and lookups issued in the same event-loop tick are batched
+    into a single $in query. Sits in front of the process-wide user_cache.
+    """
+    
+    def __init__(self):
+        self._cache: Dict[str, Dict[str, Optional[dict]]] = {"wallet_public_key": {}, "referral_code": {}}
+        self._pending: Dict[str, Dict[str, asyncio.Future]] = {"wallet_public_key": {}, "referral_code": {}}
+        self._scheduled = False
+    
+    def prime(self, user: dict):
+        """Record a user (e.g. just inserted) under both keys"""
+        self._cache["wallet_public_key"][user["wallet_public_key"]] = user
+        self._cache["referral_code"][user["referral_code"]] = user
+    
+    def load(self, field: str, key: str, allow_cached_miss: bool = True) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        cache = self._cache[field]
+        if key not in cache:
+            found, user = user_cache.get(field, key)
+            if found and (user or allow_cached_miss):
+                if user:
+                    self.prime(user)
+                future = loop.create_future()
+                future.set_result(user)
+                return future
+        
+        if key in cache:
+            future = loop.create_future()
+            future.set_result(cache[key])
+            return future
+        
+        pending = self._pending[field]
+        if key not in pending:
+            pending[key] = loop.create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+        return pending[key]
+    
+    async def _dispatch(self):
+        self._scheduled = False
+        for field in list(self._pending):
+            pending = self._pending[field]
+            if not pending:
+                continue
+            self._pending[field] = {}
+            
+            try:
+                users = await users_collection.find(
+                    {field: {"$in": list(pending)}},
+                    PROJECTIONS["user"]
+                ).to_list(length=None)
+            except Exception as e:
+                for future in pending.values():
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            found = {user[field]: user for user in users}
+            for user in users:
+                self.prime(user)
+                user_cache.put(user)
+            for key, future in pending.items():
+                if key not in found:
+                    self._cache[field].setdefault(key, None)
+                    user_cache.put_missing(field, key)
+                if not future.done():
+                    future.set_result(found.get(key))
+
+
+_user_loader: ContextVar[Optional[UserLoader]] = ContextVar("user_loader", default=None)
+
+
+@contextmanager
+def user_lookup_scope():
+    """Open a user identity map for the duration of a request (or job)"""
+    token = _user_loader.set(UserLoader())
+    try:
+        yield
+    finally:
+        _user_loader.reset(token)
+
+
+def remember_user(user: dict):
+    """Make a newly inserted user visible to later lookups (request scope and process cache)"""
+    user_cache.put(user)
+    loader = _user_loader.get()
+    if loader:
+        loader.prime(user)
+
+
+async def find_user(field: str, key: str, projection: str, allow_cached_miss: bool) -> Optional[dict]:
+    """Look a user up through the request scope, then the process cache, then Mongo"""
+    loader = _user_loader.get()
+    if loader:
+        return await loader.load(field, key, allow_cached_miss)
+    
+    if user_cache.max_size <= 0:
+        return await users_collection.find_one({field: key}, PROJECTIONS[projection])
+    
+    found, user = user_cache.get(field, key)
+    if found and (user or allow_cached_miss):
+        return user
+    
+    user = await users_collection.find_one({field: key}, PROJECTIONS["user"])
+    if user:
+        user_cache.put(user)
+    else:
+        user_cache.put_missing(field, key)
+    return user
+
+
+async def get_user_by_wallet(wallet: str, projection: str = "user", allow_cached_miss: bool = True) -> Optional[dict]:
+    """
+    Get user by wallet address, restricted to a registered projection.
+    Cached lookups return the full (small, immutable) user document.
+    Pass allow_cached_miss=False when a miss must be confirmed by Mongo.
+    """
+    return await find_user("wallet_public_key", wallet, projection, allow_cached_miss)
+
+
+async def get_user_by_referral_code(code: str, projection: str = "user", allow_cached_miss: bool = True) -> Optional[dict]:
+    """
+    Get user by referral code, restricted to a registered projection.
+    Cached lookups return the full (small, immutable) user document.
+    Pass allow_cached_miss=False when a miss must be confirmed by Mongo.
+    """
+    return await find_user("referral_code", code.upper(), projection, allow_cached_miss)
+
+
+def affiliate_relation_doc(user_wallet: str, ancestor_wallet: str, level: int, created_at: datetime) -> dict:
+    return {"user_id": user_wallet, "ancestor_id": ancestor_wallet, "level": level, "created_at": created_at}
+
+
+def commission_doc(source_wallet: str, net_amount: float, level: int, event_type: str, created_at: datetime) -> dict:
+    """Fields of a new commission at `level` (keyed separately by event_id, beneficiary and level)"""
+    rate = COMMISSION_RATES[level]
+    return {
+        "commission_id": str(uuid.uuid4()),
+        "source_user_id": source_wallet,
+        "percentage": rate * 100,  # Store as percentage (20, 10, etc.)
+        "amount": net_amount * rate,
+        "event_type": event_type,
+        "status": CommissionStatus.PENDING.value,
+        "created_at": created_at
+    }
+
+
+def commission_notification_doc(beneficiary_wallet: str, source_wallet: str, net_amount: float, level: int, created_at: datetime) -> dict:
+    rate = COMMISSION_RATES[level]
+    commission_amount = net_amount * rate
+    return {
+        "wallet": beneficiary_wallet,
+        "type": "commission_received",
+        "title": f"Commission Niveau {level} !",
+        "body": f"Vous avez gagné ${commission_amount:.2f} ({rate * 100}%) sur un achat de ${net_amount:.2f}",
+        "data": {
+            "source_wallet": source_wallet,
+            "level": level,
+            "commission_amount": commission_amount,
+            "purchase_amount": net_amount
+        },
+        "read": False,
+        "created_at": created_at
+    }
+
+
+# Leaderboard: one document per (window, period, wallet) holding running earnings and referral
+# totals, incremented as commissions and relations are written. Top-N reads walk the
+# (window, period, metric) index, so they read N documents whatever the network size.
+LEADERBOARD_WINDOWS = ("day", "week", "all")
+LEADERBOARD_METRICS = ("earnings", "referrals")
+LEADERBOARD_MAX_LIMIT = 100
+LEADERBOARD_RETENTION = {"day": timedelta(days=8), "week": timedelta(weeks=5)}  # TTL of past periods
+LEADERBOARD_PERIOD_FORMATS = {"day": "%Y-%m-%d", "week": "%G-W%V"}  # $dateToString, same keys as leaderboard_period
+
+
+def leaderboard_period(window: str, at: datetime) -> str:
+    """Period key of `at` in `window`: the UTC day, the ISO week or all"""
+    if window == "day":
+        return at.strftime("%Y-%m-%d")
+    if window == "week":
+        year, week, _ = at.isocalendar()
+        return f"{year}-W{week:02d}"
+    return "all"
+
+
+async def record_leaderboard(increments: Dict[str, dict], at: datetime):
+    """Add {wallet: {"earnings": x} / {"referrals": n}} to the current period of every window, in one bulk write"""
+    updates = []
+    for wallet, inc in increments.items():
+        inc = {"earnings": 0.0, "referrals": 0, **inc}
+        for window in LEADERBOARD_WINDOWS:
+            update = {"$inc": inc}
+            if window in LEADERBOARD_RETENTION:
+                update["$setOnInsert"] = {"expires_at": at + LEADERBOARD_RETENTION[window]}
+            updates.append(UpdateOne(
+                {"window": window, "period": leaderboard_period(window, at), "wallet": wallet}, update, upsert=True
+            ))
+    if updates:
+        await affiliate_leaderboard.bulk_write(updates, ordered=False)
+
+
+async def rebuild_affiliate_leaderboard():
+    """
+    Recompute the leaderboard from affiliate_commissions and affiliate_relations (backfill or
+    drift repair): all-time totals plus the day and week periods still within retention.
+    Increments written while it runs are lost, so run it when commissions are quiet.
+    """
+    now = datetime.now(timezone.utc)
+    await affiliate_leaderboard.delete_many({})
+    sources = [
+        (affiliate_commissions, "$beneficiary_user_id", "earnings", "$amount"),
+        (affiliate_relations, "$ancestor_id", "referrals", 1),
+    ]
+    for collection, wallet_field, metric, value in sources:
+        for window in LEADERBOARD_WINDOWS:
+            pipeline = []
+            period = {"$literal": "all"}
+            if window in LEADERBOARD_RETENTION:
+                pipeline.append({"$match": {"created_at": {"$gte": now - LEADERBOARD_RETENTION[window]}}})
+                period = {"$dateToString": {"format": LEADERBOARD_PERIOD_FORMATS[window], "date": "$created_at"}}
+            fields = {"_id": 0, "window": {"$literal": window}, "period": "$_id.period", "wallet": "$_id.wallet", metric: 1}
+            if window in LEADERBOARD_RETENTION:
+                fields["expires_at"] = {"$add": ["$last", LEADERBOARD_RETENTION[window].total_seconds() * 1000]}
+            pipeline += [
+                {"$group": {"_id": {"wallet": wallet_field, "period": period}, metric: {"$sum": value}, "last": {"$max": "$created_at"}}},
+                {"$project": fields},
+                {"$merge": {"into": affiliate_leaderboard.name, "on": ["window", "period", "wallet"],
+                            "whenMatched": "merge", "whenNotMatched": "insert"}},
+            ]
+            await collection.aggregate(pipeline, allowDiskUse=True).to_list(length=None)
+    print(f"[Leaderboard] Rebuilt: {await affiliate_leaderboard.count_documents({})} entries")
 
 
 async def create_affiliate_relations(new_user_wallet: str, referrer_wallet: str):
@@ -230,23 +1101,25 @@ async def create_affiliate_relations(new_user_wallet: str, referrer_wallet: str)
     """
     current_ancestor = referrer_wallet
     level = 1
+    ancestors = []
     
     while current_ancestor and level <= MAX_AFFILIATE_LEVEL:
         # Create relation
-        await affiliate_relations.insert_one({
-            "user_id": new_user_wallet,
-            "ancestor_id": current_ancestor,
-            "level": level,
-            "created_at": datetime.now(timezone.utc)
-        })
+        await affiliate_relations.insert_one(
+            affiliate_relation_doc(new_user_wallet, current_ancestor, level, datetime.now(timezone.utc))
+        )
+        ancestors.append(current_ancestor)
         
         # Get next ancestor (referrer's referrer)
-        ancestor_user = await get_user_by_wallet(current_ancestor)
+        ancestor_user = await get_user_by_wallet(current_ancestor, "user_referrer")
         if ancestor_user and ancestor_user.get("referrer_id"):
             current_ancestor = ancestor_user["referrer_id"]
             level += 1
         else:
             break
+    
+    # Every ancestor gains one referral (all levels, as counted in the affiliate stats)
+    await record_leaderboard({ancestor: {"referrals": 1} for ancestor in ancestors}, datetime.now(timezone.utc))
 
 
 async def distribute_commissions(source_wallet: str, net_amount: float, event_type: str, event_id: str) -> tuple:
@@ -254,11 +1127,12 @@ async def distribute_commissions(source_wallet: str, net_amount: float, event_ty
     Distribute commissions to all ancestors based on MLM rates.
     Returns (commissions_created, total_distributed)
     Also sends notifications to beneficiaries.
+    Idempotent per event_id: replaying an event creates no duplicate commission or notification.
     """
     # Get all ancestors of the source user
     ancestors = await affiliate_relations.find(
         {"user_id": source_wallet},
-        {"_id": 0}
+        PROJECTIONS["relation_ancestor"]
     ).to_list(length=MAX_AFFILIATE_LEVEL)
     
     if not ancestors:
@@ -266,47 +1140,40 @@ async def distribute_commissions(source_wallet: str, net_amount: float, event_ty
     
     commissions_created = 0
     total_distributed = 0.0
+    earned: Dict[str, dict] = {}
     
     for relation in ancestors:
         level = relation["level"]
         rate = COMMISSION_RATES.get(level, 0)
         
         if rate > 0:
-            commission_amount = net_amount * rate
+            now = datetime.now(timezone.utc)
+            commission = commission_doc(source_wallet, net_amount, level, event_type, now)
             
-            await affiliate_commissions.insert_one({
-                "commission_id": str(uuid.uuid4()),
-                "source_user_id": source_wallet,
-                "beneficiary_user_id": relation["ancestor_id"],
-                "level": level,
-                "percentage": rate * 100,  # Store as percentage (20, 10, etc.)
-                "amount": commission_amount,
-                "event_type": event_type,
-                "event_id": event_id,
-                "status": CommissionStatus.PENDING.value,
-                "created_at": datetime.now(timezone.utc)
-            })
-            
-            # Create notification for beneficiary
-            notification_id = str(uuid.uuid4())
-            await notifications_collection.insert_one({
-                "notification_id": notification_id,
-                "wallet": relation["ancestor_id"],
-                "type": "commission_received",
-                "title": f"Commission Niveau {level} !",
-                "body": f"Vous avez gagné ${commission_amount:.2f} ({rate * 100}%) sur un achat de ${net_amount:.2f}",
-                "data": {
-                    "source_wallet": source_wallet,
-                    "level": level,
-                    "commission_amount": commission_amount,
-                    "purchase_amount": net_amount
+            result = await affiliate_commissions.update_one(
+                {
+                    "event_id": event_id,
+                    "beneficiary_user_id": relation["ancestor_id"],
+                    "level": level
                 },
-                "read": False,
-                "created_at": datetime.now(timezone.utc)
-            })
+                {"$setOnInsert": commission},
+                upsert=True
+            )
             
-            commissions_created += 1
-            total_distributed += commission_amount
+            # Create notification for beneficiary (keyed by event so replays don't duplicate it)
+            await notifications_collection.update_one(
+                {"notification_id": f"{event_id}:commission:{level}"},
+                {"$setOnInsert": commission_notification_doc(relation["ancestor_id"], source_wallet, net_amount, level, now)},
+                upsert=True
+            )
+            
+            if result.upserted_id is not None:
+                commissions_created += 1
+                total_distributed += commission["amount"]
+                earned[relation["ancestor_id"]] = {"earnings": commission["amount"]}
+    
+    # Only newly created commissions count, so replays leave the leaderboard unchanged
+    await record_leaderboard(earned, datetime.now(timezone.utc))
     
     return (commissions_created, total_distributed)
 
@@ -331,7 +1198,10 @@ async def create_wallet_session(data: WalletSessionCreate):
 @app.get("/api/wallet/session/{session_id}", response_model=WalletSessionGet)
 async def get_wallet_session(session_id: str):
     """Retrieve and delete a keypair by session ID"""
-    session = await wallet_sessions.find_one_and_delete({"session_id": session_id})
+    session = await wallet_sessions.find_one_and_delete(
+        {"session_id": session_id},
+        projection=PROJECTIONS["wallet_session"]
+    )
     
     if not session:
         return WalletSessionGet(error="Session not found or expired")
@@ -353,8 +1223,8 @@ async def register_affiliate(user_data: UserCreate):
     """
     wallet = user_data.wallet_public_key
     
-    # Check if user already exists
-    existing_user = await get_user_by_wallet(wallet)
+    # Check if user already exists (a cached miss may be stale on another worker)
+    existing_user = await get_user_by_wallet(wallet, allow_cached_miss=False)
     if existing_user:
         return UserResponse(
             wallet_public_key=existing_user["wallet_public_key"],
@@ -365,14 +1235,14 @@ async def register_affiliate(user_data: UserCreate):
     
     # Generate unique referral code
     referral_code = generate_unique_referral_code()
-    while await get_user_by_referral_code(referral_code):
+    while await get_user_by_referral_code(referral_code, "exists", allow_cached_miss=False):
         referral_code = generate_unique_referral_code()
     
     referrer_wallet = None
     
     # If referral code used, find the referrer
     if user_data.referral_code_used:
-        referrer = await get_user_by_referral_code(user_data.referral_code_used)
+        referrer = await get_user_by_referral_code(user_data.referral_code_used, "user_wallet")
         if referrer:
             referrer_wallet = referrer["wallet_public_key"]
     
@@ -386,6 +1256,7 @@ async def register_affiliate(user_data: UserCreate):
     }
     
     await users_collection.insert_one(user_doc)
+    remember_user({k: v for k, v in user_doc.items() if k != "_id"})
     
     # Create affiliate relations if there's a referrer
     if referrer_wallet:
@@ -404,10 +1275,10 @@ async def get_affiliate_stats(wallet: str, request: Request):
     """Get comprehensive affiliate statistics for a user"""
     
     # Get or create user
-    user = await get_user_by_wallet(wallet)
+    user = await get_user_by_wallet(wallet, "user_referral_code")
     if not user:
         await register_affiliate(UserCreate(wallet_public_key=wallet))
-        user = await get_user_by_wallet(wallet)
+        user = await get_user_by_wallet(wallet, "user_referral_code")
     
     # Build referral link
     host = str(request.base_url).rstrip('/')
@@ -433,7 +1304,7 @@ async def get_affiliate_stats(wallet: str, request: Request):
         level_commissions = await affiliate_commissions.find({
             "beneficiary_user_id": wallet,
             "level": level
-        }, {"_id": 0}).to_list(length=10000)
+        }, PROJECTIONS["commission_totals"]).to_list(length=10000)
         
         level_total = sum(c["amount"] for c in level_commissions)
         level_pending = sum(c["amount"] for c in level_commissions if c["status"] == CommissionStatus.PENDING.value)
@@ -469,7 +1340,10 @@ async def get_affiliate_stats(wallet: str, request: Request):
 
 @app.get("/api/affiliate/{wallet}/commissions", response_model=CommissionHistoryResponse)
 async def get_commission_history(wallet: str, limit: int = 50, offset: int = 0):
-    """Get commission history for a user"""
+    """
+    Get commission history for a user.
+    Rows are serialized directly with orjson; response_model only documents the schema.
+    """
     
     # Get total count
     total_count = await affiliate_commissions.count_documents({"beneficiary_user_id": wallet})
@@ -477,30 +1351,16 @@ async def get_commission_history(wallet: str, limit: int = 50, offset: int = 0):
     # Get commissions with pagination
     commissions_cursor = affiliate_commissions.find(
         {"beneficiary_user_id": wallet},
-        {"_id": 0}
+        PROJECTIONS["commission_entry"]
     ).sort("created_at", -1).skip(offset).limit(limit)
     
     commissions = await commissions_cursor.to_list(length=limit)
     
-    commission_entries = []
-    for c in commissions:
-        commission_entries.append(CommissionEntry(
-            id=c.get("commission_id", str(uuid.uuid4())),
-            source_user_wallet=c["source_user_id"],
-            level=c["level"],
-            percentage=c["percentage"],
-            amount=c["amount"],
-            event_type=c["event_type"],
-            event_id=c["event_id"],
-            status=c["status"],
-            created_at=c["created_at"].isoformat() if isinstance(c["created_at"], datetime) else str(c["created_at"])
-        ))
-    
-    return CommissionHistoryResponse(
-        wallet_public_key=wallet,
-        commissions=commission_entries,
-        total_count=total_count
-    )
+    return ORJSONResponse({
+        "wallet_public_key": wallet,
+        "commissions": [commission_entry_row(c) for c in commissions],
+        "total_count": total_count
+    })
 
 
 @app.get("/api/affiliate/{wallet}/tree", response_model=AffiliateTreeResponse)
@@ -508,10 +1368,11 @@ async def get_affiliate_tree(wallet: str, max_depth: int = 2):
     """
     Get the affiliate tree for a user (their downline).
     max_depth limits how deep to fetch (default 2 levels for performance).
+    Nodes are built as plain dicts and serialized with orjson.
     """
     
-    async def build_tree_node(user_wallet: str, current_depth: int) -> AffiliateTreeNode:
-        user = await get_user_by_wallet(user_wallet)
+    async def build_tree_node(user_wallet: str, current_depth: int) -> Optional[dict]:
+        user = await get_user_by_wallet(user_wallet, "user_referral_code")
         if not user:
             return None
         
@@ -519,51 +1380,49 @@ async def get_affiliate_tree(wallet: str, max_depth: int = 2):
         direct_referrals = await affiliate_relations.find({
             "ancestor_id": user_wallet,
             "level": 1
-        }, {"_id": 0}).to_list(length=1000)
+        }, PROJECTIONS["relation_user"]).to_list(length=1000)
         
         # Calculate total generated revenue (sum of commissions from this user's network)
         total_generated = 0.0
         network_commissions = await affiliate_commissions.find({
             "beneficiary_user_id": user_wallet
-        }, {"_id": 0, "amount": 1}).to_list(length=10000)
+        }, PROJECTIONS["commission_amount"]).to_list(length=10000)
         total_generated = sum(c["amount"] for c in network_commissions)
         
         children = []
         if current_depth < max_depth:
-            for ref in direct_referrals:
-                child_node = await build_tree_node(ref["user_id"], current_depth + 1)
-                if child_node:
-                    children.append(child_node)
+            # Built concurrently so sibling user lookups batch into one query
+            child_nodes = await asyncio.gather(*(
+                build_tree_node(ref["user_id"], current_depth + 1) for ref in direct_referrals
+            ))
+            children = [node for node in child_nodes if node]
         
-        return AffiliateTreeNode(
-            wallet_public_key=user_wallet,
-            referral_code=user["referral_code"],
-            level=current_depth,
-            direct_referrals=len(direct_referrals),
-            total_generated=total_generated,
-            children=children
-        )
+        return {
+            "wallet_public_key": user_wallet,
+            "referral_code": user["referral_code"],
+            "level": current_depth,
+            "direct_referrals": len(direct_referrals),
+            "total_generated": total_generated,
+            "children": children
+        }
     
     # Get direct referrals of the wallet
     direct_refs = await affiliate_relations.find({
         "ancestor_id": wallet,
         "level": 1
-    }, {"_id": 0}).to_list(length=1000)
+    }, PROJECTIONS["relation_user"]).to_list(length=1000)
     
-    tree = []
-    for ref in direct_refs:
-        node = await build_tree_node(ref["user_id"], 1)
-        if node:
-            tree.append(node)
+    nodes = await asyncio.gather(*(build_tree_node(ref["user_id"], 1) for ref in direct_refs))
+    tree = [node for node in nodes if node]
     
     # Calculate total network size
     total_network = await affiliate_relations.count_documents({"ancestor_id": wallet})
     
-    return AffiliateTreeResponse(
-        wallet_public_key=wallet,
-        tree=tree,
-        total_network_size=total_network
-    )
+    return ORJSONResponse({
+        "wallet_public_key": wallet,
+        "tree": tree,
+        "total_network_size": total_network
+    })
 
 
 @app.post("/api/affiliate/commission/distribute", response_model=CreateCommissionResponse)
@@ -603,6 +1462,35 @@ async def get_affiliate_config():
     }
 
 
+@app.get("/api/affiliate/leaderboard", response_model=LeaderboardResponse)
+async def get_affiliate_leaderboard(
+    metric: str = Query("earnings", pattern="^(" + "|".join(LEADERBOARD_METRICS) + ")$"),
+    window: str = Query("all", pattern="^(" + "|".join(LEADERBOARD_WINDOWS) + ")$"),
+    limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_LIMIT)
+):
+    """Top affiliates by commission earnings or referral count over the current UTC day, ISO week or all time"""
+    period = leaderboard_period(window, datetime.now(timezone.utc))
+    rows = await affiliate_leaderboard.find(
+        {"window": window, "period": period, metric: {"$gt": 0}},
+        PROJECTIONS["leaderboard_entry"]
+    ).sort([(metric, -1), ("wallet", 1)]).limit(limit).to_list(length=limit)
+    
+    return LeaderboardResponse(
+        metric=metric,
+        window=window,
+        period=period,
+        entries=[
+            LeaderboardEntry(
+                rank=rank,
+                wallet_public_key=row["wallet"],
+                earnings=row.get("earnings", 0.0),
+                referrals=row.get("referrals", 0)
+            )
+            for rank, row in enumerate(rows, start=1)
+        ]
+    )
+
+
 @app.get("/api/affiliate/{wallet}/level/{level}/transactions")
 async def get_level_transactions(wallet: str, level: int, limit: int = 50, offset: int = 0):
     """Get all transactions/commissions for a specific level"""
@@ -617,7 +1505,7 @@ async def get_level_transactions(wallet: str, level: int, limit: int = 50, offse
     
     commissions_cursor = affiliate_commissions.find(
         {"beneficiary_user_id": wallet, "level": level},
-        {"_id": 0}
+        PROJECTIONS["commission_entry"]
     ).sort("created_at", -1).skip(offset).limit(limit)
     
     commissions = await commissions_cursor.to_list(length=limit)
@@ -671,18 +1559,24 @@ class NotificationResponse(BaseModel):
     created_at: str
 
 
+class NotificationListResponse(BaseModel):
+    notifications: List[NotificationResponse]
+    unread_count: int
+
+
 async def create_notification(
     wallet: str,
     notification_type: NotificationType,
     title: str,
     body: str,
-    data: Optional[Dict] = None
+    data: Optional[Dict] = None,
+    notification_id: Optional[str] = None
 ) -> str:
-    """Create a notification for a user"""
-    notification_id = str(uuid.uuid4())
-    
+    """
+    Create a notification for a user.
+    Passing a deterministic notification_id makes the call idempotent.
+    """
     notification_doc = {
-        "notification_id": notification_id,
         "wallet": wallet,
         "type": notification_type.value,
         "title": title,
@@ -692,7 +1586,15 @@ async def create_notification(
         "created_at": datetime.now(timezone.utc)
     }
     
-    await notifications_collection.insert_one(notification_doc)
+    if notification_id:
+        await notifications_collection.update_one(
+            {"notification_id": notification_id},
+            {"$setOnInsert": notification_doc},
+            upsert=True
+        )
+    else:
+        notification_id = str(uuid.uuid4())
+        await notifications_collection.insert_one({"notification_id": notification_id, **notification_doc})
     
     # TODO: Send push notification via Expo Push API
     # This would require the expo-server-sdk or direct API call
@@ -744,64 +1646,139 @@ async def register_push_token(data: PushTokenRegister):
     return {"success": True, "message": "Push token registered"}
 
 
-@app.get("/api/notifications/{wallet}")
-async def get_notifications(wallet: str, limit: int = 50, unread_only: bool = False):
-    """Get notifications for a wallet"""
+async def get_notification_state(wallet: str) -> dict:
+    """
+    Get the per-wallet notification watermarks.
+    - read_through: every notification created at or before it is read
+    - cleared_through: every notification created at or before it is hidden
+    """
+    state = await notification_state_collection.find_one({"wallet": wallet}, PROJECTIONS["notification_state"])
+    return state or {}
+
+
+def notification_query(wallet: str, state: dict, unread_only: bool = False) -> dict:
+    """Build the notifications filter honouring the wallet's watermarks"""
     query = {"wallet": wallet}
+    after = state.get("cleared_through")
+    
     if unread_only:
         query["read"] = False
+        read_through = state.get("read_through")
+        if read_through and (not after or read_through > after):
+            after = read_through
+    
+    if after:
+        query["created_at"] = {"$gt": after}
+    return query
+
+
+def is_notification_read(notification: dict, state: dict) -> bool:
+    """A notification is read if flagged individually or covered by the read watermark"""
+    if notification.get("read"):
+        return True
+    read_through = state.get("read_through")
+    created_at = notification.get("created_at")
+    return bool(read_through and isinstance(created_at, datetime) and created_at <= read_through)
+
+
+@app.get("/api/notifications/{wallet}", response_model=NotificationListResponse)
+async def get_notifications(wallet: str, limit: int = 50, unread_only: bool = False):
+    """Get notifications for a wallet (serialized directly with orjson)"""
+    state = await get_notification_state(wallet)
     
     notifications_cursor = notifications_collection.find(
-        query,
-        {"_id": 0}
+        notification_query(wallet, state, unread_only),
+        PROJECTIONS["notification"]
     ).sort("created_at", -1).limit(limit)
     
     notifications = await notifications_cursor.to_list(length=limit)
     
     # Count unread
-    unread_count = await notifications_collection.count_documents({
-        "wallet": wallet,
-        "read": False
-    })
-    
-    result = []
-    for n in notifications:
-        result.append(NotificationResponse(
-            id=n["notification_id"],
-            type=n["type"],
-            title=n["title"],
-            body=n["body"],
-            data=n.get("data"),
-            read=n["read"],
-            created_at=n["created_at"].isoformat() if isinstance(n["created_at"], datetime) else str(n["created_at"])
-        ))
+    unread_count = await notifications_collection.count_documents(
+        notification_query(wallet, state, unread_only=True)
+    )
     
-    return {
+    result = [{
+        "id": n["notification_id"],
+        "type": n["type"],
+        "title": n["title"],
+        "body": n["body"],
+        "data": n.get("data"),
+        "read": is_notification_read(n, state),
+        "created_at": n["created_at"]
+    } for n in notifications]
+    
+    return ORJSONResponse({
         "notifications": result,
         "unread_count": unread_count
-    }
+    })
 
 
 @app.post("/api/notifications/{wallet}/mark-read")
 async def mark_notifications_read(wallet: str, notification_ids: List[str] = None):
-    """Mark notifications as read"""
-    query = {"wallet": wallet}
+    """
+    Mark notifications as read.
+    Without IDs, advances the wallet's read_through watermark (single-document write).
+    With IDs, flags those notifications in bounded batches.
+    """
     if notification_ids:
-        query["notification_id"] = {"$in": notification_ids}
+        marked_read = 0
+        for i in range(0, len(notification_ids), NOTIFICATION_BATCH_SIZE):
+            result = await notifications_collection.update_many(
+                {
+                    "wallet": wallet,
+                    "notification_id": {"$in": notification_ids[i:i + NOTIFICATION_BATCH_SIZE]},
+                    "read": False
+                },
+                {"$set": {"read": True}}
+            )
+            marked_read += result.modified_count
+        return {"success": True, "marked_read": marked_read}
+    
+    state = await get_notification_state(wallet)
+    marked_read = await notifications_collection.count_documents(
+        notification_query(wallet, state, unread_only=True)
+    )
     
-    result = await notifications_collection.update_many(
-        query,
-        {"$set": {"read": True}}
+    await notification_state_collection.update_one(
+        {"wallet": wallet},
+        {"$max": {"read_through": datetime.now(timezone.utc)}},
+        upsert=True
     )
     
-    return {"success": True, "marked_read": result.modified_count}
+    return {"success": True, "marked_read": marked_read}
+
+
+async def purge_cleared_notifications(wallet: str, cleared_through: datetime):
+    """Physically delete cleared notifications in bounded batches"""
+    while True:
+        batch = await notifications_collection.find(
+            {"wallet": wallet, "created_at": {"$lte": cleared_through}},
+            {"_id": 1}
+        ).limit(NOTIFICATION_BATCH_SIZE).to_list(length=NOTIFICATION_BATCH_SIZE)
+        if not batch:
+            break
+        await notifications_collection.delete_many({"_id": {"$in": [n["_id"] for n in batch]}})
 
 
 @app.delete("/api/notifications/{wallet}/clear")
-async def clear_notifications(wallet: str):
-    """Clear all notifications for a wallet"""
-    result = await notifications_collection.delete_many({"wallet": wallet})
-    return {"success": True, "deleted": result.deleted_count}
+async def clear_notifications(wallet: str, background_tasks: BackgroundTasks):
+    """
+    Clear all notifications for a wallet.
+    Hides them immediately via the cleared_through watermark, then purges in the background.
+    """
+    state = await get_notification_state(wallet)
+    deleted = await notifications_collection.count_documents(notification_query(wallet, state))
+    
+    cleared_through = datetime.now(timezone.utc)
+    await notification_state_collection.update_one(
+        {"wallet": wallet},
+        {"$max": {"cleared_through": cleared_through, "read_through": cleared_through}},
+        upsert=True
+    )
+    background_tasks.add_task(purge_cleared_notifications, wallet, cleared_through)
+    
+    return {"success": True, "deleted": deleted}
 
 
 # ============== PRESALE PROGRESS ==============
@@ -818,61 +1795,177 @@ class PresaleConfigUpdate(BaseModel):
 _presale_onchain_cache: Dict = {}
 _presale_cache_ts: float = 0
 PRESALE_CACHE_TTL = 7200  # 2 hours
-_sol_price_cache: float = 0
-_sol_price_cache_ts: float = 0
-SOL_PRICE_CACHE_TTL = 300  # 5 min
+PROGRESS_HISTORY_RESOLUTIONS = {"5m": 300, "15m": 900, "1h": 3600, "6h": 21600, "1d": 86400}
+PROGRESS_HISTORY_MAX_BUCKETS = 2000
+_spl_price_cache: Dict[str, float] = {}  # mint -> last known USD price
 
 
-async def get_sol_price_usd() -> float:
-    """Get current SOL price in USD with fallback APIs and caching"""
-    global _sol_price_cache, _sol_price_cache_ts
-    import time
-    now = time.time()
-    if _sol_price_cache > 0 and (now - _sol_price_cache_ts) < SOL_PRICE_CACHE_TTL:
-        return _sol_price_cache
+async def fetch_coingecko_sol_price(client: httpx.AsyncClient) -> float:
+    resp = await client.get(f"{COINGECKO_API_BASE}/simple/price", params={"ids": "solana", "vs_currencies": "usd"})
+    return float(resp.json()["solana"]["usd"])
 
-    price = 0
-    try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(
-                "https://api.coingecko.com/api/v3/simple/price",
-                params={"ids": "solana", "vs_currencies": "usd"},
-            )
-            price = resp.json().get("solana", {}).get("usd", 0)
-    except Exception:
-        pass
 
-    if not price:
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                resp = await client.get("https://api.binance.com/api/v3/ticker/price?symbol=SOLUSDT")
-                price = float(resp.json().get("price", 0))
-        except Exception:
-            pass
+async def fetch_binance_sol_price(client: httpx.AsyncClient) -> float:
+    resp = await client.get(f"{BINANCE_API_BASE}/ticker/price", params={"symbol": "SOLUSDT"})
+    return float(resp.json()["price"])
 
-    if price and price > 0:
-        _sol_price_cache = price
-        _sol_price_cache_ts = now
-    elif _sol_price_cache > 0:
-        return _sol_price_cache
 
-    return price
+async def fetch_coinbase_sol_price(client: httpx.AsyncClient) -> float:
+    resp = await client.get(f"{COINBASE_API_BASE}/prices/SOL-USD/spot")
+    return float(resp.json()["data"]["amount"])
 
 
-async def get_token_holders_count() -> int:
-    """Count holders of Quantum token on-chain. Falls back to MongoDB config."""
-    # Try RPC endpoints
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        for endpoint in SOLANA_RPC_ENDPOINTS:
+SOL_PRICE_SOURCES = {
+    "coingecko": fetch_coingecko_sol_price,
+    "binance": fetch_binance_sol_price,
+    "coinbase": fetch_coinbase_sol_price,
+}
+
+
+class SolPriceFeed:
+    """
+    SOL/USD price kept in memory from several sources.
+    The price is the median of the fresh quotes within SOL_PRICE_MAX_DEVIATION of their median
+    (with fewer than three quotes nothing can be called an outlier, so all are used).
+    """
+    
+    def __init__(self):
+        self.quotes: Dict[str, tuple] = {}  # source -> (price, monotonic time received)
+        self.price = 0.0
+        self.updated_at = 0.0  # monotonic
+        self.disagreement = 0.0
+        self.sources: List[str] = []
+        self.outliers: set = set()
+        self._refreshing: Optional[asyncio.Future] = None
+    
+    def age(self) -> float:
+        return time.monotonic() - self.updated_at if self.price > 0 else float("inf")
+    
+    def update(self, source: str, price: float):
+        """Record a quote and recompute the price"""
+        if price > 0:
+            self.quotes[source] = (price, time.monotonic())
+            self.recompute()
+    
+    def recompute(self):
+        now = time.monotonic()
+        fresh = {source: price for source, (price, at) in self.quotes.items() if now - at < SOL_PRICE_MAX_AGE}
+        if not fresh:
+            return
+        median = statistics.median(fresh.values())
+        accepted = fresh
+        if len(fresh) >= 3:
+            accepted = {s: p for s, p in fresh.items() if abs(p - median) <= SOL_PRICE_MAX_DEVIATION * median} or fresh
+        
+        outliers = fresh.keys() - accepted.keys()
+        for source in outliers - self.outliers:
+            SOL_PRICE_OUTLIERS.labels(source).inc()
+            print(f"[SolPrice] Rejecting {source} quote {fresh[source]:.4f}, median {median:.4f}")
+        self.outliers = outliers
+        
+        self.price = statistics.median(accepted.values())
+        self.updated_at = max(self.quotes[source][1] for source in accepted)
+        self.disagreement = (max(fresh.values()) - min(fresh.values())) / median
+        self.sources = sorted(accepted)
+        SOL_PRICE_USD.set(self.price)
+        SOL_PRICE_UPDATED.set(time.time())
+        SOL_PRICE_DISAGREEMENT.set(self.disagreement)
+    
+    async def _fetch(self, client: httpx.AsyncClient, source: str):
+        with tracer.start_as_current_span("sol_price", attributes={"price.source": source}):
             try:
-                resp = await client.post(endpoint, json={
-                    "jsonrpc": "2.0", "id": 1,
-                    "method": "getTokenLargestAccounts",
-                    "params": [QUANTUM_MINT],
-                })
-                data = resp.json()
-                if "error" in data:
-                    continue
+                price = await SOL_PRICE_SOURCES[source](client)
+            except Exception as e:
+                print(f"[SolPrice] {source} failed: {type(e).__name__}: {e}")
+                return
+            if price > 0:
+                self.quotes[source] = (price, time.monotonic())
+    
+    async def _refresh(self):
+        async with upstream_client(timeout=10.0) as client:
+            await asyncio.gather(*(self._fetch(client, source) for source in SOL_PRICE_SOURCES))
+        self.recompute()
+    
+    async def refresh(self) -> float:
+        """Poll every source concurrently; concurrent callers share one refresh"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._refreshing)
+        return self.price
+    
+    def status(self) -> dict:
+        now = time.monotonic()
+        return {
+            "price_usd": self.price,
+            "age_seconds": round(self.age(), 3) if self.price > 0 else None,
+            "disagreement": round(self.disagreement, 6),
+            "sources": self.sources,
+            "outliers": sorted(self.outliers),
+            "quotes": {source: {"price_usd": price, "age_seconds": round(now - at, 3)}
+                       for source, (price, at) in sorted(self.quotes.items())},
+        }
+
+
+sol_price_feed = SolPriceFeed()
+
+
+async def get_sol_price_usd() -> float:
+    """Current SOL price in USD: a memory read, refreshed on the request path only if the feed is stale"""
+    if sol_price_feed.age() < SOL_PRICE_MAX_AGE:
+        CACHE_REQUESTS.labels("sol_price", "hit").inc()
+        return sol_price_feed.price
+    CACHE_REQUESTS.labels("sol_price", "miss").inc()
+    # On failure the last known price (or 0) is kept
+    return await sol_price_feed.refresh()
+
+
+async def run_sol_price_refresher():
+    """Poll every SOL price source every SOL_PRICE_REFRESH_INTERVAL seconds"""
+    print(f"[SolPrice] Refreshing every {SOL_PRICE_REFRESH_INTERVAL}s from {', '.join(SOL_PRICE_SOURCES)}")
+    while True:
+        try:
+            await sol_price_feed.refresh()
+        except Exception as e:
+            print(f"[SolPrice] Refresh error: {e}")
+        await asyncio.sleep(SOL_PRICE_REFRESH_INTERVAL)
+
+
+async def run_sol_price_stream():
+    """Follow the Binance SOLUSDT ticker over a websocket, reconnecting with backoff"""
+    backoff = 1
+    while True:
+        try:
+            async with websockets.connect(BINANCE_STREAM_URL, open_timeout=10, ping_interval=20) as stream:
+                print(f"[SolPrice] Streaming {BINANCE_STREAM_URL}")
+                backoff = 1
+                async for message in stream:
+                    ticker = json.loads(message)
+                    if "c" in ticker:  # last price
+                        sol_price_feed.update("binance", float(ticker["c"]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[SolPrice] Stream error: {type(e).__name__}: {e}, reconnecting in {backoff}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+
+async def get_token_holders_count() -> int:
+    """Count holders of Quantum token on-chain. Falls back to MongoDB config."""
+    # Try RPC endpoints
+    async with upstream_client(timeout=15.0) as client:
+        for endpoint in SOLANA_RPC_ENDPOINTS:
+            try:
+                with rpc_span("getTokenLargestAccounts", endpoint) as span:
+                    resp = await client.post(endpoint, json={
+                        "jsonrpc": "2.0", "id": 1,
+                        "method": "getTokenLargestAccounts",
+                        "params": [QUANTUM_MINT],
+                    })
+                    data = resp.json()
+                    if "error" in data:
+                        span.set_status(StatusCode.ERROR, str(data["error"]))
+                        continue
                 accounts = data.get("result", {}).get("value", [])
                 count = len([a for a in accounts if float(a.get("uiAmount", 0) or 0) > 0])
                 if count > 0:
@@ -887,7 +1980,7 @@ async def get_token_holders_count() -> int:
                 continue
 
     # Fallback: use MongoDB cached value
-    config = await presale_config_collection.find_one({"config_id": "main"}, {"_id": 0})
+    config = await presale_config_collection.find_one({"config_id": "main"}, PROJECTIONS["presale_participants"])
     return config.get("participants", 0) if config else 0
 
 
@@ -900,12 +1993,18 @@ async def get_wallet_total_value_usd() -> dict:
     sol_balance = 0.0
     total_usd = 0.0
     token_details = []
+    balances = {}  # raw amounts per asset ("SOL" or mint), for the treasury ledger
+    prices = {}  # USD unit prices of other priced mints
+    slots = []  # context slot of each snapshot call
 
     # Get SOL balance
     try:
         result = await solana_rpc_call("getBalance", [SOLANA_WALLET_ADDRESS])
         lamports = result.get("value", 0) if isinstance(result, dict) else 0
         sol_balance = lamports / 1e9
+        balances["SOL"] = sol_balance
+        if isinstance(result, dict) and "context" in result:
+            slots.append(result["context"]["slot"])
     except Exception:
         pass
 
@@ -925,11 +2024,13 @@ async def get_wallet_total_value_usd() -> dict:
             # SKIP Quantum tokens - not part of presale raised amount
             if mint == QUANTUM_MINT:
                 continue
-            elif mint == "EPjFWdd5AufqSSqeM2qN1xzybapC8G4wEGGkZwyTDt1v":
+            balances[mint] = balances.get(mint, 0) + ui_amount
+
+            if mint == USDC_MINT:
                 # USDC (1:1 with USD)
                 total_usd += ui_amount
                 token_details.append({"name": "USDC", "amount": ui_amount, "usd": ui_amount})
-            elif mint == "Es9vMFrzaCERmJfrF4H2FYD4KCoNkY11McCe8BenwNYB":
+            elif mint == USDT_MINT:
                 # USDT (1:1 with USD)
                 total_usd += ui_amount
                 token_details.append({"name": "USDT", "amount": ui_amount, "usd": ui_amount})
@@ -937,8 +2038,11 @@ async def get_wallet_total_value_usd() -> dict:
                 # Try to price unknown tokens via CoinGecko (e.g. HYPE bridged)
                 token_usd = await get_spl_token_usd_value(mint, ui_amount)
                 if token_usd > 0:
+                    prices[mint] = token_usd / ui_amount
                     total_usd += token_usd
                     token_details.append({"name": mint[:8], "amount": ui_amount, "usd": round(token_usd, 2)})
+        if isinstance(result, dict) and "context" in result:
+            slots.append(result["context"]["slot"])
     except Exception:
         pass
 
@@ -952,24 +2056,35 @@ async def get_wallet_total_value_usd() -> dict:
         "sol_price_usd": sol_price,
         "sol_value_usd": round(sol_usd, 2),
         "tokens": token_details,
+        "balances": balances,
+        "prices": prices,
+        # Both snapshot calls answered: the oldest slot they reflect, else None
+        "slot": min(slots) if len(slots) == 2 else None,
     }
 
 
 async def get_spl_token_usd_value(mint: str, amount: float) -> float:
-    """Try to get USD value of a SPL token via CoinGecko contract lookup."""
+    """Try to get USD value of a SPL token via CoinGecko contract lookup (last known price if it fails)."""
+    price = 0
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.get(
-                "https://api.coingecko.com/api/v3/simple/token_price/solana",
-                params={"contract_addresses": mint, "vs_currencies": "usd"},
-            )
-            data = resp.json()
-            price = data.get(mint.lower(), {}).get("usd", 0)
-            if not price:
-                price = data.get(mint, {}).get("usd", 0)
-            return amount * price if price else 0
+        with tracer.start_as_current_span("spl_token_price", attributes={"price.source": "coingecko", "token.mint": mint}):
+            async with upstream_client(timeout=10.0) as client:
+                resp = await client.get(
+                    f"{COINGECKO_API_BASE}/simple/token_price/solana",
+                    params={"contract_addresses": mint, "vs_currencies": "usd"},
+                )
+                data = resp.json()
+                price = data.get(mint.lower(), {}).get("usd", 0)
+                if not price:
+                    price = data.get(mint, {}).get("usd", 0)
     except Exception:
-        return 0
+        pass
+    
+    if price:
+        _spl_price_cache[mint] = price
+    else:
+        price = _spl_price_cache.get(mint, 0)
+    return amount * price if price else 0
 
 
 @app.get("/api/presale/progress")
@@ -981,10 +2096,12 @@ async def get_presale_progress(refresh: bool = False):
     now = time.time()
 
     if not refresh and _presale_onchain_cache and (now - _presale_cache_ts) < PRESALE_CACHE_TTL:
+        CACHE_REQUESTS.labels("presale_progress", "hit").inc()
         return _presale_onchain_cache
+    CACHE_REQUESTS.labels("presale_progress", "miss").inc()
 
-    # Get total wallet value (simple, fast: 2-3 RPC calls)
-    wallet_data = await get_wallet_total_value_usd()
+    # Total wallet value from the treasury ledger (full on-chain re-valuation only when due)
+    wallet_data = await get_treasury_value()
     total_raised_usd = wallet_data["total_usd"]
 
     # Get token holders count (may fail due to rate limits)
@@ -1009,9 +2126,74 @@ async def get_presale_progress(refresh: bool = False):
     _presale_onchain_cache = result
     _presale_cache_ts = now
 
+    try:
+        await presale_progress_history.insert_one({
+            "timestamp": datetime.now(timezone.utc),
+            "meta": {"source": "onchain"},
+            "total_raised": total_raised_usd,
+            "participants": holders,
+            "sol_price_usd": wallet_data["sol_price_usd"],
+        })
+    except Exception as e:
+        print(f"[Presale] Failed to record progress point: {str(e)}")
+
     return result
 
 
+@app.get("/api/presale/progress/history")
+async def get_presale_progress_history(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    resolution: str = Query("1h", pattern="^(" + "|".join(PROGRESS_HISTORY_RESOLUTIONS) + ")$")
+):
+    """
+    Downsampled progress history: min/max/last raised per bucket of `resolution` between
+    `start` and `end` (default: the last 30 days), aggregated in MongoDB.
+    """
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=30)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    bucket_ms = PROGRESS_HISTORY_RESOLUTIONS[resolution] * 1000
+    if (end - start).total_seconds() * 1000 / bucket_ms > PROGRESS_HISTORY_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail="Range too large for this resolution")
+
+    epoch_ms = {"$subtract": ["$timestamp", datetime(1970, 1, 1)]}  # date - date = milliseconds
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {
+            "_id": {"$subtract": [epoch_ms, {"$mod": [epoch_ms, bucket_ms]}]},
+            "min": {"$min": "$total_raised"},
+            "max": {"$max": "$total_raised"},
+            "last": {"$last": "$total_raised"},
+            "participants": {"$last": "$participants"},
+            "samples": {"$sum": 1},
+        }},
+        {"$sort": {"_id": 1}},
+    ]
+    buckets = await presale_progress_history.aggregate(pipeline).to_list(length=None)
+
+    return {
+        "resolution": resolution,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "points": [
+            {
+                "timestamp": datetime.fromtimestamp(b["_id"] / 1000, timezone.utc).isoformat(),
+                "min": b["min"],
+                "max": b["max"],
+                "last": b["last"],
+                "participants": b["participants"],
+                "samples": b["samples"],
+            }
+            for b in buckets
+        ]
+    }
+
+
 @app.put("/api/presale/config")
 async def update_presale_config(config_update: PresaleConfigUpdate):
     """Update presale configuration (admin endpoint)"""
@@ -1058,24 +2240,54 @@ async def increment_presale_raised(amount: float):
 
 async def solana_rpc_call(method: str, params: list) -> dict:
     """Make a Solana RPC call via backend (avoids browser CORS/rate-limit)"""
-    async with httpx.AsyncClient(timeout=15.0) as client:
+    async with upstream_client(timeout=15.0) as client:
         for endpoint in SOLANA_RPC_ENDPOINTS:
             try:
-                resp = await client.post(endpoint, json={
-                    "jsonrpc": "2.0",
-                    "id": 1,
-                    "method": method,
-                    "params": params,
-                })
-                data = resp.json()
-                if "error" in data:
-                    continue
-                return data.get("result", {})
+                with rpc_span(method, endpoint) as span:
+                    resp = await client.post(endpoint, json={
+                        "jsonrpc": "2.0",
+                        "id": 1,
+                        "method": method,
+                        "params": params,
+                    })
+                    data = resp.json()
+                    if "error" in data:
+                        span.set_status(StatusCode.ERROR, str(data["error"]))
+                        continue
+                    return data.get("result", {})
             except Exception:
                 continue
     return {}
 
 
+async def solana_rpc_batch(method: str, params_list: List[list]) -> List[Optional[dict]]:
+    """Send several calls of one method as a single JSON-RPC batch; results in request order, None on error"""
+    if not params_list:
+        return []
+    payload = [
+        {"jsonrpc": "2.0", "id": i, "method": method, "params": params}
+        for i, params in enumerate(params_list)
+    ]
+    async with upstream_client(timeout=30.0) as client:
+        for endpoint in SOLANA_RPC_ENDPOINTS:
+            try:
+                with rpc_span(method, endpoint, **{"rpc.batch_size": len(payload)}) as span:
+                    resp = await client.post(endpoint, json=payload)
+                    data = resp.json()
+                    if not isinstance(data, list):
+                        span.set_status(StatusCode.ERROR, "batch rejected")
+                        continue
+                    results = [None] * len(params_list)
+                    for item in data:
+                        if "error" not in item and item.get("id") in range(len(results)):
+                            results[item["id"]] = item.get("result")
+                    span.set_attribute("rpc.batch_missing", results.count(None))
+                    return results
+            except Exception:
+                continue
+    return [None] * len(params_list)
+
+
 @app.get("/api/solana/balance/{wallet}")
 async def get_solana_balance(wallet: str):
     """Proxy endpoint: fetch SOL + Quantum token balance from Solana mainnet"""
@@ -1165,7 +2377,7 @@ def generate_referral_code(wallet_address: str) -> str:
 
 async def get_or_create_referral_data(wallet_address: str) -> ReferralStats:
     """Get or create referral data for a wallet"""
-    existing = await referral_data.find_one({"walletAddress": wallet_address})
+    existing = await referral_data.find_one({"walletAddress": wallet_address}, PROJECTIONS["referral_stats"])
     
     if existing:
         return ReferralStats(**existing)
@@ -1181,29 +2393,131 @@ async def get_or_create_referral_data(wallet_address: str) -> ReferralStats:
     return new_data
 
 
-async def update_referral_stats(referral_code: str, purchase_amount: float, token_amount: int):
-    """Update referral stats when a purchase is made"""
-    # Find referrer by code
-    referrer = await referral_data.find_one({"referralCode": referral_code})
-    
-    if not referrer:
-        return
-    
+async def update_referral_stats(referral_code: str, purchase_amount: float, token_amount: int, event_id: Optional[str] = None):
+    """
+    Update referral stats when a purchase is made.
+    With an event_id the increment is applied at most once per event.
+    """
     # Calculate commission (10%)
     commission = purchase_amount * 0.10
     
-    # Update stats
-    await referral_data.update_one(
-        {"referralCode": referral_code},
-        {
-            "$inc": {
-                "referrals": 1,
-                "totalPurchased": token_amount,
-                "commissionEarned": commission,
-                "commissionPending": commission
-            }
+    query = {"referralCode": referral_code}
+    update = {
+        "$inc": {
+            "referrals": 1,
+            "totalPurchased": token_amount,
+            "commissionEarned": commission,
+            "commissionPending": commission
         }
+    }
+    if event_id:
+        query["applied_events"] = {"$ne": event_id}
+        update["$push"] = {"applied_events": {"$each": [event_id], "$slice": -500}}
+    
+    # Update stats (no-op if the referrer is unknown or the event was already applied)
+    await referral_data.update_one(query, update)
+
+
+# ============== CARD2CRYPTO WALLETS ==============
+
+_card2crypto_pool_wakeup = asyncio.Event()
+
+
+def card2crypto_callback_url(host_url: str, purchase_id: str) -> str:
+    return f"{host_url}/api/payments/callback?pid={purchase_id}"
+
+
+async def generate_card2crypto_wallet(purchase_id: str, host_url: str) -> dict:
+    """Generate an encrypted Card2Crypto deposit wallet whose callback targets this purchase"""
+    encoded_callback = urllib.parse.quote(card2crypto_callback_url(host_url, purchase_id), safe='')
+    wallet_url = f"{CARD2CRYPTO_API_BASE}/wallet.php?address={CARD2CRYPTO_PAYOUT_WALLET}&callback={encoded_callback}"
+    
+    with tracer.start_as_current_span("card2crypto wallet", attributes={"purchase.id": purchase_id}):
+        async with upstream_client(timeout=15.0) as http_client:
+            resp = await http_client.get(wallet_url)
+            if resp.status_code != 200:
+                raise HTTPException(status_code=502, detail="Card2Crypto wallet generation failed")
+            wallet_data = resp.json()
+    
+    if not wallet_data.get("address_in"):
+        raise HTTPException(status_code=502, detail="Card2Crypto did not return encrypted address")
+    return wallet_data
+
+
+def card2crypto_payment_url(address_in: str, total_price: float, email: Optional[str]) -> str:
+    """Hosted payment page (multiple providers). address_in is already URL-encoded by Card2Crypto."""
+    email_encoded = urllib.parse.quote(email or "customer@quantum.io", safe='')
+    return (
+        f"{CARD2CRYPTO_PAY_BASE}/pay.php"
+        f"?address={address_in}"
+        f"&amount={total_price:.2f}"
+        f"&email={email_encoded}"
+        f"&currency=USD"
+    )
+
+
+async def claim_pooled_card2crypto_wallet(host_url: str) -> Optional[dict]:
+    """Take a pre-generated wallet (and its reserved purchase_id) for this host, if the pool has one"""
+    if CARD2CRYPTO_POOL_SIZE <= 0:
+        return None
+    
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=CARD2CRYPTO_POOL_MAX_AGE)
+    entry = await card2crypto_wallet_pool.find_one_and_delete(
+        {"host_url": host_url.rstrip('/'), "created_at": {"$gt": cutoff}},
+        projection=PROJECTIONS["card2crypto_pool_entry"],
+        sort=[("created_at", 1)]
     )
+    if entry:
+        _card2crypto_pool_wakeup.set()
+    return entry
+
+
+async def refill_card2crypto_pool():
+    """Top the pool up to CARD2CRYPTO_POOL_SIZE wallets per configured host"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=CARD2CRYPTO_POOL_MAX_AGE)
+    
+    for host_url in CARD2CRYPTO_POOL_HOSTS:
+        await card2crypto_wallet_pool.delete_many({"host_url": host_url, "created_at": {"$lte": cutoff}})
+        missing = CARD2CRYPTO_POOL_SIZE - await card2crypto_wallet_pool.count_documents({"host_url": host_url})
+        if missing <= 0:
+            continue
+        
+        purchase_ids = [str(uuid.uuid4()) for _ in range(missing)]
+        results = await asyncio.gather(
+            *(generate_card2crypto_wallet(pid, host_url) for pid in purchase_ids),
+            return_exceptions=True
+        )
+        
+        entries = [{
+            "purchase_id": pid,
+            "host_url": host_url,
+            "address_in": wallet_data["address_in"],
+            "polygon_address_in": wallet_data.get("polygon_address_in"),
+            "created_at": datetime.now(timezone.utc)
+        } for pid, wallet_data in zip(purchase_ids, results) if not isinstance(wallet_data, Exception)]
+        
+        if entries:
+            await card2crypto_wallet_pool.insert_many(entries)
+        if len(entries) < missing:
+            print(f"[Card2Crypto Pool] {missing - len(entries)} wallet generations failed for {host_url}")
+
+
+async def run_card2crypto_pool_worker():
+    """Background loop: refill the pool on startup, after each claim, and periodically"""
+    _query_counter.set(QueryCounter("worker:card2crypto_pool"))
+    while True:
+        try:
+            await refill_card2crypto_pool()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Card2Crypto Pool] Refill failed: {str(e)}")
+        
+        try:
+            await asyncio.wait_for(_card2crypto_pool_wakeup.wait(), CARD2CRYPTO_POOL_REFILL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _card2crypto_pool_wakeup.clear()
 
 
 # ============== API ENDPOINTS ==============
@@ -1223,18 +2537,54 @@ async def health_check():
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
 
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus scrape endpoint (aggregated across workers in multiprocess mode)"""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """In-process cache sizes and hit ratios, and the SOL price feed state (per worker)"""
+    return {
+        "pid": os.getpid(),
+        "user_cache": user_cache.stats(),
+        "sol_price": sol_price_feed.status()
+    }
+
+
 @app.post("/api/presale/purchase", response_model=PreSalePurchaseResponse)
 async def create_presale_purchase(purchase: PreSalePurchaseRequest):
-    """Create a pre-sale purchase (Card2Crypto for card, manual for crypto)"""
+    """
+    Create a pre-sale purchase (Card2Crypto for card, manual for crypto).
+    For card payments the encrypted wallet comes from the pre-generated pool when
+    available; otherwise it is requested from Card2Crypto concurrently with the
+    registration and purchase writes.
+    """
+    wallet_task = None
     
     try:
         if purchase.tokenAmount < MIN_PURCHASE:
             raise HTTPException(status_code=400, detail=f"Minimum purchase is {MIN_PURCHASE} tokens")
         
         total_price = float(purchase.tokenAmount) * TOKEN_PRICE
+        purchase_id = str(uuid.uuid4())
+        
+        # Start the Card2Crypto round trip first so it overlaps with our own writes
+        pooled_wallet = None
+        if purchase.paymentMethod == "card":
+            pooled_wallet = await claim_pooled_card2crypto_wallet(purchase.hostUrl)
+            if pooled_wallet:
+                purchase_id = pooled_wallet["purchase_id"]
+            else:
+                wallet_task = asyncio.ensure_future(generate_card2crypto_wallet(purchase_id, purchase.hostUrl))
         
         # Register user in MLM system
-        existing_user = await get_user_by_wallet(purchase.walletAddress)
+        existing_user = await get_user_by_wallet(purchase.walletAddress, "exists")
         if not existing_user:
             await register_affiliate(UserCreate(
                 wallet_public_key=purchase.walletAddress,
@@ -1243,7 +2593,6 @@ async def create_presale_purchase(purchase: PreSalePurchaseRequest):
         
         # CRYPTO PAYMENT - Return Solana address
         if purchase.paymentMethod == "crypto":
-            purchase_id = str(uuid.uuid4())
             purchase_doc = {
                 "purchase_id": purchase_id,
                 "firstName": purchase.firstName,
@@ -1270,36 +2619,7 @@ async def create_presale_purchase(purchase: PreSalePurchaseRequest):
         
         # CARD PAYMENT - Use Card2Crypto
         elif purchase.paymentMethod == "card":
-            purchase_id = str(uuid.uuid4())
-            
-            # Step 1: Generate encrypted wallet via Card2Crypto
-            callback_url = f"{purchase.hostUrl}/api/payments/callback?pid={purchase_id}"
-            encoded_callback = urllib.parse.quote(callback_url, safe='')
-            
-            wallet_url = f"{CARD2CRYPTO_API_BASE}/wallet.php?address={CARD2CRYPTO_PAYOUT_WALLET}&callback={encoded_callback}"
-            
-            async with httpx.AsyncClient(timeout=15.0) as http_client:
-                resp = await http_client.get(wallet_url)
-                if resp.status_code != 200:
-                    raise HTTPException(status_code=502, detail="Card2Crypto wallet generation failed")
-                wallet_data = resp.json()
-            
-            address_in = wallet_data.get("address_in")
-            if not address_in:
-                raise HTTPException(status_code=502, detail="Card2Crypto did not return encrypted address")
-            
-            # Step 2: Build payment URL (hosted page with multiple providers)
-            # address_in is already URL-encoded by Card2Crypto - pass as-is
-            email_encoded = urllib.parse.quote(purchase.email or "customer@quantum.io", safe='')
-            payment_url = (
-                f"{CARD2CRYPTO_PAY_BASE}/pay.php"
-                f"?address={address_in}"
-                f"&amount={total_price:.2f}"
-                f"&email={email_encoded}"
-                f"&currency=USD"
-            )
-            
-            # Store purchase in DB
+            # Store purchase in DB with its transaction embedded (wallet fields filled in below if generated inline)
             purchase_doc = {
                 "purchase_id": purchase_id,
                 "firstName": purchase.firstName,
@@ -1310,17 +2630,13 @@ async def create_presale_purchase(purchase: PreSalePurchaseRequest):
                 "totalPrice": total_price,
                 "paymentMethod": "card",
                 "paymentStatus": "pending",
-                "card2crypto_address_in": address_in,
-                "card2crypto_polygon_address": wallet_data.get("polygon_address_in"),
+                "card2crypto_address_in": pooled_wallet["address_in"] if pooled_wallet else None,
+                "card2crypto_polygon_address": pooled_wallet.get("polygon_address_in") if pooled_wallet else None,
                 "referralCode": purchase.referralCode,
                 "createdAt": datetime.now(timezone.utc),
                 "updatedAt": datetime.now(timezone.utc)
             }
-            await presale_purchases.insert_one(purchase_doc)
-            
-            # Store transaction
-            await payment_transactions.insert_one({
-                "purchase_id": purchase_id,
+            purchase_doc["transaction"] = {
                 "amount": total_price,
                 "currency": "usd",
                 "status": "pending",
@@ -1336,11 +2652,33 @@ async def create_presale_purchase(purchase: PreSalePurchaseRequest):
                 },
                 "createdAt": datetime.now(timezone.utc),
                 "updatedAt": datetime.now(timezone.utc)
-            })
+            }
+            
+            await presale_purchases.insert_one(purchase_doc)
+            
+            if pooled_wallet:
+                wallet_data = pooled_wallet
+            else:
+                try:
+                    wallet_data = await wallet_task
+                except HTTPException:
+                    await presale_purchases.update_one(
+                        {"purchase_id": purchase_id},
+                        {"$set": {"paymentStatus": "wallet_generation_failed", "updatedAt": datetime.now(timezone.utc)}}
+                    )
+                    raise
+                
+                await presale_purchases.update_one(
+                    {"purchase_id": purchase_id},
+                    {"$set": {
+                        "card2crypto_address_in": wallet_data["address_in"],
+                        "card2crypto_polygon_address": wallet_data.get("polygon_address_in")
+                    }}
+                )
             
             return PreSalePurchaseResponse(
                 success=True,
-                checkoutUrl=payment_url,
+                checkoutUrl=card2crypto_payment_url(wallet_data["address_in"], total_price, purchase.email),
                 sessionId=purchase_id,
                 message="Redirecting to payment"
             )
@@ -1353,62 +2691,150 @@ async def create_presale_purchase(purchase: PreSalePurchaseRequest):
     except Exception as e:
         print(f"Error creating purchase: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create purchase: {str(e)}")
+    finally:
+        if wallet_task and not wallet_task.done():
+            wallet_task.cancel()
+        elif wallet_task and not wallet_task.cancelled():
+            wallet_task.exception()  # mark any failure as retrieved
 
 
-@app.get("/api/payments/callback")
-async def card2crypto_callback(request: Request):
-    """
-    Card2Crypto payment callback - called via GET when payment is confirmed.
-    Params: pid (purchase_id), value_coin, coin, txid_in, txid_out
-    """
-    params = dict(request.query_params)
-    purchase_id = params.get("pid")
-    value_coin = params.get("value_coin")
-    coin = params.get("coin", "polygon_usdc")
-    txid_in = params.get("txid_in")
-    txid_out = params.get("txid_out")
-    
-    print(f"[Card2Crypto Callback] pid={purchase_id}, value={value_coin}, coin={coin}, txid_in={txid_in}, txid_out={txid_out}")
-    
-    if not purchase_id:
-        return {"error": "Missing purchase ID"}
-    
-    # Find the purchase
-    purchase = await presale_purchases.find_one({"purchase_id": purchase_id})
-    if not purchase:
-        print(f"[Card2Crypto Callback] Purchase not found: {purchase_id}")
-        return {"error": "Purchase not found"}
-    
-    # Already processed?
-    if purchase.get("paymentStatus") == "paid":
-        return {"status": "already_processed"}
+# ============== PURCHASE STATUS WAITERS ==============
+
+class PurchaseStatusWaiters:
+    """In-process events keyed by purchase_id, set when the purchase leaves pending"""
     
-    # Update purchase as paid
-    await presale_purchases.update_one(
-        {"purchase_id": purchase_id},
-        {"$set": {
-            "paymentStatus": "paid",
-            "card2crypto_value_coin": float(value_coin) if value_coin else 0,
-            "card2crypto_coin": coin,
-            "card2crypto_txid_in": txid_in,
-            "card2crypto_txid_out": txid_out,
-            "paidAt": datetime.now(timezone.utc),
-            "updatedAt": datetime.now(timezone.utc)
-        }}
-    )
+    def __init__(self):
+        self._events: Dict[str, asyncio.Event] = {}
+        self._counts: Dict[str, int] = {}
     
-    # Update transaction record
-    await payment_transactions.update_one(
-        {"purchase_id": purchase_id},
-        {"$set": {
-            "status": "paid",
-            "paymentStatus": "paid",
-            "card2crypto_value_coin": float(value_coin) if value_coin else 0,
-            "card2crypto_txid_in": txid_in,
-            "card2crypto_txid_out": txid_out,
-            "updatedAt": datetime.now(timezone.utc)
-        }}
+    @contextmanager
+    def watch(self, purchase_id: str):
+        event = self._events.get(purchase_id)
+        if event is None:
+            event = self._events[purchase_id] = asyncio.Event()
+        self._counts[purchase_id] = self._counts.get(purchase_id, 0) + 1
+        try:
+            yield event
+        finally:
+            self._counts[purchase_id] -= 1
+            if not self._counts[purchase_id]:
+                del self._counts[purchase_id]
+                del self._events[purchase_id]
+    
+    def waiting(self) -> List[str]:
+        return list(self._events)
+    
+    def notify(self, purchase_id: str):
+        event = self._events.get(purchase_id)
+        if event is not None:
+            event.set()
+
+
+purchase_status_waiters = PurchaseStatusWaiters()
+
+
+async def watch_purchase_status_changes():
+    """Wake waiters from a change stream on presale_purchases (requires a replica set)"""
+    pipeline = [
+        {"$match": {
+            "operationType": "update",
+            "updateDescription.updatedFields.paymentStatus": {"$exists": True}
+        }},
+        {"$project": {"documentKey": 1}},
+    ]
+    async with presale_purchases.watch(pipeline) as stream:
+        print("[Purchase Status] Watching presale_purchases change stream")
+        async for change in stream:
+            if not purchase_status_waiters.waiting():
+                continue
+            purchase = await presale_purchases.find_one(
+                {"_id": change["documentKey"]["_id"]}, {"_id": 0, "purchase_id": 1}
+            )
+            if purchase:
+                purchase_status_waiters.notify(purchase["purchase_id"])
+
+
+async def poll_purchase_status_changes():
+    """Fallback: one query per interval for all purchases waited on in this worker"""
+    print("[Purchase Status] Change streams unavailable, polling waited purchases")
+    while True:
+        await asyncio.sleep(PURCHASE_STATUS_POLL_INTERVAL)
+        waiting = purchase_status_waiters.waiting()
+        if not waiting:
+            continue
+        try:
+            async for purchase in presale_purchases.find(
+                {"purchase_id": {"$in": waiting}, "paymentStatus": {"$ne": "pending"}},
+                {"_id": 0, "purchase_id": 1}
+            ):
+                purchase_status_waiters.notify(purchase["purchase_id"])
+        except Exception as e:
+            print(f"[Purchase Status] Poll failed: {str(e)}")
+
+
+async def run_purchase_status_watcher():
+    """Wake long-poll requests for purchases settled by other workers"""
+    _query_counter.set(QueryCounter("worker:purchase_status"))
+    while True:
+        try:
+            await watch_purchase_status_changes()
+        except OperationFailure as e:
+            # Standalone server: $changeStream is only supported on replica sets
+            print(f"[Purchase Status] Change stream unavailable: {str(e)}")
+            await poll_purchase_status_changes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Purchase Status] Change stream interrupted: {str(e)}")
+            await asyncio.sleep(PURCHASE_STATUS_POLL_INTERVAL)
+
+
+# ============== PAYMENT OUTBOX ==============
+
+_outbox_wakeup = asyncio.Event()
+
+
+def new_outbox_event(event_type: str, payload: Optional[Dict] = None) -> dict:
+    """Outbox event embedded in the purchase document, written in the same update as the state change"""
+    return {
+        "event_id": str(uuid.uuid4()),
+        "type": event_type,
+        "payload": payload or {},
+        "status": "pending",
+        "attempts": 0,
+        "enqueued_at": datetime.now(timezone.utc)
+    }
+
+
+async def claim_outbox_event() -> Optional[dict]:
+    """Lease the oldest pending (or abandoned) outbox event"""
+    now = datetime.now(timezone.utc)
+    return await presale_purchases.find_one_and_update(
+        {"$or": [
+            {"outbox.status": "pending"},
+            {
+                "outbox.status": "processing",
+                "outbox.locked_until": {"$lt": now},
+                "outbox.attempts": {"$lt": OUTBOX_MAX_ATTEMPTS}
+            }
+        ]},
+        {
+            "$set": {
+                "outbox.status": "processing",
+                "outbox.locked_until": now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+            },
+            "$inc": {"outbox.attempts": 1}
+        },
+        projection=PROJECTIONS["purchase_outbox"],
+        sort=[("outbox.enqueued_at", 1)],
+        return_document=ReturnDocument.AFTER
     )
+
+
+async def handle_purchase_paid(purchase: dict):
+    """Side effects of a paid purchase. Every step is idempotent so the event can be replayed."""
+    purchase_id = purchase["purchase_id"]
+    payload = purchase["outbox"].get("payload", {})
     
     # Distribute MLM commissions
     await distribute_commissions(
@@ -1423,7 +2849,8 @@ async def card2crypto_callback(request: Request):
         await update_referral_stats(
             purchase["referralCode"],
             purchase["totalPrice"],
-            purchase["tokenAmount"]
+            purchase["tokenAmount"],
+            event_id=purchase_id
         )
     
     # Create notification for buyer
@@ -1432,21 +2859,159 @@ async def card2crypto_callback(request: Request):
         notification_type=NotificationType.SYSTEM,
         title="Paiement confirme !",
         body=f"Votre achat de {purchase['tokenAmount']} QTM (${purchase['totalPrice']:.2f}) a ete confirme.",
-        data={"purchase_id": purchase_id, "txid_out": txid_out}
+        data={"purchase_id": purchase_id, "txid_out": payload.get("txid_out")},
+        notification_id=f"{purchase_id}:paid"
+    )
+
+
+async def mark_purchase_paid(purchase_id: str, paid_fields: Dict, outbox_payload: Optional[Dict] = None) -> bool:
+    """
+    Atomically transition a purchase to paid and enqueue its purchase_paid outbox event.
+    Only one concurrent caller can win; returns False if the purchase was already paid or does not exist.
+    """
+    now = datetime.now(timezone.utc)
+    purchase = await presale_purchases.find_one_and_update(
+        {"purchase_id": purchase_id, "paymentStatus": {"$ne": "paid"}},
+        {"$set": {
+            **paid_fields,
+            "paymentStatus": "paid",
+            "paidAt": now,
+            "updatedAt": now,
+            "outbox": new_outbox_event("purchase_paid", outbox_payload)
+        }},
+        projection=PROJECTIONS["exists"]
+    )
+    if not purchase:
+        return False
+    
+    _outbox_wakeup.set()
+    purchase_status_waiters.notify(purchase_id)
+    return True
+
+
+OUTBOX_HANDLERS = {
+    "purchase_paid": handle_purchase_paid,
+}
+
+
+async def process_next_outbox_event() -> bool:
+    """Claim and process one outbox event. Returns False when the queue is empty."""
+    purchase = await claim_outbox_event()
+    if not purchase:
+        return False
+    
+    event = purchase["outbox"]
+    with user_lookup_scope():
+        await OUTBOX_HANDLERS[event["type"]](purchase)
+    
+    await presale_purchases.update_one(
+        {"purchase_id": purchase["purchase_id"], "outbox.event_id": event["event_id"]},
+        {
+            "$set": {"outbox.status": "done", "outbox.processed_at": datetime.now(timezone.utc)},
+            "$unset": {"outbox.locked_until": ""}
+        }
+    )
+    print(f"[Outbox] {event['type']} processed for {purchase['purchase_id']} (attempt {event['attempts']})")
+    return True
+
+
+async def run_outbox_worker():
+    """Background loop: drain the outbox, then sleep until woken up or the poll interval elapses"""
+    _query_counter.set(QueryCounter("worker:outbox"))
+    while True:
+        try:
+            while await process_next_outbox_event():
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Outbox] Event processing failed: {str(e)}")
+        
+        try:
+            await asyncio.wait_for(_outbox_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _outbox_wakeup.clear()
+
+
+@app.get("/api/payments/callback")
+async def card2crypto_callback(request: Request):
+    """
+    Card2Crypto payment callback - called via GET when payment is confirmed.
+    Params: pid (purchase_id), value_coin, coin, txid_in, txid_out
+    Marks the purchase paid and enqueues a purchase_paid outbox event in a single
+    conditional write, so concurrent callbacks for the same pid cannot both win;
+    commissions, stats and notifications run in the outbox worker.
+    """
+    params = dict(request.query_params)
+    purchase_id = params.get("pid")
+    value_coin = params.get("value_coin")
+    coin = params.get("coin", "polygon_usdc")
+    txid_in = params.get("txid_in")
+    txid_out = params.get("txid_out")
+    
+    print(f"[Card2Crypto Callback] pid={purchase_id}, value={value_coin}, coin={coin}, txid_in={txid_in}, txid_out={txid_out}")
+    
+    if not purchase_id:
+        return {"error": "Missing purchase ID"}
+    
+    # Update purchase and its embedded transaction as paid, and enqueue side effects (only the first callback wins)
+    now = datetime.now(timezone.utc)
+    won = await mark_purchase_paid(
+        purchase_id,
+        {
+            "card2crypto_value_coin": float(value_coin) if value_coin else 0,
+            "card2crypto_coin": coin,
+            "card2crypto_txid_in": txid_in,
+            "card2crypto_txid_out": txid_out,
+            "transaction.status": "paid",
+            "transaction.paymentStatus": "paid",
+            "transaction.card2crypto_value_coin": float(value_coin) if value_coin else 0,
+            "transaction.card2crypto_txid_in": txid_in,
+            "transaction.card2crypto_txid_out": txid_out,
+            "transaction.updatedAt": now
+        },
+        {"txid_out": txid_out}
     )
     
+    if not won:
+        # Already processed, or unknown purchase
+        if await presale_purchases.find_one({"purchase_id": purchase_id}, PROJECTIONS["exists"]):
+            return {"status": "already_processed"}
+        print(f"[Card2Crypto Callback] Purchase not found: {purchase_id}")
+        return {"error": "Purchase not found"}
+    
     print(f"[Card2Crypto Callback] Payment confirmed for {purchase_id}: ${value_coin} USDC")
     return {"status": "ok"}
 
 
-@app.get("/api/presale/status/{purchase_id}")
-async def get_presale_status(purchase_id: str):
-    """Get the status of a purchase"""
-    
-    purchase = await presale_purchases.find_one(
+async def find_purchase_status(purchase_id: str) -> Optional[dict]:
+    return await presale_purchases.find_one(
         {"purchase_id": purchase_id},
-        {"_id": 0}
+        PROJECTIONS["purchase_status"]
     )
+
+
+@app.get("/api/presale/status/{purchase_id}")
+async def get_presale_status(purchase_id: str, wait: int = Query(0, ge=0, le=PURCHASE_STATUS_MAX_WAIT)):
+    """
+    Get the status of a purchase.
+    With `wait` (seconds), a pending purchase holds the request until its status changes
+    or the wait elapses, replacing repeated polling from the checkout return page.
+    """
+    
+    if not wait:
+        purchase = await find_purchase_status(purchase_id)
+    else:
+        # Register before reading so a transition in between is not missed
+        with purchase_status_waiters.watch(purchase_id) as changed:
+            purchase = await find_purchase_status(purchase_id)
+            if purchase and purchase.get("paymentStatus") == "pending":
+                try:
+                    await asyncio.wait_for(changed.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                purchase = await find_purchase_status(purchase_id)
     
     if not purchase:
         raise HTTPException(status_code=404, detail="Purchase not found")
@@ -1491,6 +3056,474 @@ async def get_config():
     }
 
 
+# ============== ON-CHAIN PAYMENT SCANNER ==============
+
+ASSET_SYMBOLS = {USDC_MINT: "USDC", USDT_MINT: "USDT"}
+
+
+def treasury_transfers(transaction: dict, address: str = SOLANA_WALLET_ADDRESS) -> List[dict]:
+    """
+    Net balance changes of `address` in a jsonParsed transaction, one per asset (signed amounts).
+    The counterparty is the account whose balance moved the most in the opposite direction.
+    """
+    meta = transaction.get("meta") or {}
+    if meta.get("err") is not None:
+        return []
+    keys = [k["pubkey"] if isinstance(k, dict) else k for k in transaction["transaction"]["message"]["accountKeys"]]
+    transfers = []
+    
+    # SOL: lamport balance deltas
+    lamport_deltas = [post - pre for pre, post in zip(meta.get("preBalances", []), meta.get("postBalances", []))]
+    if address in keys:
+        own = lamport_deltas[keys.index(address)]
+        if own:
+            opposite = [(abs(d), keys[i]) for i, d in enumerate(lamport_deltas) if d * own < 0]
+            transfers.append({
+                "asset": "SOL",
+                "mint": None,
+                "amount": own / 1e9,
+                "counterparty": max(opposite)[1] if opposite else None,
+            })
+    
+    # SPL tokens: per (owner, mint) token balance deltas
+    token_deltas: Dict[tuple, int] = {}
+    decimals: Dict[str, int] = {}
+    for balances, sign in ((meta.get("preTokenBalances") or [], -1), (meta.get("postTokenBalances") or [], 1)):
+        for balance in balances:
+            key = (balance.get("owner"), balance["mint"])
+            token_deltas[key] = token_deltas.get(key, 0) + sign * int(balance["uiTokenAmount"]["amount"])
+            decimals[balance["mint"]] = balance["uiTokenAmount"]["decimals"]
+    for (owner, mint), own in token_deltas.items():
+        if owner != address or not own:
+            continue
+        opposite = [(abs(d), o) for (o, m), d in token_deltas.items() if m == mint and d * own < 0]
+        transfers.append({
+            "asset": ASSET_SYMBOLS.get(mint, mint),
+            "mint": mint,
+            "amount": own / 10 ** decimals[mint],
+            "counterparty": max(opposite)[1] if opposite else None,
+        })
+    
+    return transfers
+
+
+async def fetch_new_signatures(address: str, until: Optional[str], since: Optional[float]) -> List[dict]:
+    """
+    Page getSignaturesForAddress back to the `until` cursor (or to `since` block time on a first scan).
+    Returns signatures oldest first; raises if a page cannot be fetched so the cursor never skips ahead.
+    """
+    signatures = []
+    before = None
+    while True:
+        options = {"limit": CHAIN_SCANNER_PAGE_SIZE, "commitment": "finalized"}
+        if until:
+            options["until"] = until
+        if before:
+            options["before"] = before
+        page = await solana_rpc_call("getSignaturesForAddress", [address, options])
+        if not isinstance(page, list):
+            raise RuntimeError("getSignaturesForAddress failed on every endpoint")
+        
+        for entry in page:
+            if since and (entry.get("blockTime") or 0) < since:
+                return signatures[::-1]
+            signatures.append(entry)
+        if len(page) < CHAIN_SCANNER_PAGE_SIZE:
+            return signatures[::-1]
+        before = page[-1]["signature"]
+
+
+async def match_treasury_payments(transactions: List[tuple], sol_price: float) -> int:
+    """Mark pending crypto purchases paid from incoming SOL/USDC/USDT transfers, matched by sender wallet and amount"""
+    incoming = []
+    for signature, transaction in transactions:
+        for transfer in treasury_transfers(transaction):
+            if transfer["amount"] > 0 and transfer["asset"] in CHAIN_PAYMENT_TOLERANCE and transfer["counterparty"]:
+                value_usd = transfer["amount"] * (sol_price if transfer["asset"] == "SOL" else 1)
+                incoming.append((signature, transfer, value_usd))
+    if not incoming:
+        return 0
+    
+    # One query each for already-applied signatures and for the senders' pending purchases
+    applied = {
+        p["onchain_signature"] async for p in presale_purchases.find(
+            {"onchain_signature": {"$in": [signature for signature, _, _ in incoming]}},
+            PROJECTIONS["purchase_onchain_signature"]
+        )
+    }
+    pending = await presale_purchases.find(
+        {
+            "walletAddress": {"$in": list({t["counterparty"] for _, t, _ in incoming})},
+            "paymentMethod": "crypto",
+            "paymentStatus": "pending_manual_transfer"
+        },
+        PROJECTIONS["purchase_payment_match"]
+    ).sort("createdAt", 1).to_list(length=None)
+    
+    paid = 0
+    for signature, transfer, value_usd in incoming:
+        if signature in applied:
+            continue
+        tolerance = CHAIN_PAYMENT_TOLERANCE[transfer["asset"]]
+        purchase = next((
+            p for p in pending
+            if p["walletAddress"] == transfer["counterparty"]
+            and abs(value_usd - p["totalPrice"]) <= tolerance * p["totalPrice"]
+        ), None)
+        if not purchase:
+            print(f"[Chain Scanner] Unmatched {transfer['amount']} {transfer['asset']} from {transfer['counterparty']} ({signature})")
+            continue
+        
+        try:
+            won = await mark_purchase_paid(
+                purchase["purchase_id"],
+                {
+                    "onchain_signature": signature,
+                    "onchain_asset": transfer["asset"],
+                    "onchain_amount": transfer["amount"],
+                    "onchain_sender": transfer["counterparty"],
+                    "onchain_value_usd": round(value_usd, 2),
+                },
+                {"txid_out": signature}
+            )
+        except DuplicateKeyError:
+            won = False  # signature already applied by another worker
+        
+        pending.remove(purchase)
+        applied.add(signature)
+        if won:
+            paid += 1
+            print(f"[Chain Scanner] {transfer['amount']} {transfer['asset']} ({signature}) paid purchase {purchase['purchase_id']}")
+    
+    return paid
+
+
+def datetime_to_timestamp(value: datetime) -> float:
+    """Mongo returns naive UTC datetimes"""
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+async def scan_treasury_payments(address: str = SOLANA_WALLET_ADDRESS) -> int:
+    """
+    Process treasury signatures newer than the persisted cursor, in batched getTransaction calls,
+    matching payments and recording ledger deltas. The cursor advances past each processed batch; a transaction that cannot be fetched stops the
+    scan there so it is retried next time. Returns the number of purchases marked paid.
+    """
+    sol_price = await get_sol_price_usd()
+    if sol_price <= 0:
+        print("[Chain Scanner] SOL price unavailable, skipping scan")
+        return 0
+    
+    state = await chain_cursors.find_one({"cursor_id": "payment_scanner"}, PROJECTIONS["chain_cursor"])
+    until = state.get("signature") if state else None
+    since = None
+    if not until:
+        # First scan: go back to the oldest purchase still waiting for a transfer
+        oldest = await presale_purchases.find_one(
+            {"paymentStatus": "pending_manual_transfer"},
+            PROJECTIONS["purchase_created"],
+            sort=[("createdAt", 1)]
+        )
+        since = datetime_to_timestamp(oldest["createdAt"]) if oldest else time.time()
+    
+    signatures = await fetch_new_signatures(address, until, since)
+    paid = 0
+    for start in range(0, len(signatures), CHAIN_SCANNER_TX_BATCH):
+        batch = signatures[start:start + CHAIN_SCANNER_TX_BATCH]
+        # Failed transactions move no funds and are not fetched
+        to_fetch = [entry["signature"] for entry in batch if entry.get("err") is None]
+        results = dict(zip(to_fetch, await solana_rpc_batch("getTransaction", [
+            [signature, {"encoding": "jsonParsed", "maxSupportedTransactionVersion": 0, "commitment": "finalized"}]
+            for signature in to_fetch
+        ])))
+        
+        processed, fetched = [], []
+        for entry in batch:
+            signature = entry["signature"]
+            if signature in results:
+                if results[signature] is None:
+                    break
+                fetched.append((signature, results[signature]))
+            processed.append(signature)
+        
+        paid += await match_treasury_payments(fetched, sol_price)
+        await record_treasury_deltas(fetched, sol_price)
+        if processed:
+            await chain_cursors.update_one(
+                {"cursor_id": "payment_scanner"},
+                {"$set": {"signature": processed[-1], "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        if len(processed) < len(batch):
+            print(f"[Chain Scanner] Could not fetch transaction {batch[len(processed)]['signature']}, will retry")
+            break
+    
+    return paid
+
+
+async def run_chain_payment_scanner():
+    """Background loop matching incoming treasury transfers to pending crypto purchases"""
+    _query_counter.set(QueryCounter("worker:chain_scanner"))
+    while True:
+        try:
+            await scan_treasury_payments()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[Chain Scanner] Scan failed: {str(e)}")
+        await asyncio.sleep(CHAIN_SCANNER_INTERVAL)
+
+
+# ============== TREASURY LEDGER ==============
+
+def treasury_valuation(state: dict, sol_price: float) -> dict:
+    """Value ledger balances: SOL at the current price, stablecoins 1:1, other mints at their last reconciled price"""
+    balances = state.get("balances", {})
+    prices = state.get("prices", {})
+    sol_balance = balances.get("SOL", 0)
+    sol_usd = sol_balance * sol_price if sol_price > 0 else 0
+    total_usd = sol_usd
+    token_details = []
+    for mint, amount in balances.items():
+        if mint in ("SOL", QUANTUM_MINT):
+            continue
+        usd = amount * (1.0 if mint in ASSET_SYMBOLS else prices.get(mint, 0))
+        if usd > 0:
+            total_usd += usd
+            token_details.append({"name": ASSET_SYMBOLS.get(mint, mint[:8]), "amount": amount, "usd": round(usd, 2)})
+    
+    return {
+        "total_usd": round(total_usd, 2),
+        "sol_balance": round(sol_balance, 4),
+        "sol_price_usd": sol_price,
+        "sol_value_usd": round(sol_usd, 2),
+        "tokens": token_details,
+    }
+
+
+def transfers_usd(transfers: List[dict], sol_price: float, prices: Dict) -> float:
+    usd = 0.0
+    for transfer in transfers:
+        if transfer["asset"] == "SOL":
+            usd += transfer["amount"] * sol_price
+        elif transfer["mint"] in ASSET_SYMBOLS:
+            usd += transfer["amount"]
+        elif transfer["mint"] != QUANTUM_MINT:
+            usd += transfer["amount"] * prices.get(transfer["mint"], 0)
+    return usd
+
+
+async def record_treasury_deltas(transactions: List[tuple], sol_price: float):
+    """
+    Append ledger entries for scanned treasury transactions and apply their deltas to the balances.
+    Transactions at or before the last reconciliation snapshot are already in the balances and skipped.
+    A crash between the entry insert and the balance update loses that delta until the next reconciliation.
+    """
+    state = await treasury_balances.find_one({"address": SOLANA_WALLET_ADDRESS}, PROJECTIONS["treasury_state"])
+    if not state:
+        return  # no baseline yet, the first reconciliation creates it
+    
+    for signature, transaction in transactions:
+        if transaction["slot"] <= state["baseline_slot"]:
+            continue
+        transfers = [t for t in treasury_transfers(transaction) if t["mint"] != QUANTUM_MINT]
+        if not transfers:
+            continue
+        
+        usd_delta = transfers_usd(transfers, sol_price, state.get("prices", {}))
+        entry = await treasury_ledger.update_one(
+            {"signature": signature},
+            {"$setOnInsert": {
+                "kind": "transfer",
+                "slot": transaction["slot"],
+                "block_time": datetime.fromtimestamp(transaction.get("blockTime") or time.time(), timezone.utc),
+                "deltas": transfers,
+                "usd_delta": round(usd_delta, 2),
+            }},
+            upsert=True
+        )
+        if not entry.upserted_id:
+            continue  # already applied
+        
+        state = await treasury_balances.find_one_and_update(
+            {"address": SOLANA_WALLET_ADDRESS},
+            {"$inc": {f"balances.{t['mint'] or 'SOL'}": t["amount"] for t in transfers}},
+            projection=PROJECTIONS["treasury_state"],
+            return_document=ReturnDocument.AFTER
+        )
+        await treasury_ledger.update_one(
+            {"signature": signature},
+            {"$set": {"raised_usd": treasury_valuation(state, sol_price)["total_usd"]}}
+        )
+
+
+async def reconcile_treasury_ledger() -> dict:
+    """
+    Full on-chain re-valuation: reset the ledger balances to the snapshot and record the drift.
+    An incomplete snapshot (an RPC call failed) is returned but not persisted.
+    """
+    wallet_data = await get_wallet_total_value_usd()
+    if wallet_data["slot"] is None:
+        print("[Treasury] Reconciliation skipped: balance snapshot incomplete")
+        return wallet_data
+    
+    now = datetime.now(timezone.utc)
+    previous = await treasury_balances.find_one_and_update(
+        {"address": SOLANA_WALLET_ADDRESS},
+        {"$set": {
+            "balances": wallet_data["balances"],
+            "prices": wallet_data["prices"],
+            "baseline_slot": wallet_data["slot"],
+            "reconciled_at": now,
+        }},
+        projection=PROJECTIONS["treasury_state"],
+        upsert=True
+    )
+    drift = wallet_data["total_usd"] - treasury_valuation(previous, wallet_data["sol_price_usd"])["total_usd"] if previous else 0
+    await treasury_ledger.insert_one({
+        "kind": "reconciliation",
+        "slot": wallet_data["slot"],
+        "block_time": now,
+        "raised_usd": wallet_data["total_usd"],
+        "drift_usd": round(drift, 2),
+    })
+    print(f"[Treasury] Reconciled at slot {wallet_data['slot']}: ${wallet_data['total_usd']} (drift ${drift:.2f})")
+    return wallet_data
+
+
+async def get_treasury_value() -> dict:
+    """Treasury value from the ledger; falls back to a full re-valuation when reconciliation is due"""
+    state = await treasury_balances.find_one({"address": SOLANA_WALLET_ADDRESS}, PROJECTIONS["treasury_state"])
+    if not state or time.time() - datetime_to_timestamp(state["reconciled_at"]) > TREASURY_RECONCILE_INTERVAL:
+        wallet_data = await reconcile_treasury_ledger()
+        if wallet_data["slot"] is not None or not state:
+            return wallet_data
+    
+    return treasury_valuation(state, await get_sol_price_usd())
+
+
+@app.get("/api/presale/treasury/history")
+async def get_treasury_history(days: int = Query(30, ge=1, le=365), limit: int = Query(1000, ge=1, le=5000)):
+    """Raised-over-time points from the treasury ledger (latest `limit` within `days`), for the progress chart"""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    entries = await treasury_ledger.find(
+        {"block_time": {"$gte": since}, "raised_usd": {"$exists": True}},
+        PROJECTIONS["treasury_history"]
+    ).sort("block_time", -1).limit(limit).to_list(length=limit)
+    
+    return {
+        "points": [
+            {
+                "timestamp": e["block_time"].isoformat(),
+                "raised_usd": e["raised_usd"],
+                "kind": e["kind"],
+                "usd_delta": e.get("usd_delta"),
+                "drift_usd": e.get("drift_usd"),
+                "signature": e.get("signature"),
+            }
+            for e in reversed(entries)
+        ]
+    }
+
+
+# ============== STARTUP ==============
+
+INDEXES = [
+    (notifications_collection, [("wallet", 1), ("created_at", -1)], {}),
+    (notifications_collection, [("wallet", 1), ("read", 1), ("created_at", -1)], {}),
+    (notifications_collection, [("notification_id", 1)], {}),
+    (notification_state_collection, [("wallet", 1)], {"unique": True}),
+    (affiliate_commissions, [("event_id", 1), ("beneficiary_user_id", 1), ("level", 1)], {"unique": True}),
+    (affiliate_leaderboard, [("window", 1), ("period", 1), ("wallet", 1)], {"unique": True}),
+    (affiliate_leaderboard, [("window", 1), ("period", 1), ("earnings", -1), ("wallet", 1)], {}),
+    (affiliate_leaderboard, [("window", 1), ("period", 1), ("referrals", -1), ("wallet", 1)], {}),
+    (affiliate_leaderboard, [("expires_at", 1)], {"expireAfterSeconds": 0}),
+    (presale_purchases, [("purchase_id", 1)], {}),
+    (presale_purchases, [("outbox.status", 1), ("outbox.enqueued_at", 1)], {"sparse": True}),
+    (presale_purchases, [("walletAddress", 1), ("paymentStatus", 1), ("createdAt", 1)], {}),
+    (presale_purchases, [("onchain_signature", 1)], {"unique": True, "sparse": True}),
+    (chain_cursors, [("cursor_id", 1)], {"unique": True}),
+    (treasury_balances, [("address", 1)], {"unique": True}),
+    (treasury_ledger, [("signature", 1)], {"unique": True, "sparse": True}),
+    (treasury_ledger, [("block_time", -1)], {}),
+    (presale_progress_history, [("timestamp", 1)], {}),
+    (referral_data, [("referralCode", 1)], {}),
+    (card2crypto_wallet_pool, [("host_url", 1), ("created_at", 1)], {}),
+]
+
+_background_tasks: set = set()
+
+
+@app.on_event("startup")
+async def ensure_timeseries_collections():
+    """Create the progress history as a time-series collection (MongoDB 5.0+; a plain collection otherwise)"""
+    try:
+        await db.create_collection(
+            presale_progress_history.name,
+            timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "minutes"}
+        )
+    except CollectionInvalid:
+        pass  # already exists
+    except Exception as e:
+        print(f"[Startup] Time-series collection unavailable, using a plain collection: {str(e)}")
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    """Create the indexes backing the hot query paths"""
+    for collection, keys, options in INDEXES:
+        try:
+            await collection.create_index(keys, **options)
+        except Exception as e:
+            print(f"[Startup] Index creation failed on {collection.name} {keys}: {str(e)}")
+
+
+def start_background_task(coro):
+    """Run a coroutine for the lifetime of the app, keeping a reference so it is not collected"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+@app.on_event("startup")
+async def start_outbox_worker():
+    start_background_task(run_outbox_worker())
+
+
+@app.on_event("startup")
+async def start_purchase_status_watcher():
+    start_background_task(run_purchase_status_watcher())
+
+
+@app.on_event("startup")
+async def start_chain_payment_scanner():
+    if CHAIN_SCANNER_INTERVAL > 0:
+        start_background_task(run_chain_payment_scanner())
+
+
+@app.on_event("startup")
+async def start_card2crypto_pool_worker():
+    if CARD2CRYPTO_POOL_SIZE > 0 and CARD2CRYPTO_POOL_HOSTS:
+        start_background_task(run_card2crypto_pool_worker())
+
+
+@app.on_event("startup")
+async def start_sol_price_feed():
+    if SOL_PRICE_REFRESH_INTERVAL > 0:
+        start_background_task(run_sol_price_refresher())
+    if SOL_PRICE_STREAM:
+        start_background_task(run_sol_price_stream())
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in list(_background_tasks):
+        task.cancel()
+    if tracer_provider is not None:
+        tracer_provider.shutdown()  # flush buffered spans
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8001))
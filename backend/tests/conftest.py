@@ -0,0 +1,73 @@
+"""
+Shared fixtures for tests that run the backend in-process against a local MongoDB.
+Set MONGO_URL (e.g. mongodb://localhost:27017); these tests are skipped otherwise.
+"""
+
+import pytest
+import os
+import sys
+import uuid
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def local_mongo_available() -> bool:
+    mongo_url = os.environ.get("MONGO_URL")
+    if not mongo_url:
+        return False
+    try:
+        from pymongo import MongoClient
+        MongoClient(mongo_url, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except Exception:
+        return False
+
+
+@pytest.fixture
+def mongo_db(monkeypatch):
+    """
+    Point every server collection at a throwaway database on the local MongoDB.
+    The Motor client is created per test so it binds to that test's event loop.
+    """
+    if not local_mongo_available():
+        pytest.skip("local MongoDB not available (set MONGO_URL)")
+
+    from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
+    from pymongo import MongoClient
+    import server
+
+    db_name = f"quantum_test_{uuid.uuid4().hex[:8]}"
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], event_listeners=server.mongo_event_listeners)
+    test_db = client[db_name]
+
+    for name, value in list(vars(server).items()):
+        if isinstance(value, AsyncIOMotorCollection):
+            monkeypatch.setattr(server, name, test_db[value.name])
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", test_db)
+    monkeypatch.setattr(server, "user_cache", server.UserCache(server.USER_CACHE_MAX_SIZE, server.USER_CACHE_NEGATIVE_TTL))
+
+    yield test_db
+
+    MongoClient(os.environ["MONGO_URL"]).drop_database(db_name)
+
+
+@pytest.fixture
+def max_queries():
+    """
+    Assert an upper bound on the MongoDB commands issued inside a block, as counted by the
+    server's command listener:
+
+        with max_queries(3, "get_affiliate_stats"):
+            asyncio.run(server.get_affiliate_stats(...))
+    """
+    import server
+
+    @contextmanager
+    def check(limit: int, endpoint: str = "test"):
+        with server.mongo_query_scope(endpoint) as queries:
+            yield queries
+        assert queries.count <= limit, f"{endpoint} issued {queries.count} MongoDB commands (max {limit})"
+
+    return check
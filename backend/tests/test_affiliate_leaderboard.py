@@ -0,0 +1,88 @@
+"""
+Affiliate leaderboard tests (in-process, local MongoDB)
+Tests for:
+- Commissions and relations increment earnings and referral totals in every window
+- Replayed commission events leave the leaderboard unchanged
+- Reads return the current period only, ranked, limited and without zero entries
+- A rebuild from the source collections matches the incremental totals
+"""
+
+import pytest
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import server
+from server import UserCreate
+
+
+async def seed_network():
+    """ROOT <- MID <- BUYER1, BUYER2 and ROOT <- SOLO, with purchases by both buyers"""
+    root = await server.register_affiliate(UserCreate(wallet_public_key="ROOT"))
+    mid = await server.register_affiliate(UserCreate(wallet_public_key="MID", referral_code_used=root.referral_code))
+    await server.register_affiliate(UserCreate(wallet_public_key="SOLO", referral_code_used=root.referral_code))
+    for buyer in ["BUYER1", "BUYER2"]:
+        await server.register_affiliate(UserCreate(wallet_public_key=buyer, referral_code_used=mid.referral_code))
+    await server.distribute_commissions("BUYER1", 100.0, "presale_purchase", "p-1")
+    await server.distribute_commissions("BUYER2", 300.0, "presale_purchase", "p-2")
+
+
+def leaderboard(metric: str, window: str = "all", limit: int = 10) -> list:
+    response = asyncio.run(server.get_affiliate_leaderboard(metric=metric, window=window, limit=limit))
+    return [(e.rank, e.wallet_public_key, e.earnings if metric == "earnings" else e.referrals) for e in response.entries]
+
+
+class TestLeaderboard:
+
+    def test_earnings_and_referrals(self, mongo_db):
+        asyncio.run(seed_network())
+        level1, level2 = server.COMMISSION_RATES[1], server.COMMISSION_RATES[2]
+
+        for window in server.LEADERBOARD_WINDOWS:
+            earnings = leaderboard("earnings", window)
+            assert [(rank, wallet) for rank, wallet, _ in earnings] == [(1, "MID"), (2, "ROOT")]
+            assert earnings[0][2] == pytest.approx(400.0 * level1)
+            assert earnings[1][2] == pytest.approx(400.0 * level2)
+            assert leaderboard("referrals", window) == [(1, "ROOT", 4), (2, "MID", 2)]
+
+    def test_replayed_event_not_counted(self, mongo_db):
+        async def scenario():
+            await seed_network()
+            await server.distribute_commissions("BUYER1", 100.0, "presale_purchase", "p-1")
+
+        asyncio.run(scenario())
+        assert leaderboard("earnings")[0][2] == pytest.approx(400.0 * server.COMMISSION_RATES[1])
+
+    def test_current_period_only(self, mongo_db):
+        yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+
+        async def scenario():
+            await seed_network()
+            await server.record_leaderboard({"OLD": {"earnings": 10000.0}}, yesterday)
+
+        asyncio.run(scenario())
+        assert "OLD" not in [wallet for _, wallet, _ in leaderboard("earnings", "day")]
+        assert leaderboard("earnings", "all", limit=1)[0][1] == "OLD"
+
+    def test_period_keys(self):
+        at = datetime(2027, 1, 1, 12, tzinfo=timezone.utc)
+        assert server.leaderboard_period("day", at) == "2027-01-01"
+        assert server.leaderboard_period("week", at) == "2026-W53"
+        assert server.leaderboard_period("all", at) == "all"
+
+    def test_rebuild_matches_incremental(self, mongo_db):
+        def snapshot():
+            return {
+                (metric, window): leaderboard(metric, window)
+                for metric in server.LEADERBOARD_METRICS for window in server.LEADERBOARD_WINDOWS
+            }
+
+        asyncio.run(seed_network())
+        incremental = snapshot()
+        asyncio.run(server.ensure_indexes())
+        asyncio.run(server.rebuild_affiliate_leaderboard())
+        rebuilt = snapshot()
+
+        assert rebuilt.keys() == incremental.keys()
+        for key, rows in incremental.items():
+            assert [(rank, wallet) for rank, wallet, _ in rebuilt[key]] == [(rank, wallet) for rank, wallet, _ in rows]
+            assert [value for _, _, value in rebuilt[key]] == pytest.approx([value for _, _, value in rows])
@@ -0,0 +1,57 @@
+"""
+Card2Crypto callback concurrency tests (in-process, local MongoDB)
+Tests for:
+- Parallel callbacks for the same pid: exactly one wins the paid-state transition
+- Commissions are distributed once regardless of how many callbacks raced
+- Unknown purchase ids are still reported as not found
+"""
+
+import pytest
+import asyncio
+import uuid
+
+import server
+from server import UserCreate
+
+
+class FakeRequest:
+    def __init__(self, **params):
+        self.query_params = params
+
+
+class TestCallbackConcurrency:
+
+    def test_parallel_callbacks_single_winner(self, mongo_db):
+        async def scenario():
+            referrer = await server.register_affiliate(UserCreate(wallet_public_key="REFERRER"))
+            await server.register_affiliate(UserCreate(wallet_public_key="BUYER", referral_code_used=referrer.referral_code))
+
+            purchase_id = str(uuid.uuid4())
+            await server.presale_purchases.insert_one({
+                "purchase_id": purchase_id,
+                "walletAddress": "BUYER",
+                "tokenAmount": 1000,
+                "totalPrice": 200.0,
+                "paymentMethod": "card",
+                "paymentStatus": "pending",
+            })
+
+            responses = await asyncio.gather(*(
+                server.card2crypto_callback(FakeRequest(pid=purchase_id, value_coin="200", txid_out=f"0x{i}"))
+                for i in range(20)
+            ))
+
+            while await server.process_next_outbox_event():
+                pass
+
+            commissions = await server.affiliate_commissions.count_documents({"event_id": purchase_id})
+            return [r.get("status") for r in responses], commissions
+
+        statuses, commissions = asyncio.run(scenario())
+        assert statuses.count("ok") == 1
+        assert statuses.count("already_processed") == 19
+        assert commissions == 1
+
+    def test_unknown_purchase(self, mongo_db):
+        response = asyncio.run(server.card2crypto_callback(FakeRequest(pid="does-not-exist")))
+        assert response == {"error": "Purchase not found"}
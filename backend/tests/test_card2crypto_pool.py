@@ -0,0 +1,132 @@
+"""
+Card2Crypto wallet pool tests (in-process, local MongoDB, local Card2Crypto stub)
+Tests for:
+- The pool is refilled with pre-generated wallets bound to reserved purchase ids
+- Checkout from the pool never waits on Card2Crypto
+- Without a pooled wallet, the upstream call overlaps with the purchase writes
+- Upstream failures mark the purchase and surface a 502
+"""
+
+import pytest
+import asyncio
+import json
+import time
+import urllib.parse
+
+import server
+from fastapi import HTTPException
+from server import PreSalePurchaseRequest
+
+STUB_LATENCY = 0.3
+HOST = "http://checkout.test"
+
+
+class Card2CryptoStub:
+    """Minimal local wallet.php with injected latency"""
+
+    def __init__(self, latency: float, status: int = 200):
+        self.latency = latency
+        self.status = status
+        self.calls = []
+
+    async def handle(self, reader, writer):
+        request_line = (await reader.readline()).decode()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        path = request_line.split(" ")[1]
+        self.calls.append(urllib.parse.parse_qs(urllib.parse.urlparse(path).query))
+
+        await asyncio.sleep(self.latency)
+        body = json.dumps({"address_in": f"enc{len(self.calls)}", "polygon_address_in": "0xpolygon"}).encode()
+        writer.write(
+            f"HTTP/1.1 {self.status} OK\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}/control"
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+def card_purchase(host: str = HOST) -> PreSalePurchaseRequest:
+    return PreSalePurchaseRequest(
+        firstName="A", lastName="B", walletAddress="BUYER", tokenAmount=500,
+        paymentMethod="card", hostUrl=host
+    )
+
+
+@pytest.fixture
+def pool_config(monkeypatch):
+    monkeypatch.setattr(server, "CARD2CRYPTO_POOL_SIZE", 3)
+    monkeypatch.setattr(server, "CARD2CRYPTO_POOL_HOSTS", [HOST])
+
+
+class TestCard2CryptoPool:
+
+    def test_pooled_checkout_skips_upstream(self, mongo_db, pool_config, monkeypatch):
+        async def scenario():
+            stub = Card2CryptoStub(STUB_LATENCY)
+            async with stub as base:
+                monkeypatch.setattr(server, "CARD2CRYPTO_API_BASE", base)
+
+                await server.refill_card2crypto_pool()
+                assert len(stub.calls) == 3
+                assert await server.card2crypto_wallet_pool.count_documents({}) == 3
+                callback = stub.calls[0]["callback"][0]
+                assert callback.startswith(f"{HOST}/api/payments/callback?pid=")
+
+                start = time.perf_counter()
+                response = await server.create_presale_purchase(card_purchase())
+                elapsed = time.perf_counter() - start
+
+                purchase = await server.presale_purchases.find_one({"purchase_id": response.sessionId})
+                return stub, elapsed, response, purchase
+
+        stub, elapsed, response, purchase = asyncio.run(scenario())
+        assert len(stub.calls) == 3
+        assert elapsed < STUB_LATENCY
+        assert response.checkoutUrl.startswith(f"{server.CARD2CRYPTO_PAY_BASE}/pay.php?address=enc")
+        assert purchase["card2crypto_address_in"].startswith("enc")
+        assert any(call["callback"][0].endswith(f"pid={response.sessionId}") for call in stub.calls)
+
+    def test_inline_generation_overlaps_writes(self, mongo_db, monkeypatch):
+        async def scenario():
+            stub = Card2CryptoStub(STUB_LATENCY)
+            async with stub as base:
+                monkeypatch.setattr(server, "CARD2CRYPTO_API_BASE", base)
+
+                start = time.perf_counter()
+                response = await server.create_presale_purchase(card_purchase())
+                elapsed = time.perf_counter() - start
+
+                purchase = await server.presale_purchases.find_one({"purchase_id": response.sessionId})
+                return stub, elapsed, response, purchase
+
+        stub, elapsed, response, purchase = asyncio.run(scenario())
+        assert len(stub.calls) == 1
+        assert STUB_LATENCY <= elapsed < STUB_LATENCY * 2
+        assert purchase["card2crypto_address_in"] == "enc1"
+        assert purchase["card2crypto_polygon_address"] == "0xpolygon"
+        assert purchase["transaction"]["status"] == "pending"
+        assert purchase["transaction"]["payment_gateway"] == "card2crypto"
+
+    def test_upstream_failure_marks_purchase(self, mongo_db, monkeypatch):
+        async def scenario():
+            stub = Card2CryptoStub(0.01, status=500)
+            async with stub as base:
+                monkeypatch.setattr(server, "CARD2CRYPTO_API_BASE", base)
+                with pytest.raises(HTTPException) as error:
+                    await server.create_presale_purchase(card_purchase())
+                purchase = await server.presale_purchases.find_one({"walletAddress": "BUYER"})
+                return error.value, purchase
+
+        error, purchase = asyncio.run(scenario())
+        assert error.status_code == 502
+        assert purchase["paymentStatus"] == "wallet_generation_failed"
@@ -0,0 +1,258 @@
+"""
+On-chain payment scanner tests (in-process, local MongoDB, local fake Solana RPC)
+Tests for:
+- Treasury balance changes are parsed from jsonParsed SOL and SPL transfers
+- Incoming transfers pay the sender's pending crypto purchase when the amount matches
+- Signatures are paged from the persisted cursor and transactions fetched in batches
+- Rescans never apply the same signature twice
+- A transaction the RPC cannot return stops the cursor so it is retried
+"""
+
+import pytest
+import asyncio
+import json
+import os
+from datetime import datetime
+
+import server
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "solana_treasury_transactions.json")
+SOL_PRICE = 100.0
+FIRST_PURCHASE_AT = datetime(2025, 3, 1, 12, 0)
+
+
+def load_fixtures() -> dict:
+    with open(FIXTURES) as f:
+        return json.load(f)
+
+
+class FakeSolanaRpc:
+    """Local JSON-RPC endpoint serving recorded getSignaturesForAddress / getTransaction results"""
+
+    def __init__(self, fixtures: dict):
+        self.signatures = fixtures["signatures"]  # newest first, like the real RPC
+        self.transactions = fixtures["transactions"]
+        self.missing = set()
+        self.snapshot = None  # {"slot", "lamports", "tokens": {mint: ui_amount}} for balance reads
+        self.calls = []
+
+    def get_signatures(self, address, options):
+        entries = self.signatures
+        if options.get("before"):
+            entries = entries[[e["signature"] for e in entries].index(options["before"]) + 1:]
+        if options.get("until"):
+            stop = [e["signature"] for e in entries]
+            entries = entries[:stop.index(options["until"])] if options["until"] in stop else entries
+        return entries[:options.get("limit", 1000)]
+
+    def dispatch(self, request: dict) -> dict:
+        method, params = request["method"], request["params"]
+        self.calls.append((method, params))
+        if method == "getSignaturesForAddress":
+            result = self.get_signatures(*params)
+        elif method == "getTransaction" and params[0] not in self.missing:
+            result = self.transactions.get(params[0])
+        elif method == "getBalance" and self.snapshot:
+            result = {"context": {"slot": self.snapshot["slot"]}, "value": self.snapshot["lamports"]}
+        elif method == "getTokenAccountsByOwner" and self.snapshot:
+            result = {"context": {"slot": self.snapshot["slot"]}, "value": [
+                {"account": {"data": {"parsed": {"info": {"mint": mint, "tokenAmount": {"uiAmount": amount}}}}}}
+                for mint, amount in self.snapshot["tokens"].items()
+            ]}
+        else:
+            return {"jsonrpc": "2.0", "id": request["id"], "error": {"code": -32009, "message": "unavailable"}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": result}
+
+    async def handle(self, reader, writer):
+        await reader.readline()
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            name, _, value = line.decode().partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        payload = json.loads(await reader.readexactly(length))
+
+        if isinstance(payload, list):
+            self.calls.append(("batch", len(payload)))
+            response = [self.dispatch(r) for r in payload]
+        else:
+            response = self.dispatch(payload)
+        body = json.dumps(response).encode()
+        writer.write(
+            f"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+    def count(self, method: str) -> int:
+        return len([c for c in self.calls if c[0] == method])
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        port = self.server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+async def seed_crypto_purchase(wallet: str, total_price: float) -> str:
+    purchase_id = f"crypto-{wallet[:6]}-{int(total_price)}"
+    await server.presale_purchases.insert_one({
+        "purchase_id": purchase_id,
+        "walletAddress": wallet,
+        "tokenAmount": int(total_price / server.TOKEN_PRICE),
+        "totalPrice": total_price,
+        "paymentMethod": "crypto",
+        "paymentStatus": "pending_manual_transfer",
+        "createdAt": FIRST_PURCHASE_AT,
+    })
+    return purchase_id
+
+
+@pytest.fixture
+def fake_rpc(monkeypatch):
+    rpc = FakeSolanaRpc(load_fixtures())
+
+    async def sol_price():
+        return SOL_PRICE
+
+    monkeypatch.setattr(server, "get_sol_price_usd", sol_price)
+    return rpc
+
+
+async def seed_purchases(wallets: dict) -> dict:
+    return {
+        "sol": await seed_crypto_purchase(wallets["SOL_BUYER"], 200.0),
+        "usdc": await seed_crypto_purchase(wallets["USDC_BUYER"], 100.0),
+        "usdt": await seed_crypto_purchase(wallets["USDT_BUYER"], 50.0),
+    }
+
+
+async def statuses(purchase_ids: dict) -> dict:
+    result = {}
+    for name, purchase_id in purchase_ids.items():
+        purchase = await server.presale_purchases.find_one({"purchase_id": purchase_id})
+        result[name] = purchase["paymentStatus"]
+    return result
+
+
+class TestTreasuryTransfers:
+    """Test parsing of recorded transactions"""
+
+    def test_parses_incoming_and_outgoing(self):
+        fixtures = load_fixtures()
+        labels, wallets = fixtures["labels"], fixtures["wallets"]
+        parse = lambda label: server.treasury_transfers(fixtures["transactions"][labels[label]])
+
+        assert parse("sol_payment") == [
+            {"asset": "SOL", "mint": None, "amount": 2.0, "counterparty": wallets["SOL_BUYER"]}
+        ]
+        assert parse("usdc_payment") == [
+            {"asset": "USDC", "mint": server.USDC_MINT, "amount": 100.0, "counterparty": wallets["USDC_BUYER"]}
+        ]
+        assert parse("treasury_outgoing")[0]["amount"] < -1.0
+        assert parse("treasury_outgoing")[0]["counterparty"] == wallets["PAYEE"]
+        assert parse("failed_transfer") == []
+
+
+class TestChainPaymentScanner:
+
+    def test_scan_pays_matching_purchases(self, mongo_db, fake_rpc, monkeypatch):
+        fixtures = load_fixtures()
+
+        async def scenario():
+            async with fake_rpc as url:
+                monkeypatch.setattr(server, "SOLANA_RPC_ENDPOINTS", [url])
+                purchases = await seed_purchases(fixtures["wallets"])
+                paid = await server.scan_treasury_payments()
+
+                sol = await server.presale_purchases.find_one({"purchase_id": purchases["sol"]})
+                assert sol["onchain_signature"] == fixtures["labels"]["sol_payment"]
+                assert sol["onchain_value_usd"] == 200.0
+                assert sol["outbox"]["type"] == "purchase_paid"
+                assert await server.process_next_outbox_event() is True
+
+                cursor = await server.chain_cursors.find_one({"cursor_id": "payment_scanner"})
+                assert cursor["signature"] == fixtures["labels"]["treasury_outgoing"]
+                return paid, await statuses(purchases)
+
+        paid, result = asyncio.run(scenario())
+        assert paid == 2
+        assert result == {"sol": "paid", "usdc": "paid", "usdt": "pending_manual_transfer"}
+
+    def test_pages_from_cursor_in_batches(self, mongo_db, fake_rpc, monkeypatch):
+        monkeypatch.setattr(server, "CHAIN_SCANNER_PAGE_SIZE", 2)
+        monkeypatch.setattr(server, "CHAIN_SCANNER_TX_BATCH", 2)
+        fixtures = load_fixtures()
+
+        async def scenario():
+            async with fake_rpc as url:
+                monkeypatch.setattr(server, "SOLANA_RPC_ENDPOINTS", [url])
+                await seed_purchases(fixtures["wallets"])
+                await server.scan_treasury_payments()
+                first = list(fake_rpc.calls)
+
+                # Nothing new: one signature page bounded by the cursor, no transactions fetched
+                fake_rpc.calls.clear()
+                await server.scan_treasury_payments()
+                second = list(fake_rpc.calls)
+                return first, second
+
+        first, second = asyncio.run(scenario())
+        # 5 signatures since the first purchase (the older one is never fetched), failed one skipped
+        assert len([c for c in first if c[0] == "getSignaturesForAddress"]) == 3
+        fetched = [c[1][0] for c in first if c[0] == "getTransaction"]
+        assert len(fetched) == 4
+        assert fixtures["labels"]["before_first_purchase"] not in fetched
+        assert fixtures["labels"]["failed_transfer"] not in fetched
+        assert [c[1] for c in first if c[0] == "batch"] == [2, 1, 1]
+        assert second == [("getSignaturesForAddress", [
+            fixtures["address"],
+            {"limit": 2, "commitment": "finalized", "until": fixtures["labels"]["treasury_outgoing"]}
+        ])]
+
+    def test_rescan_does_not_reapply_signature(self, mongo_db, fake_rpc, monkeypatch):
+        fixtures = load_fixtures()
+
+        async def scenario():
+            async with fake_rpc as url:
+                monkeypatch.setattr(server, "SOLANA_RPC_ENDPOINTS", [url])
+                purchases = await seed_purchases(fixtures["wallets"])
+                await server.scan_treasury_payments()
+
+                # Same buyer places an identical second order, then the cursor is lost
+                second = await server.presale_purchases.insert_one({
+                    "purchase_id": "crypto-second", "walletAddress": fixtures["wallets"]["SOL_BUYER"],
+                    "tokenAmount": 1000, "totalPrice": 200.0, "paymentMethod": "crypto",
+                    "paymentStatus": "pending_manual_transfer", "createdAt": FIRST_PURCHASE_AT,
+                })
+                await server.chain_cursors.delete_many({})
+                paid = await server.scan_treasury_payments()
+                return paid, await statuses({**purchases, "second": "crypto-second"})
+
+        paid, result = asyncio.run(scenario())
+        assert paid == 0
+        assert result["second"] == "pending_manual_transfer"
+
+    def test_unfetchable_transaction_is_retried(self, mongo_db, fake_rpc, monkeypatch):
+        fixtures = load_fixtures()
+        fake_rpc.missing.add(fixtures["labels"]["usdc_payment"])
+
+        async def scenario():
+            async with fake_rpc as url:
+                monkeypatch.setattr(server, "SOLANA_RPC_ENDPOINTS", [url])
+                purchases = await seed_purchases(fixtures["wallets"])
+                first = await server.scan_treasury_payments()
+                cursor = await server.chain_cursors.find_one({"cursor_id": "payment_scanner"})
+                assert cursor["signature"] == fixtures["labels"]["sol_payment"]
+
+                fake_rpc.missing.clear()
+                second = await server.scan_treasury_payments()
+                return first, second, await statuses(purchases)
+
+        first, second, result = asyncio.run(scenario())
+        assert (first, second) == (1, 1)
+        assert result["usdc"] == "paid"
@@ -0,0 +1,195 @@
+"""
+Prometheus metrics tests (in-process, no MongoDB needed)
+Tests for:
+- Request latency is labelled with the route template, not the raw path
+- Outbound HTTP latency and errors are recorded per upstream host
+- Mongo command latency and failures are recorded per collection, command and endpoint
+- Slow commands are logged with their filter shape, values redacted
+- Cache lookups are counted as hits and misses
+- /metrics serves the Prometheus text format
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import httpx
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+async def asgi_get(path: str) -> httpx.Response:
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        return await client.get(path)
+
+
+class UpstreamStub:
+    """Local HTTP server answering every request with a fixed status"""
+
+    def __init__(self, status: int):
+        self.status = status
+
+    async def handle(self, reader, writer):
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        writer.write(f"HTTP/1.1 {self.status} X\r\nContent-Length: 2\r\nConnection: close\r\n\r\n{{}}".encode())
+        await writer.drain()
+        writer.close()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        return f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class TestRequestMetrics:
+
+    def test_route_template_label(self):
+        labels = {"method": "GET", "route": "/api/affiliate/config", "status": "200"}
+        before = sample("http_request_duration_seconds_count", labels)
+        response = asyncio.run(asgi_get("/api/affiliate/config"))
+        assert response.status_code == 200
+        assert sample("http_request_duration_seconds_count", labels) == before + 1
+
+    def test_unmatched_paths_share_one_label(self):
+        labels = {"method": "GET", "route": "unmatched", "status": "404"}
+        before = sample("http_request_duration_seconds_count", labels)
+        asyncio.run(asgi_get("/no/such/path/123"))
+        asyncio.run(asgi_get("/no/such/path/456"))
+        assert sample("http_request_duration_seconds_count", labels) == before + 2
+
+    def test_metrics_endpoint(self):
+        response = asyncio.run(asgi_get("/metrics"))
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "http_request_duration_seconds_bucket" in response.text
+
+
+class TestUpstreamMetrics:
+
+    def test_latency_and_errors_per_upstream(self):
+        async def scenario():
+            async with UpstreamStub(200) as ok_url, UpstreamStub(503) as failing_url:
+                async with server.upstream_client(timeout=5.0) as client:
+                    await client.get(ok_url)
+                    await client.get(failing_url)
+
+        before_ok = sample("upstream_request_duration_seconds_count", {"upstream": "127.0.0.1", "status": "200"})
+        before_err = sample("upstream_request_errors_total", {"upstream": "127.0.0.1", "reason": "http_503"})
+        asyncio.run(scenario())
+        assert sample("upstream_request_duration_seconds_count", {"upstream": "127.0.0.1", "status": "200"}) == before_ok + 1
+        assert sample("upstream_request_errors_total", {"upstream": "127.0.0.1", "reason": "http_503"}) == before_err + 1
+
+    def test_connection_errors_are_counted(self):
+        async def scenario():
+            async with server.upstream_client(timeout=1.0) as client:
+                with pytest.raises(httpx.ConnectError):
+                    await client.get("http://127.0.0.1:9/")
+
+        before = sample("upstream_request_errors_total", {"upstream": "127.0.0.1", "reason": "ConnectError"})
+        asyncio.run(scenario())
+        assert sample("upstream_request_errors_total", {"upstream": "127.0.0.1", "reason": "ConnectError"}) == before + 1
+
+
+class TestMongoMetrics:
+
+    def command_event(self, request_id: int, command_name: str, command: dict = None, duration: int = 0):
+        return SimpleNamespace(
+            connection_id=("localhost", 27017), request_id=request_id, command_name=command_name,
+            command=command or {}, duration_micros=duration
+        )
+
+    def test_commands_per_collection(self):
+        listener = server.MongoMetricsListener()
+        labels = {"collection": "users", "command": "find", "endpoint": "background"}
+        before = sample("mongo_command_duration_seconds_count", labels)
+
+        listener.started(self.command_event(1, "find", {"find": "users", "filter": {}}))
+        listener.succeeded(self.command_event(1, "find", duration=1500))
+        listener.started(self.command_event(2, "getMore", {"getMore": 123, "collection": "users"}))
+        listener.failed(self.command_event(2, "getMore", duration=10))
+
+        assert sample("mongo_command_duration_seconds_count", labels) == before + 1
+        assert sample("mongo_command_failures_total", {"collection": "users", "command": "getMore"}) >= 1
+
+    def test_endpoint_attribution_and_count(self):
+        listener = server.MongoMetricsListener()
+        labels = {"collection": "affiliate_relations", "command": "aggregate", "endpoint": "/api/affiliate/{wallet}/stats"}
+        before = sample("mongo_command_duration_seconds_count", labels)
+
+        route = SimpleNamespace(path="/api/affiliate/{wallet}/stats")
+        with server.mongo_query_scope(scope={"route": route}) as queries:
+            for request_id in (1, 2):
+                listener.started(self.command_event(request_id, "aggregate", {"aggregate": "affiliate_relations"}))
+                listener.succeeded(self.command_event(request_id, "aggregate"))
+
+        assert queries.count == 2
+        assert sample("mongo_command_duration_seconds_count", labels) == before + 2
+
+    def test_slow_command_logged_with_redacted_shape(self, monkeypatch, capsys):
+        monkeypatch.setattr(server, "MONGO_SLOW_QUERY_MS", 50)
+        listener = server.MongoMetricsListener()
+        command = {
+            "find": "affiliate_commissions",
+            "filter": {"beneficiary_user_id": "SECRET_WALLET", "status": {"$in": ["pending", "paid"]}},
+            "sort": {"created_at": -1},
+        }
+        with server.mongo_query_scope("worker:test"):
+            listener.started(self.command_event(1, "find", command))
+        listener.succeeded(self.command_event(1, "find", duration=80000))
+
+        output = capsys.readouterr().out
+        assert "[Mongo] Slow find on affiliate_commissions from worker:test (80 ms)" in output
+        assert "SECRET_WALLET" not in output and "pending" not in output
+        assert "'beneficiary_user_id': '?'" in output
+        assert sample("mongo_slow_commands_total", {
+            "collection": "affiliate_commissions", "command": "find", "endpoint": "worker:test"
+        }) >= 1
+
+    def test_query_shape(self):
+        pipeline = [
+            {"$match": {"$or": [{"wallet": "A"}, {"wallet": "B"}, {"code": "C"}]}},
+            {"$group": {"_id": "$level", "n": {"$sum": 1}}},
+        ]
+        assert server.query_shape(pipeline) == [
+            {"$match": {"$or": [{"wallet": "?"}, {"code": "?"}]}},
+            {"$group": {"_id": "?", "n": {"$sum": "?"}}},
+        ]
+
+    def test_disabled_metrics_record_nothing(self, monkeypatch):
+        monkeypatch.setattr(server, "METRICS_ENABLED", False)
+        listener = server.MongoMetricsListener()
+        labels = {"collection": "referral_data", "command": "update", "endpoint": "background"}
+        before = sample("mongo_command_duration_seconds_count", labels)
+
+        listener.started(self.command_event(1, "update", {"update": "referral_data"}))
+        listener.succeeded(self.command_event(1, "update"))
+        assert sample("mongo_command_duration_seconds_count", labels) == before
+
+
+class TestCacheMetrics:
+
+    def test_user_cache_hits_and_misses(self):
+        cache = server.UserCache(max_size=10, negative_ttl=60)
+        hits = sample("cache_requests_total", {"cache": "user", "result": "hit"})
+        misses = sample("cache_requests_total", {"cache": "user", "result": "miss"})
+
+        cache.get("wallet_public_key", "W1")
+        cache.put({"wallet_public_key": "W1", "referral_code": "QTMW1"})
+        cache.get("wallet_public_key", "W1")
+
+        assert sample("cache_requests_total", {"cache": "user", "result": "hit"}) == hits + 1
+        assert sample("cache_requests_total", {"cache": "user", "result": "miss"}) == misses + 1
@@ -0,0 +1,64 @@
+"""
+Synthetic MLM dataset tests (in-process, no MongoDB needed)
+Tests for:
+- Relations match the ancestor chain create_affiliate_relations would write, capped at MAX_AFFILIATE_LEVEL
+- Commissions use the server rates and one document per (event, beneficiary, level)
+- Fan-out is skewed and the forest is deeper than the commission levels
+"""
+
+import random
+from collections import Counter, defaultdict
+
+import server
+from mlm_dataset import DatasetShape, build_forest, generate_documents, synthetic_referral_code
+
+
+def generated(shape: DatasetShape) -> dict:
+    documents = defaultdict(list)
+    for name, document in generate_documents(shape):
+        documents[name].append(document)
+    return documents
+
+
+class TestMlmDataset:
+
+    def test_relations_follow_referrer_chain(self):
+        documents = generated(DatasetShape(2000, seed=7))
+        referrer_of = {u["wallet_public_key"]: u["referrer_id"] for u in documents["users"]}
+
+        relations = defaultdict(dict)
+        for relation in documents["affiliate_relations"]:
+            relations[relation["user_id"]][relation["level"]] = relation["ancestor_id"]
+
+        for wallet in referrer_of:
+            expected, ancestor = {}, referrer_of[wallet]
+            while ancestor and len(expected) < server.MAX_AFFILIATE_LEVEL:
+                expected[len(expected) + 1] = ancestor
+                ancestor = referrer_of[ancestor]
+            assert relations.get(wallet, {}) == expected
+
+    def test_commissions_use_server_rates(self):
+        documents = generated(DatasetShape(2000, seed=7))
+        keys = Counter((c["event_id"], c["beneficiary_user_id"], c["level"]) for c in documents["affiliate_commissions"])
+        assert keys and max(keys.values()) == 1
+
+        by_event = defaultdict(list)
+        for commission in documents["affiliate_commissions"]:
+            assert commission["percentage"] == server.COMMISSION_RATES[commission["level"]] * 100
+            assert commission["status"] == server.CommissionStatus.PENDING.value
+            by_event[commission["event_id"]].append(commission)
+        for commissions in by_event.values():
+            net_amount = [c["amount"] for c in commissions if c["level"] == 1][0] / server.COMMISSION_RATES[1]
+            expected = sum(net_amount * server.COMMISSION_RATES[c["level"]] for c in commissions)
+            assert abs(sum(c["amount"] for c in commissions) - expected) < 1e-6
+
+    def test_skewed_fan_out_and_depth(self):
+        referrers, depths = build_forest(DatasetShape(50000, max_depth=9), random.Random(1))
+        fan_out = Counter(r for r in referrers if r >= 0)
+        assert fan_out.most_common(1)[0][1] > 50 * len(referrers) / len(fan_out)
+        assert max(depths) == 9 > server.MAX_AFFILIATE_LEVEL
+
+    def test_referral_codes_are_unique(self):
+        codes = {synthetic_referral_code(i) for i in range(100000)}
+        assert len(codes) == 100000
+        assert all(len(code) == 8 and code.startswith("QTM") for code in codes)
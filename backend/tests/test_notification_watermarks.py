@@ -0,0 +1,103 @@
+"""
+Notification read watermark tests
+Tests for:
+- Mark-all-read advances the read_through watermark (unread derived at query time)
+- Explicit notification IDs still mark only those notifications
+- New notifications after the watermark are unread again
+- Clear hides notifications immediately
+"""
+
+import pytest
+import requests
+import os
+import uuid
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://deep-link-wallet.preview.emergentagent.com').rstrip('/')
+
+
+def create_referrer_with_commissions(prefix: str, purchases: int) -> tuple:
+    """Register a referrer and a buyer, then distribute `purchases` commissions to the referrer"""
+    referrer_wallet = f"TEST_{prefix}_{uuid.uuid4().hex[:8]}"
+    reg_response = requests.post(f"{BASE_URL}/api/affiliate/register", json={
+        "wallet_public_key": referrer_wallet,
+        "referral_code_used": None
+    })
+    referrer_code = reg_response.json().get("referral_code")
+
+    buyer_wallet = f"TEST_buyer_{prefix}_{uuid.uuid4().hex[:8]}"
+    requests.post(f"{BASE_URL}/api/affiliate/register", json={
+        "wallet_public_key": buyer_wallet,
+        "referral_code_used": referrer_code
+    })
+
+    for _ in range(purchases):
+        distribute_commission(buyer_wallet)
+    return referrer_wallet, buyer_wallet
+
+
+def distribute_commission(buyer_wallet: str):
+    requests.post(f"{BASE_URL}/api/affiliate/commission/distribute", json={
+        "source_wallet": buyer_wallet,
+        "amount": 100.0,
+        "event_type": "presale_purchase",
+        "event_id": f"test-watermark-{uuid.uuid4().hex[:8]}"
+    })
+
+
+class TestNotificationWatermarks:
+    """Test read_through / cleared_through watermark behaviour"""
+
+    def test_mark_specific_ids_only(self):
+        """Explicit IDs mark only those notifications"""
+        referrer_wallet, _ = create_referrer_with_commissions("ids", 3)
+
+        before = requests.get(f"{BASE_URL}/api/notifications/{referrer_wallet}").json()
+        assert before.get("unread_count") == 3
+
+        target_id = before["notifications"][0]["id"]
+        mark_response = requests.post(
+            f"{BASE_URL}/api/notifications/{referrer_wallet}/mark-read",
+            json=[target_id]
+        )
+        assert mark_response.status_code == 200
+        assert mark_response.json().get("marked_read") == 1
+
+        after = requests.get(f"{BASE_URL}/api/notifications/{referrer_wallet}").json()
+        assert after.get("unread_count") == 2
+        read_ids = [n["id"] for n in after["notifications"] if n["read"]]
+        assert read_ids == [target_id]
+
+        print("PASS: Explicit IDs mark only the selected notifications")
+
+    def test_new_notifications_after_mark_all_are_unread(self):
+        """Notifications created after the watermark are unread"""
+        referrer_wallet, buyer_wallet = create_referrer_with_commissions("after", 2)
+
+        mark_response = requests.post(f"{BASE_URL}/api/notifications/{referrer_wallet}/mark-read")
+        assert mark_response.json().get("marked_read") == 2
+
+        distribute_commission(buyer_wallet)
+
+        after = requests.get(f"{BASE_URL}/api/notifications/{referrer_wallet}").json()
+        assert after.get("unread_count") == 1
+        assert [n["read"] for n in after["notifications"]] == [False, True, True]
+
+        unread = requests.get(f"{BASE_URL}/api/notifications/{referrer_wallet}?unread_only=true").json()
+        assert len(unread.get("notifications", [])) == 1
+
+        print("PASS: Notifications after the read watermark are unread")
+
+    def test_clear_then_new_notification_visible(self):
+        """Clear hides existing notifications but not later ones"""
+        referrer_wallet, buyer_wallet = create_referrer_with_commissions("clear", 2)
+
+        clear_response = requests.delete(f"{BASE_URL}/api/notifications/{referrer_wallet}/clear")
+        assert clear_response.json().get("deleted") == 2
+
+        distribute_commission(buyer_wallet)
+
+        after = requests.get(f"{BASE_URL}/api/notifications/{referrer_wallet}").json()
+        assert len(after.get("notifications", [])) == 1
+        assert after.get("unread_count") == 1
+
+        print("PASS: Clear watermark hides only older notifications")
@@ -0,0 +1,129 @@
+"""
+Payment outbox tests (in-process, local MongoDB)
+Tests for:
+- The Card2Crypto callback marks the purchase paid and enqueues one outbox event
+- The outbox worker applies commissions, legacy stats and notifications
+- A worker killed mid-event leaves a leased event that is replayed with exactly-once effects
+"""
+
+import pytest
+import asyncio
+import uuid
+
+import server
+from server import UserCreate
+
+
+class FakeRequest:
+    def __init__(self, **params):
+        self.query_params = params
+
+
+async def seed_paid_chain_purchase() -> dict:
+    """ROOT <- MID <- BUYER, with a pending card purchase by BUYER referred by MID"""
+    root = await server.register_affiliate(UserCreate(wallet_public_key="ROOT"))
+    mid = await server.register_affiliate(UserCreate(wallet_public_key="MID", referral_code_used=root.referral_code))
+    await server.register_affiliate(UserCreate(wallet_public_key="BUYER", referral_code_used=mid.referral_code))
+
+    await server.referral_data.insert_one(server.ReferralStats(
+        walletAddress="MID", referralCode=mid.referral_code
+    ).model_dump())
+
+    purchase_id = str(uuid.uuid4())
+    await server.presale_purchases.insert_one({
+        "purchase_id": purchase_id,
+        "walletAddress": "BUYER",
+        "tokenAmount": 1000,
+        "totalPrice": 200.0,
+        "paymentMethod": "card",
+        "paymentStatus": "pending",
+        "referralCode": mid.referral_code,
+        "transaction": {"amount": 200.0, "status": "pending", "paymentStatus": "pending"},
+    })
+    return {"purchase_id": purchase_id, "referral_code": mid.referral_code}
+
+
+async def effect_counts(seed: dict) -> dict:
+    referral = await server.referral_data.find_one({"referralCode": seed["referral_code"]})
+    return {
+        "commissions": await server.affiliate_commissions.count_documents({"event_id": seed["purchase_id"]}),
+        "commission_notifications": await server.notifications_collection.count_documents({"type": "commission_received"}),
+        "buyer_notifications": await server.notifications_collection.count_documents({"wallet": "BUYER"}),
+        "referrals": referral["referrals"],
+        "commissionEarned": referral["commissionEarned"],
+    }
+
+
+EXPECTED_EFFECTS = {
+    "commissions": 2,
+    "commission_notifications": 2,
+    "buyer_notifications": 1,
+    "referrals": 1,
+    "commissionEarned": 20.0,
+}
+
+
+class TestPaymentOutbox:
+
+    def test_callback_enqueues_and_worker_applies(self, mongo_db):
+        async def scenario():
+            seed = await seed_paid_chain_purchase()
+            response = await server.card2crypto_callback(FakeRequest(pid=seed["purchase_id"], value_coin="200", txid_out="0xabc"))
+            assert response == {"status": "ok"}
+
+            purchase = await server.presale_purchases.find_one({"purchase_id": seed["purchase_id"]})
+            assert purchase["paymentStatus"] == "paid"
+            assert purchase["transaction"]["status"] == "paid"
+            assert purchase["transaction"]["card2crypto_txid_out"] == "0xabc"
+            assert purchase["outbox"]["status"] == "pending"
+            assert await server.affiliate_commissions.count_documents({}) == 0
+
+            assert await server.process_next_outbox_event() is True
+            assert await server.process_next_outbox_event() is False
+
+            purchase = await server.presale_purchases.find_one({"purchase_id": seed["purchase_id"]})
+            assert purchase["outbox"]["status"] == "done"
+            return await effect_counts(seed)
+
+        assert asyncio.run(scenario()) == EXPECTED_EFFECTS
+
+    def test_worker_killed_mid_event_is_exactly_once(self, mongo_db, monkeypatch):
+        monkeypatch.setattr(server, "OUTBOX_LEASE_SECONDS", 0)
+        real_update_referral_stats = server.update_referral_stats
+
+        async def scenario():
+            seed = await seed_paid_chain_purchase()
+            await server.card2crypto_callback(FakeRequest(pid=seed["purchase_id"], value_coin="200"))
+
+            # Kill the worker after commissions are written, before legacy stats/notification
+            reached = asyncio.Event()
+
+            async def hang(*args, **kwargs):
+                reached.set()
+                await asyncio.sleep(3600)
+
+            monkeypatch.setattr(server, "update_referral_stats", hang)
+            worker = asyncio.create_task(server.run_outbox_worker())
+            await asyncio.wait_for(reached.wait(), 10)
+            worker.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await worker
+
+            partial = await effect_counts(seed)
+            assert partial["commissions"] == 2
+            assert partial["buyer_notifications"] == 0
+
+            # Restart: the expired lease makes the event claimable again
+            monkeypatch.setattr(server, "update_referral_stats", real_update_referral_stats)
+            assert await server.process_next_outbox_event() is True
+            assert await server.process_next_outbox_event() is False
+
+            # A duplicate callback does not enqueue the event again
+            duplicate = await server.card2crypto_callback(FakeRequest(pid=seed["purchase_id"], value_coin="200"))
+            assert duplicate == {"status": "already_processed"}
+
+            purchase = await server.presale_purchases.find_one({"purchase_id": seed["purchase_id"]})
+            assert purchase["outbox"]["attempts"] == 2
+            return await effect_counts(seed)
+
+        assert asyncio.run(scenario()) == EXPECTED_EFFECTS
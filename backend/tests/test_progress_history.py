@@ -0,0 +1,72 @@
+"""
+Presale progress history tests (in-process, local MongoDB)
+Tests for:
+- Each progress refresh records one point in the time-series collection
+- History is downsampled to min/max/last per bucket, oldest first
+- Ranges are bounded to the requested window and bucket count
+"""
+
+import pytest
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+from fastapi import HTTPException
+
+import server
+
+DAY = datetime(2025, 3, 1, tzinfo=timezone.utc)
+
+
+async def seed_points(values: list, step: timedelta):
+    await server.presale_progress_history.insert_many([
+        {"timestamp": DAY + i * step, "meta": {"source": "onchain"}, "total_raised": value, "participants": i}
+        for i, value in enumerate(values)
+    ])
+
+
+class TestProgressHistory:
+
+    def test_refresh_records_point(self, mongo_db, monkeypatch):
+        async def treasury_value():
+            return {"total_usd": 1234.5, "sol_balance": 10.0, "sol_price_usd": 100.0, "sol_value_usd": 1000.0}
+
+        async def holders():
+            return 42
+
+        monkeypatch.setattr(server, "get_treasury_value", treasury_value)
+        monkeypatch.setattr(server, "get_token_holders_count", holders)
+
+        async def scenario():
+            await server.get_presale_progress(refresh=True)
+            return await server.presale_progress_history.find_one({}, {"_id": 0})
+
+        point = asyncio.run(scenario())
+        assert point["total_raised"] == 1234.5
+        assert point["participants"] == 42
+
+    def test_downsampled_min_max_last(self, mongo_db):
+        async def scenario():
+            # Every 20 minutes for 3 hours: three 1h buckets of three points
+            await seed_points([10, 30, 20, 40, 45, 42, 50, 50, 55], timedelta(minutes=20))
+            return await server.get_presale_progress_history(start=DAY, end=DAY + timedelta(hours=3), resolution="1h")
+
+        history = asyncio.run(scenario())
+        assert [(p["min"], p["max"], p["last"], p["samples"]) for p in history["points"]] == [
+            (10, 30, 20, 3), (40, 45, 42, 3), (50, 55, 55, 3)
+        ]
+        assert history["points"][0]["timestamp"] == DAY.isoformat()
+        assert history["points"][2]["participants"] == 8
+
+    def test_range_is_bounded(self, mongo_db):
+        async def scenario():
+            await seed_points([10, 20, 30, 40], timedelta(days=1))
+            history = await server.get_presale_progress_history(
+                start=DAY + timedelta(days=1), end=DAY + timedelta(days=3), resolution="1d"
+            )
+            with pytest.raises(HTTPException) as exc:
+                await server.get_presale_progress_history(start=DAY, end=DAY + timedelta(days=365), resolution="5m")
+            return history, exc.value.status_code
+
+        history, status = asyncio.run(scenario())
+        assert [p["last"] for p in history["points"]] == [20, 30]
+        assert status == 400
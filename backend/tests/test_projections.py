@@ -0,0 +1,106 @@
+"""
+Projection registry tests
+Tests for:
+- Every registered projection returns exactly the fields its call sites read
+- Full documents are never fetched on the hot read paths
+- Projected rows still serialize through the list endpoint helpers
+"""
+
+import pytest
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import PROJECTIONS, commission_entry_row, ReferralStats
+
+
+FULL_DOCUMENTS = {
+    "user": {
+        "_id": "oid", "wallet_public_key": "W1", "referral_code": "QTMABCDE",
+        "referrer_id": "W0", "created_at": datetime(2025, 1, 1)
+    },
+    "relation": {
+        "_id": "oid", "user_id": "W1", "ancestor_id": "W0", "level": 1, "created_at": datetime(2025, 1, 1)
+    },
+    "commission": {
+        "_id": "oid", "commission_id": "c1", "source_user_id": "W1", "beneficiary_user_id": "W0",
+        "level": 1, "percentage": 20.0, "amount": 40.0, "event_type": "presale_purchase",
+        "event_id": "p1", "status": "pending", "created_at": datetime(2025, 1, 1)
+    },
+    "purchase": {
+        "_id": "oid", "purchase_id": "p1", "firstName": "A", "lastName": "B", "email": "a@b.c",
+        "walletAddress": "W1", "tokenAmount": 1000, "totalPrice": 200.0, "paymentMethod": "card",
+        "paymentStatus": "pending", "card2crypto_address_in": "enc", "card2crypto_polygon_address": "0x",
+        "card2crypto_txid_out": None, "referralCode": "QTMABCDE",
+        "createdAt": datetime(2025, 1, 1), "updatedAt": datetime(2025, 1, 1)
+    },
+    "referral": {
+        "_id": "oid", "walletAddress": "W1", "referralCode": "QTMW1", "referrals": 1, "totalPurchased": 1000,
+        "commissionEarned": 20.0, "commissionPending": 20.0, "commissionPaid": 0.0
+    },
+}
+
+
+def apply_projection(doc: dict, projection: dict) -> dict:
+    """Mimic MongoDB inclusion projection semantics"""
+    include_id = projection.get("_id", 1)
+    fields = [k for k, v in projection.items() if k != "_id" and v]
+    result = {k: doc[k] for k in fields if k in doc}
+    if include_id and "_id" in doc:
+        result["_id"] = doc["_id"]
+    return result
+
+
+class TestProjectionRegistry:
+    """Test the shared projection registry"""
+
+    @pytest.mark.parametrize("name", sorted(PROJECTIONS))
+    def test_projection_is_inclusion_only(self, name):
+        """No projection fetches the whole document"""
+        projection = PROJECTIONS[name]
+        fields = [k for k in projection if k != "_id"]
+        if name == "exists":
+            assert projection == {"_id": 1}
+        else:
+            assert projection.get("_id") == 0
+            assert fields and all(projection[k] == 1 for k in fields)
+
+    @pytest.mark.parametrize("name, source, expected", [
+        ("exists", "user", {"_id"}),
+        ("user", "user", {"wallet_public_key", "referral_code", "referrer_id", "created_at"}),
+        ("user_wallet", "user", {"wallet_public_key"}),
+        ("user_referral_code", "user", {"referral_code"}),
+        ("user_referrer", "user", {"referrer_id"}),
+        ("relation_ancestor", "relation", {"ancestor_id", "level"}),
+        ("relation_user", "relation", {"user_id"}),
+        ("commission_totals", "commission", {"amount", "status"}),
+        ("commission_amount", "commission", {"amount"}),
+        ("purchase_outbox", "purchase", {"purchase_id", "walletAddress", "totalPrice", "tokenAmount", "referralCode"}),
+    ])
+    def test_projected_shape(self, name, source, expected):
+        """Projected documents contain exactly the fields the call site uses"""
+        projected = apply_projection(FULL_DOCUMENTS[source], PROJECTIONS[name])
+        assert set(projected) == expected
+
+    def test_commission_entry_projection_serializes(self):
+        """commission_entry_row only reads projected fields"""
+        projected = apply_projection(FULL_DOCUMENTS["commission"], PROJECTIONS["commission_entry"])
+        assert "beneficiary_user_id" not in projected
+        row = commission_entry_row(projected)
+        assert row["id"] == "c1"
+        assert row["source_user_wallet"] == "W1"
+
+    def test_referral_stats_projection_builds_model(self):
+        """ReferralStats can be built from the referral_stats projection"""
+        projected = apply_projection(FULL_DOCUMENTS["referral"], PROJECTIONS["referral_stats"])
+        assert set(projected) == set(ReferralStats.model_fields)
+        assert ReferralStats(**projected).referralCode == "QTMW1"
+
+    def test_purchase_status_projection_omits_payment_secrets(self):
+        """Status reads do not pull Card2Crypto encrypted addresses or contact details"""
+        projected = apply_projection(FULL_DOCUMENTS["purchase"], PROJECTIONS["purchase_status"])
+        assert "card2crypto_address_in" not in projected
+        assert "email" not in projected
+        assert projected["paymentStatus"] == "pending"
@@ -0,0 +1,97 @@
+"""
+Purchase status long-poll tests (in-process, local MongoDB)
+Tests for:
+- A held status request is woken by the Card2Crypto callback in the same worker
+- Settled or unknown purchases are answered immediately
+- The wait elapses and returns pending when nothing happens
+- The cross-worker polling fallback wakes requests for purchases paid elsewhere
+"""
+
+import pytest
+import asyncio
+import time
+import uuid
+
+from fastapi import HTTPException
+
+import server
+
+
+class FakeRequest:
+    def __init__(self, **params):
+        self.query_params = params
+
+
+async def seed_pending_purchase(status: str = "pending") -> str:
+    purchase_id = str(uuid.uuid4())
+    await server.presale_purchases.insert_one({
+        "purchase_id": purchase_id,
+        "walletAddress": "BUYER",
+        "tokenAmount": 1000,
+        "totalPrice": 200.0,
+        "paymentMethod": "card",
+        "paymentStatus": status,
+    })
+    return purchase_id
+
+
+class TestPurchaseStatusLongPoll:
+
+    def test_callback_wakes_waiting_request(self, mongo_db):
+        async def scenario():
+            purchase_id = await seed_pending_purchase()
+            start = time.monotonic()
+            waiting = asyncio.create_task(server.get_presale_status(purchase_id, wait=30))
+            await asyncio.sleep(0.05)
+            assert server.purchase_status_waiters.waiting() == [purchase_id]
+
+            await server.card2crypto_callback(FakeRequest(pid=purchase_id, value_coin="200", txid_out="0xabc"))
+            status = await asyncio.wait_for(waiting, 5)
+            return status, time.monotonic() - start
+
+        status, elapsed = asyncio.run(scenario())
+        assert status["payment_status"] == "paid"
+        assert elapsed < 5
+        assert server.purchase_status_waiters.waiting() == []
+
+    def test_settled_purchase_returns_immediately(self, mongo_db):
+        async def scenario():
+            purchase_id = await seed_pending_purchase(status="paid")
+            return await asyncio.wait_for(server.get_presale_status(purchase_id, wait=30), 1)
+
+        assert asyncio.run(scenario())["payment_status"] == "paid"
+
+    def test_unknown_purchase_is_not_held(self, mongo_db):
+        async def scenario():
+            with pytest.raises(HTTPException) as exc:
+                await asyncio.wait_for(server.get_presale_status("missing", wait=30), 1)
+            return exc.value.status_code
+
+        assert asyncio.run(scenario()) == 404
+
+    def test_wait_elapses_with_pending_status(self, mongo_db):
+        async def scenario():
+            purchase_id = await seed_pending_purchase()
+            return await server.get_presale_status(purchase_id, wait=1)
+
+        assert asyncio.run(scenario())["payment_status"] == "pending"
+
+    def test_polling_fallback_wakes_for_other_workers(self, mongo_db, monkeypatch):
+        monkeypatch.setattr(server, "PURCHASE_STATUS_POLL_INTERVAL", 0.05)
+
+        async def scenario():
+            purchase_id = await seed_pending_purchase()
+            poller = asyncio.create_task(server.poll_purchase_status_changes())
+            waiting = asyncio.create_task(server.get_presale_status(purchase_id, wait=30))
+            await asyncio.sleep(0.05)
+
+            # Paid by another worker: no in-process notification
+            await server.presale_purchases.update_one(
+                {"purchase_id": purchase_id}, {"$set": {"paymentStatus": "paid"}}
+            )
+            try:
+                return await asyncio.wait_for(waiting, 5)
+            finally:
+                poller.cancel()
+
+        assert asyncio.run(scenario())["payment_status"] == "paid"
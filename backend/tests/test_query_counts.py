@@ -0,0 +1,105 @@
+"""
+MongoDB query budgets per endpoint (in-process, local MongoDB)
+Tests for:
+- Each hot endpoint stays within its maximum number of MongoDB commands
+- Commands are counted by the server's command listener, so N+1 regressions fail here
+
+Raise a budget only together with the change that needs it.
+"""
+
+import pytest
+import asyncio
+import uuid
+
+import server
+from server import UserCreate, PreSalePurchaseRequest
+
+
+QUERY_BUDGETS = {
+    "get_affiliate_stats": 11,  # user + (relations count, commissions) per level
+    "get_commission_history": 2,
+    "get_affiliate_tree": 10,  # depth 2 over ROOT -> MID -> 2 buyers
+    "get_notifications": 3,
+    "get_affiliate_leaderboard": 1,
+    "get_presale_status": 1,
+    "create_presale_purchase": 9,  # new buyer with a referrer: registration, relations, leaderboard, purchase
+    "card2crypto_callback": 1,
+}
+
+
+class FakeRequest:
+    base_url = "http://testserver/"
+
+    def __init__(self, **params):
+        self.query_params = params
+
+
+async def seed_network() -> dict:
+    """ROOT <- MID <- BUYER1, BUYER2, one paid purchase with commissions, and a pending card purchase"""
+    root = await server.register_affiliate(UserCreate(wallet_public_key="ROOT"))
+    mid = await server.register_affiliate(UserCreate(wallet_public_key="MID", referral_code_used=root.referral_code))
+    for buyer in ["BUYER1", "BUYER2"]:
+        await server.register_affiliate(UserCreate(wallet_public_key=buyer, referral_code_used=mid.referral_code))
+    await server.distribute_commissions("BUYER1", 200.0, "presale_purchase", "p-paid")
+
+    purchase_id = str(uuid.uuid4())
+    await server.presale_purchases.insert_one({
+        "purchase_id": purchase_id, "walletAddress": "BUYER2", "tokenAmount": 1000, "totalPrice": 200.0,
+        "paymentMethod": "card", "paymentStatus": "pending",
+    })
+    # Start every measured call with a cold process cache, as on a fresh worker
+    server.user_cache = server.UserCache(server.USER_CACHE_MAX_SIZE, server.USER_CACHE_NEGATIVE_TTL)
+    return {"purchase_id": purchase_id, "mid_code": mid.referral_code}
+
+
+def measure(max_queries, endpoint: str, call):
+    """Seed, then run `call(seed)` inside a request-like scope under the endpoint's budget"""
+    async def scenario():
+        seed = await seed_network()
+        with max_queries(QUERY_BUDGETS[endpoint], endpoint) as queries:
+            with server.user_lookup_scope():
+                await call(seed)
+        return queries.count
+
+    return asyncio.run(scenario())
+
+
+class TestQueryBudgets:
+
+    def test_affiliate_stats(self, mongo_db, max_queries):
+        measure(max_queries, "get_affiliate_stats", lambda seed: server.get_affiliate_stats("MID", FakeRequest()))
+
+    def test_commission_history(self, mongo_db, max_queries):
+        measure(max_queries, "get_commission_history", lambda seed: server.get_commission_history("MID"))
+
+    def test_affiliate_tree(self, mongo_db, max_queries):
+        measure(max_queries, "get_affiliate_tree", lambda seed: server.get_affiliate_tree("ROOT", max_depth=2))
+
+    def test_affiliate_leaderboard(self, mongo_db, max_queries):
+        measure(max_queries, "get_affiliate_leaderboard",
+                lambda seed: server.get_affiliate_leaderboard(metric="earnings", window="week", limit=10))
+
+    def test_notifications(self, mongo_db, max_queries):
+        measure(max_queries, "get_notifications", lambda seed: server.get_notifications("MID"))
+
+    def test_presale_status(self, mongo_db, max_queries):
+        measure(max_queries, "get_presale_status", lambda seed: server.get_presale_status(seed["purchase_id"], wait=0))
+
+    def test_create_presale_purchase(self, mongo_db, max_queries):
+        measure(max_queries, "create_presale_purchase", lambda seed: server.create_presale_purchase(PreSalePurchaseRequest(
+            firstName="A", lastName="B", walletAddress="NEW_BUYER", tokenAmount=500,
+            paymentMethod="crypto", referralCode=seed["mid_code"], hostUrl="http://testserver"
+        )))
+
+    def test_card2crypto_callback(self, mongo_db, max_queries):
+        measure(max_queries, "card2crypto_callback", lambda seed: server.card2crypto_callback(
+            FakeRequest(pid=seed["purchase_id"], value_coin="200")
+        ))
+
+    def test_budget_violation_is_reported(self, mongo_db, max_queries):
+        with pytest.raises(AssertionError, match="issued 2 MongoDB commands"):
+            with max_queries(1, "two_finds"):
+                async def two_finds():
+                    await server.users_collection.find_one({"wallet_public_key": "A"})
+                    await server.users_collection.find_one({"wallet_public_key": "B"})
+                asyncio.run(two_finds())
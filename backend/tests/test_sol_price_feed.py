@@ -0,0 +1,136 @@
+"""
+SOL price feed tests (in-process, local stub upstreams)
+Tests for:
+- The price is the median of the fresh quotes, with outliers rejected once three sources report
+- Stale quotes are ignored and the last update age and source disagreement are reported
+- A refresh polls every source concurrently and concurrent readers share it
+- Reads of a fresh price are memory lookups
+- The Binance ticker stream updates the price between polls
+"""
+
+import pytest
+import asyncio
+import json
+import time
+
+import websockets
+from prometheus_client import REGISTRY
+
+import server
+from upstream_stubs import StubBehaviour, StubPack
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    feed = server.SolPriceFeed()
+    monkeypatch.setattr(server, "sol_price_feed", feed)
+    monkeypatch.setattr(server, "_upstream_guards", {})
+    return feed
+
+
+async def with_stubs(monkeypatch, pack: StubPack, scenario):
+    async with pack:
+        for key in ("COINGECKO_API_BASE", "BINANCE_API_BASE", "COINBASE_API_BASE"):
+            monkeypatch.setattr(server, key, pack.env()[key])
+        return await scenario()
+
+
+def outliers(source: str) -> float:
+    return REGISTRY.get_sample_value("sol_price_outliers_total", {"source": source}) or 0.0
+
+
+class TestMedian:
+
+    def test_outlier_rejected(self, feed):
+        before = outliers("coinbase")
+        feed.update("coingecko", 150.0)
+        feed.update("binance", 150.5)
+        feed.update("coinbase", 170.0)
+        feed.update("binance", 150.4)
+
+        assert feed.price == pytest.approx(150.2)
+        assert feed.sources == ["binance", "coingecko"]
+        assert feed.disagreement == pytest.approx(20.0 / 150.4)
+        assert outliers("coinbase") == before + 1  # counted once, not per recompute
+        assert feed.status()["outliers"] == ["coinbase"]
+
+    def test_two_sources_are_averaged(self, feed):
+        feed.update("coingecko", 150.0)
+        feed.update("binance", 160.0)
+        assert feed.price == 155.0
+        assert feed.outliers == set()
+
+    def test_stale_quotes_ignored(self, feed):
+        feed.quotes["coingecko"] = (100.0, time.monotonic() - server.SOL_PRICE_MAX_AGE - 1)
+        feed.update("binance", 150.0)
+        assert feed.price == 150.0
+        assert feed.sources == ["binance"]
+
+    def test_age(self, feed):
+        assert feed.age() == float("inf")
+        assert feed.status()["age_seconds"] is None
+        feed.quotes["coingecko"] = (150.0, time.monotonic() - 10)
+        feed.recompute()
+        assert 10 <= feed.age() < 11
+
+
+class TestRefresh:
+
+    def test_sources_polled_concurrently(self, feed, monkeypatch):
+        pack = StubPack(StubBehaviour(latency="fixed:200"))
+        pack.coingecko.sol_price, pack.binance.sol_price, pack.coinbase.sol_price = 150.0, 151.0, 152.0
+
+        async def scenario():
+            start = time.perf_counter()
+            prices = await asyncio.gather(*(server.get_sol_price_usd() for _ in range(10)))
+            return prices, time.perf_counter() - start
+
+        prices, elapsed = asyncio.run(with_stubs(monkeypatch, pack, scenario))
+        assert prices == [151.0] * 10
+        assert elapsed < 0.5
+        assert [stub.stats["requests"] for stub in (pack.coingecko, pack.binance, pack.coinbase)] == [1, 1, 1]
+
+    def test_fresh_price_is_a_memory_read(self, feed, monkeypatch):
+        pack = StubPack()
+
+        async def scenario():
+            await feed.refresh()
+            return [await server.get_sol_price_usd() for _ in range(20)]
+
+        assert asyncio.run(with_stubs(monkeypatch, pack, scenario)) == [150.0] * 20
+        assert pack.coingecko.stats["requests"] == 1
+
+    def test_failed_refresh_keeps_last_price(self, feed, monkeypatch):
+        pack = StubPack()
+
+        async def scenario():
+            await feed.refresh()
+            for stub in (pack.coingecko, pack.binance, pack.coinbase):
+                stub.behaviour = StubBehaviour(error_rate=1.0)
+            return await feed.refresh()
+
+        assert asyncio.run(with_stubs(monkeypatch, pack, scenario)) == 150.0
+
+
+class TestStream:
+
+    def test_ticker_updates_price(self, feed, monkeypatch):
+        async def ticker(connection):
+            for price in ("151.10", "151.20"):
+                await connection.send(json.dumps({"e": "24hrTicker", "s": "SOLUSDT", "c": price}))
+            await connection.wait_closed()
+
+        async def scenario():
+            async with websockets.serve(ticker, "127.0.0.1", 0) as stream_server:
+                port = stream_server.sockets[0].getsockname()[1]
+                monkeypatch.setattr(server, "BINANCE_STREAM_URL", f"ws://127.0.0.1:{port}")
+                task = asyncio.create_task(server.run_sol_price_stream())
+                for _ in range(100):
+                    if feed.price == 151.2:
+                        break
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                return feed.price
+
+        assert asyncio.run(scenario()) == 151.2
+        assert feed.sources == ["binance"]
@@ -0,0 +1,123 @@
+"""
+OpenTelemetry tracing tests (in-process, no MongoDB needed)
+Tests for:
+- Each Solana RPC attempt gets a span with its method and endpoint, failures marked as errors
+- Upstream HTTP calls are child spans of the operation that made them
+- MongoDB commands become client spans with the redacted query shape
+- The file exporter writes one JSON span per line and the sampler bounds recorded traces
+"""
+
+import pytest
+import asyncio
+import json
+from types import SimpleNamespace
+
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.trace import StatusCode, NonRecordingSpan, SpanContext, TraceFlags
+
+import server
+from test_chain_payment_scanner import FakeSolanaRpc, load_fixtures
+
+
+@pytest.fixture
+def spans(monkeypatch):
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(server, "tracer", provider.get_tracer("test"))
+    return exporter
+
+
+class TestUpstreamSpans:
+
+    def test_rpc_attempt_per_endpoint(self, spans, monkeypatch):
+        failing, healthy = FakeSolanaRpc(load_fixtures()), FakeSolanaRpc(load_fixtures())
+        healthy.snapshot = {"slot": 1, "lamports": 5_000_000_000, "tokens": {}}
+
+        async def scenario():
+            async with failing as failing_url, healthy as healthy_url:
+                monkeypatch.setattr(server, "SOLANA_RPC_ENDPOINTS", [failing_url, healthy_url])
+                return await server.solana_rpc_call("getBalance", ["WALLET"])
+
+        result = asyncio.run(scenario())
+        assert result["value"] == 5_000_000_000
+
+        finished = spans.get_finished_spans()
+        attempts = [s for s in finished if s.name == "solana_rpc getBalance"]
+        assert len(attempts) == 2
+        assert all(s.attributes["rpc.method"] == "getBalance" for s in attempts)
+        assert all(s.attributes["rpc.endpoint"] == "127.0.0.1" for s in attempts)
+        assert [s.status.status_code for s in attempts] == [StatusCode.ERROR, StatusCode.UNSET]
+
+        http = [s for s in finished if s.name == "HTTP POST"]
+        assert {s.parent.span_id for s in http} == {s.context.span_id for s in attempts}
+        assert all(s.attributes["http.response.status_code"] == 200 for s in http)
+
+    def test_unreachable_endpoint_records_exception(self, spans, monkeypatch):
+        monkeypatch.setattr(server, "SOLANA_RPC_ENDPOINTS", ["http://127.0.0.1:9"])
+        assert asyncio.run(server.solana_rpc_call("getSlot", [])) == {}
+
+        attempt = [s for s in spans.get_finished_spans() if s.name == "solana_rpc getSlot"][0]
+        assert attempt.status.status_code == StatusCode.ERROR
+        assert attempt.events[0].name == "exception"
+
+
+class TestMongoSpans:
+
+    def command_event(self, command_name: str, command: dict = None, failure: dict = None):
+        return SimpleNamespace(
+            connection_id=("localhost", 27017), request_id=7, command_name=command_name, command=command or {},
+            database_name="quantum_db", failure=failure, duration_micros=0
+        )
+
+    def test_command_span_is_child_of_current_span(self, spans):
+        listener = server.MongoTracingListener()
+        command = {"find": "users", "filter": {"wallet_public_key": "SECRET_WALLET"}}
+        with server.tracer.start_as_current_span("request") as request_span:
+            listener.started(self.command_event("find", command))
+        listener.succeeded(self.command_event("find"))
+
+        span = [s for s in spans.get_finished_spans() if s.name == "mongo find"][0]
+        assert span.parent.span_id == request_span.get_span_context().span_id
+        assert span.attributes["db.collection.name"] == "users"
+        assert span.attributes["db.query.text"] == "{'filter': {'wallet_public_key': '?'}}"
+
+    def test_failed_command_marks_error(self, spans):
+        listener = server.MongoTracingListener()
+        listener.started(self.command_event("insert", {"insert": "users"}))
+        listener.failed(self.command_event("insert", failure={"errmsg": "E11000 duplicate key"}))
+
+        span = spans.get_finished_spans()[0]
+        assert span.status.status_code == StatusCode.ERROR
+        assert "E11000" in span.status.description
+
+
+class TestTracingConfig:
+
+    def test_disabled_by_default(self):
+        assert server.build_tracer_provider("none", 1.0) is None
+
+    def test_file_exporter_writes_json_lines(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        provider = server.build_tracer_provider("file", 1.0, path=str(path))
+        with provider.get_tracer("test").start_as_current_span("refresh_progress"):
+            pass
+        provider.shutdown()
+
+        lines = path.read_text().splitlines()
+        assert len(lines) == 1
+        assert json.loads(lines[0])["name"] == "refresh_progress"
+
+    def test_sampling_ratio_and_parent_decision(self, tmp_path):
+        provider = server.build_tracer_provider("file", 0.0, path=str(tmp_path / "traces.jsonl"))
+        tracer = provider.get_tracer("test")
+        assert not tracer.start_span("new_trace").is_recording()
+
+        # A caller that sampled its trace keeps it sampled here
+        parent = SpanContext(trace_id=1, span_id=2, is_remote=True, trace_flags=TraceFlags(TraceFlags.SAMPLED))
+        context = trace.set_span_in_context(NonRecordingSpan(parent))
+        assert tracer.start_span("continued", context=context).is_recording()
+        provider.shutdown()
@@ -0,0 +1,116 @@
+"""
+Upstream rate limiting and circuit breaker tests (in-process, local stub upstreams)
+Tests for:
+- Consecutive failures open the breaker, after which calls fail fast to cached values
+- After the reset period a single probe closes (or re-opens) the breaker
+- Token buckets reject calls beyond the configured rate without reaching the upstream
+- A failing Solana RPC endpoint is skipped while its breaker is open
+- Breaker state and rejections are exported as metrics
+"""
+
+import pytest
+import asyncio
+
+from prometheus_client import REGISTRY
+
+import server
+from upstream_stubs import StubBehaviour, StubPack
+
+MINT = "HYPEmint1111111111111111111111111111111111"
+FAILING = StubBehaviour(error_rate=1.0)
+
+
+def sample(name: str, labels: dict) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.fixture
+def guards(monkeypatch):
+    monkeypatch.setattr(server, "_upstream_guards", {})
+    monkeypatch.setattr(server, "_spl_price_cache", {})
+    monkeypatch.setattr(server, "sol_price_feed", server.SolPriceFeed())
+    monkeypatch.setattr(server, "UPSTREAM_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(server, "UPSTREAM_BREAKER_RESET", 0.2)
+
+
+async def with_stubs(monkeypatch, pack: StubPack, scenario):
+    async with pack:
+        monkeypatch.setattr(server, "SOLANA_RPC_ENDPOINTS", [stub.url for stub in pack.solana])
+        for key in ("COINGECKO_API_BASE", "BINANCE_API_BASE", "COINBASE_API_BASE", "CARD2CRYPTO_API_BASE"):
+            monkeypatch.setattr(server, key, pack.env()[key])
+        return await scenario()
+
+
+class TestCircuitBreaker:
+
+    def test_opens_and_serves_cached_price(self, guards, monkeypatch):
+        pack = StubPack()
+        pack.coingecko.token_prices = {MINT: 2.0}
+        rejected = sample("upstream_rejected_total", {"upstream": "coingecko", "reason": "circuit_open"})
+
+        async def scenario():
+            values = [await server.get_spl_token_usd_value(MINT, 10)]
+            pack.coingecko.behaviour = FAILING
+            for _ in range(5):
+                values.append(await server.get_spl_token_usd_value(MINT, 10))
+            return values
+
+        values = asyncio.run(with_stubs(monkeypatch, pack, scenario))
+        assert values == [20.0] * 6
+        assert pack.coingecko.stats["requests"] == 1 + 3
+        assert sample("upstream_circuit_state", {"upstream": "coingecko"}) == server.CIRCUIT_OPEN
+        assert sample("upstream_rejected_total", {"upstream": "coingecko", "reason": "circuit_open"}) == rejected + 2
+
+    def test_half_open_probe(self, guards, monkeypatch):
+        pack = StubPack(coingecko=FAILING)
+        pack.coingecko.token_prices = {MINT: 3.0}
+
+        async def scenario():
+            for _ in range(3):
+                await server.get_spl_token_usd_value(MINT, 1)
+            await asyncio.sleep(0.25)
+            # Failed probe: open again without further requests
+            await server.get_spl_token_usd_value(MINT, 1)
+            await server.get_spl_token_usd_value(MINT, 1)
+            reopened = (pack.coingecko.stats["requests"], sample("upstream_circuit_state", {"upstream": "coingecko"}))
+
+            await asyncio.sleep(0.25)
+            pack.coingecko.behaviour = StubBehaviour()
+            value = await server.get_spl_token_usd_value(MINT, 1)
+            return reopened, value
+
+        (requests, state), value = asyncio.run(with_stubs(monkeypatch, pack, scenario))
+        assert (requests, state) == (4, server.CIRCUIT_OPEN)
+        assert value == 3.0
+        assert sample("upstream_circuit_state", {"upstream": "coingecko"}) == server.CIRCUIT_CLOSED
+
+    def test_failing_rpc_endpoint_is_skipped(self, guards, monkeypatch):
+        pack = StubPack(solana_endpoints=2)
+        pack.solana[0].behaviour = StubBehaviour(latency="fixed:50", error_rate=1.0)
+
+        async def scenario():
+            return [await server.solana_rpc_call("getBalance", ["WALLET"]) for _ in range(6)]
+
+        results = asyncio.run(with_stubs(monkeypatch, pack, scenario))
+        assert all(r["value"] == pack.solana[1].lamports for r in results)
+        assert pack.solana[0].stats["requests"] == 3
+        assert pack.solana[1].stats["requests"] == 6
+
+
+class TestRateLimit:
+
+    def test_excess_calls_fall_back_without_request(self, guards, monkeypatch):
+        monkeypatch.setitem(server.UPSTREAM_RATE_LIMITS, "coingecko", (0.001, 2))
+        pack = StubPack(coinbase=FAILING)
+        pack.coingecko.sol_price, pack.binance.sol_price = 150.0, 149.0
+
+        async def scenario():
+            prices = []
+            for _ in range(3):
+                monkeypatch.setattr(server, "sol_price_feed", server.SolPriceFeed())
+                prices.append(await server.get_sol_price_usd())
+            return prices
+
+        assert asyncio.run(with_stubs(monkeypatch, pack, scenario)) == [149.5, 149.5, 149.0]
+        assert pack.coingecko.stats["requests"] == 2
+        assert sample("upstream_rejected_total", {"upstream": "coingecko", "reason": "rate_limited"}) >= 1
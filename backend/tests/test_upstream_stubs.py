@@ -0,0 +1,107 @@
+"""
+Upstream stub pack tests (in-process, no MongoDB needed)
+Tests for:
+- Latency specs parse into seeded, reproducible distributions
+- Injected errors and token-bucket rate limiting
+- Keep-alive connections, so client pooling shows in the connection count
+- The server's upstream calls follow the configured base URLs (price sources, RPC failover)
+"""
+
+import pytest
+import asyncio
+import random
+
+import httpx
+
+import server
+from upstream_stubs import LatencyDistribution, StubBehaviour, StubPack, CoinGeckoStub
+
+
+@pytest.fixture
+def cold_price_cache(monkeypatch):
+    monkeypatch.setattr(server, "sol_price_feed", server.SolPriceFeed())
+
+
+async def with_stubs(monkeypatch, pack: StubPack, scenario):
+    async with pack:
+        for key, value in {
+            "SOLANA_RPC_ENDPOINTS": [stub.url for stub in pack.solana],
+            **{k: v for k, v in pack.env().items() if k != "SOLANA_RPC_URLS"},
+        }.items():
+            monkeypatch.setattr(server, key, value)
+        return await scenario()
+
+
+class TestLatencyDistribution:
+
+    def test_specs_and_reproducibility(self):
+        assert LatencyDistribution("fixed:20").sample(random.Random(0)) == 0.02
+        lognormal = LatencyDistribution("lognormal:20:0.5")
+        first = [lognormal.sample(random.Random(3)) for _ in range(5)]
+        assert first == [lognormal.sample(random.Random(3)) for _ in range(5)]
+        assert all(0.01 <= LatencyDistribution("uniform:10:50").sample(random.Random(i)) <= 0.05 for i in range(20))
+
+    def test_invalid_spec(self):
+        with pytest.raises(ValueError):
+            LatencyDistribution("gamma:1:2")
+        with pytest.raises(ValueError):
+            LatencyDistribution("uniform:10")
+
+
+class TestStubBehaviour:
+
+    def test_rate_limit_and_keep_alive(self):
+        stub = CoinGeckoStub(StubBehaviour(rate_limit=1, burst=2))
+
+        async def scenario():
+            async with stub as url:
+                async with httpx.AsyncClient(base_url=url) as http:
+                    return [(await http.get("/api/v3/simple/price")).status_code for _ in range(4)]
+
+        assert asyncio.run(scenario()) == [200, 200, 429, 429]
+        assert stub.stats["rate_limited"] == 2
+        assert stub.stats["connections"] == 1
+
+    def test_error_rate(self):
+        stub = CoinGeckoStub(StubBehaviour(error_rate=0.3, seed=5))
+
+        async def scenario():
+            async with stub as url:
+                async with httpx.AsyncClient(base_url=url) as http:
+                    return [(await http.get("/api/v3/simple/price")).status_code for _ in range(200)]
+
+        statuses = asyncio.run(scenario())
+        assert 40 <= statuses.count(503) <= 80
+        assert statuses.count(503) == stub.stats["errors"]
+
+
+class TestConfiguredUpstreams:
+
+    def test_sol_price_without_coingecko(self, monkeypatch, cold_price_cache):
+        pack = StubPack(coingecko=StubBehaviour(error_rate=1.0))
+        pack.binance.sol_price, pack.coinbase.sol_price = 123.45, 123.55
+
+        price = asyncio.run(with_stubs(monkeypatch, pack, server.get_sol_price_usd))
+        assert price == pytest.approx(123.5)
+        assert pack.coingecko.stats["errors"] == 1
+        assert pack.binance.paths["/api/v3/ticker/price"] == 1
+        assert pack.coinbase.paths["/v2/prices/SOL-USD/spot"] == 1
+
+    def test_rpc_fails_over_to_next_endpoint(self, monkeypatch):
+        pack = StubPack(solana_endpoints=2, solana=StubBehaviour(rate_limit=0.001, burst=0))
+        pack.solana[1].behaviour = StubBehaviour()
+        pack.solana[1].lamports = 7_000_000_000
+
+        result = asyncio.run(with_stubs(monkeypatch, pack, lambda: server.solana_rpc_call("getBalance", ["WALLET"])))
+        assert result["value"] == 7_000_000_000
+        assert pack.solana[0].stats["rate_limited"] == 1
+
+    def test_env_points_at_stubs(self):
+        async def scenario():
+            async with StubPack(solana_endpoints=2) as pack:
+                return pack, pack.env()
+
+        pack, env = asyncio.run(scenario())
+        assert env["SOLANA_RPC_URLS"].split(",") == [stub.url for stub in pack.solana]
+        assert env["COINGECKO_API_BASE"] == f"{pack.coingecko.url}/api/v3"
+        assert env["CARD2CRYPTO_API_BASE"].endswith("/control")
@@ -0,0 +1,218 @@
+"""
+Request-scoped and process-wide user lookup tests
+Tests for:
+- Repeated lookups of the same wallet / referral code hit Mongo once per request
+- Misses are remembered and newly registered users are primed into the scope
+- Concurrent lookups are batched into a single $in query
+- The process-wide LRU cache serves immutable users across requests
+- Cached misses expire and are never trusted for registration
+- Mongo query counts per endpoint stay at their reduced level
+"""
+
+import pytest
+import asyncio
+import os
+import sys
+import copy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server
+from server import UserCreate, PreSalePurchaseRequest
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        if isinstance(condition, dict) and "$in" in condition:
+            if doc.get(field) not in condition["$in"]:
+                return False
+        elif doc.get(field) != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def skip(self, n):
+        self.docs = self.docs[n:]
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n] if n else self.docs
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs[:length] if length else self.docs
+
+
+class FakeCollection:
+    """In-memory stand-in for a Motor collection that counts read queries"""
+
+    def __init__(self):
+        self.docs = []
+        self.reads = 0
+        self.writes = 0
+
+    def find(self, query, projection=None):
+        self.reads += 1
+        return FakeCursor([copy.deepcopy(d) for d in self.docs if matches(d, query)])
+
+    async def find_one(self, query, projection=None):
+        self.reads += 1
+        found = [d for d in self.docs if matches(d, query)]
+        return copy.deepcopy(found[0]) if found else None
+
+    async def count_documents(self, query):
+        self.reads += 1
+        return len([d for d in self.docs if matches(d, query)])
+
+    async def insert_one(self, doc):
+        doc["_id"] = len(self.docs) + 1
+        self.docs.append(copy.deepcopy(doc))
+
+    async def bulk_write(self, requests, ordered=True):
+        self.writes += len(requests)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    collections = {}
+    for name in ["users_collection", "affiliate_relations", "affiliate_commissions", "affiliate_leaderboard", "presale_purchases"]:
+        collections[name] = FakeCollection()
+        monkeypatch.setattr(server, name, collections[name])
+    monkeypatch.setattr(server, "user_cache", server.UserCache(max_size=100, negative_ttl=60))
+    return collections
+
+
+def run_in_scope(coro_fn):
+    async def runner():
+        with server.user_lookup_scope():
+            return await coro_fn()
+    return asyncio.run(runner())
+
+
+class FakeRequest:
+    base_url = "http://testserver/"
+
+
+class TestUserLoader:
+    """Test the request-scoped identity map"""
+
+    def test_repeated_lookups_hit_mongo_once(self, fake_db):
+        async def lookups():
+            await server.register_affiliate(UserCreate(wallet_public_key="W1"))
+            fake_db["users_collection"].reads = 0
+            for _ in range(3):
+                assert (await server.get_user_by_wallet("W1"))["wallet_public_key"] == "W1"
+            return fake_db["users_collection"].reads
+
+        assert run_in_scope(lookups) == 0
+
+    def test_concurrent_lookups_are_batched(self, fake_db):
+        async def lookups():
+            for wallet in ["A", "B", "C"]:
+                await fake_db["users_collection"].insert_one({
+                    "wallet_public_key": wallet, "referral_code": f"QTM{wallet}", "referrer_id": None
+                })
+            users = await asyncio.gather(
+                server.get_user_by_wallet("A"),
+                server.get_user_by_wallet("B"),
+                server.get_user_by_wallet("A"),
+                server.get_user_by_wallet("missing"),
+            )
+            return users, fake_db["users_collection"].reads
+
+        users, reads = run_in_scope(lookups)
+        assert [u["wallet_public_key"] if u else None for u in users] == ["A", "B", "A", None]
+        assert reads == 1
+
+    def test_outside_scope_uses_process_cache(self, fake_db):
+        async def lookups():
+            await server.get_user_by_wallet("W1")
+            await server.get_user_by_wallet("W1")
+            return fake_db["users_collection"].reads
+
+        assert asyncio.run(lookups()) == 1
+        assert server.user_cache.stats()["hits"] == 1
+
+
+class TestUserCache:
+    """Test the process-wide LRU cache of immutable user mappings"""
+
+    def test_lru_eviction_and_stats(self):
+        cache = server.UserCache(max_size=4, negative_ttl=60)
+        for wallet in ["A", "B", "C"]:
+            cache.put({"wallet_public_key": wallet, "referral_code": f"QTM{wallet}"})
+
+        # Each user occupies two entries (wallet + code), so A was evicted
+        assert cache.get("wallet_public_key", "A") == (False, None)
+        assert cache.get("referral_code", "QTMC")[1]["wallet_public_key"] == "C"
+        stats = cache.stats()
+        assert stats["size"] == 4
+        assert stats["hit_ratio"] == 0.5
+
+    def test_negative_entries_expire(self, monkeypatch):
+        cache = server.UserCache(max_size=10, negative_ttl=5)
+        clock = [100.0]
+        monkeypatch.setattr(server.time, "monotonic", lambda: clock[0])
+
+        cache.put_missing("wallet_public_key", "GHOST")
+        assert cache.get("wallet_public_key", "GHOST") == (True, None)
+        clock[0] += 6
+        assert cache.get("wallet_public_key", "GHOST") == (False, None)
+
+    def test_insert_overrides_cached_miss(self, fake_db):
+        async def flow():
+            assert await server.get_user_by_wallet("LATE") is None
+            await server.register_affiliate(UserCreate(wallet_public_key="LATE"))
+            return await server.get_user_by_wallet("LATE")
+
+        assert asyncio.run(flow())["wallet_public_key"] == "LATE"
+
+    def test_registration_ignores_cached_miss(self, fake_db):
+        """A user inserted by another worker is found even if this worker cached a miss"""
+        async def flow():
+            assert await server.get_user_by_wallet("OTHER") is None
+            await fake_db["users_collection"].insert_one({
+                "wallet_public_key": "OTHER", "referral_code": "QTMOTHER", "referrer_id": None, "created_at": "2025-01-01"
+            })
+            return await server.register_affiliate(UserCreate(wallet_public_key="OTHER"))
+
+        assert asyncio.run(flow()).referral_code == "QTMOTHER"
+        assert len(fake_db["users_collection"].docs) == 1
+
+
+class TestQueryCountsPerEndpoint:
+    """Lock in the user query reduction per endpoint"""
+
+    def test_affiliate_stats_new_wallet(self, fake_db):
+        """Lookup, auto-register, re-lookup: one wallet query + one referral code uniqueness check"""
+        async def endpoint():
+            await server.get_affiliate_stats("NEW_WALLET", FakeRequest())
+            return fake_db["users_collection"].reads
+
+        assert run_in_scope(endpoint) == 2
+
+    def test_presale_purchase_with_referral_chain(self, fake_db):
+        """Buyer lookup and code uniqueness only: referrer and chain walk come from the process cache"""
+        async def setup_chain():
+            root = await server.register_affiliate(UserCreate(wallet_public_key="ROOT"))
+            await server.register_affiliate(UserCreate(wallet_public_key="MID", referral_code_used=root.referral_code))
+            fake_db["users_collection"].reads = 0
+
+        async def purchase():
+            referrer_code = fake_db["users_collection"].docs[1]["referral_code"]
+            await server.create_presale_purchase(PreSalePurchaseRequest(
+                firstName="A", lastName="B", walletAddress="BUYER", tokenAmount=500,
+                paymentMethod="crypto", referralCode=referrer_code, hostUrl="http://testserver"
+            ))
+            return fake_db["users_collection"].reads
+
+        run_in_scope(setup_chain)
+        assert run_in_scope(purchase) == 2
+        assert [r["level"] for r in fake_db["affiliate_relations"].docs if r["user_id"] == "BUYER"] == [1, 2]
@@ -0,0 +1,345 @@
+"""
+Local stub servers for every upstream the backend calls, for offline performance testing.
+
+Each stub is an asyncio HTTP/1.1 server (keep-alive, so client pooling is measurable) serving
+the paths server.py uses: Solana JSON-RPC, CoinGecko simple/token price, the Binance ticker,
+the Coinbase spot price and Card2Crypto wallet.php. Latency follows a configurable distribution and errors and rate
+limiting (token bucket, 429) are injected from a seeded RNG, so runs are reproducible.
+
+Point the server at them through its base-URL settings:
+    SOLANA_RPC_URLS, COINGECKO_API_BASE, BINANCE_API_BASE, COINBASE_API_BASE, CARD2CRYPTO_API_BASE
+
+Usage (from backend/), prints the variables to export and serves until interrupted:
+    python upstream_stubs.py [--latency lognormal:20:0.5] [--error-rate 0.01] [--rate-limit 50]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+LATENCY_DISTRIBUTIONS = {
+    # name: (parameter count, sampler(rng, *params) -> milliseconds)
+    "fixed": (1, lambda rng, ms: ms),
+    "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+    "normal": (2, lambda rng, mean, sd: max(0.0, rng.gauss(mean, sd))),
+    "lognormal": (2, lambda rng, median, sigma: median * rng.lognormvariate(0.0, sigma)),
+    "pareto": (2, lambda rng, minimum, alpha: minimum * rng.paretovariate(alpha)),
+}
+
+
+class LatencyDistribution:
+    """
+    Response delay from a spec in milliseconds: "fixed:20", "uniform:10:50", "normal:30:5",
+    "lognormal:20:0.5" (median, sigma) or "pareto:10:1.5" (minimum, alpha).
+    """
+
+    def __init__(self, spec: str):
+        name, *params = spec.split(":")
+        if name not in LATENCY_DISTRIBUTIONS or len(params) != LATENCY_DISTRIBUTIONS[name][0]:
+            raise ValueError(f"Invalid latency spec {spec!r}, expected one of: fixed:MS, uniform:LOW:HIGH, "
+                             f"normal:MEAN:SD, lognormal:MEDIAN:SIGMA, pareto:MIN:ALPHA")
+        self.spec = spec
+        self._sampler = LATENCY_DISTRIBUTIONS[name][1]
+        self._params = [float(p) for p in params]
+
+    def sample(self, rng: random.Random) -> float:
+        """Seconds"""
+        return self._sampler(rng, *self._params) / 1000
+
+
+class StubBehaviour:
+    """Latency, injected errors and rate limit of one stub server"""
+
+    def __init__(
+        self,
+        latency: str = "fixed:0",
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        rate_limit: float = 0.0,
+        burst: Optional[int] = None,
+        seed: int = 0,
+    ):
+        self.latency = LatencyDistribution(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rate_limit = rate_limit  # requests per second, 0 = unlimited
+        self.burst = burst if burst is not None else max(1, int(rate_limit))
+        self.seed = seed
+
+
+class StubServer:
+    """Keep-alive HTTP server applying a StubBehaviour in front of `respond`"""
+
+    name = "stub"
+
+    def __init__(self, behaviour: Optional[StubBehaviour] = None):
+        self.behaviour = behaviour or StubBehaviour()
+        self.rng = random.Random(self.behaviour.seed)
+        self.tokens = float(self.behaviour.burst)
+        self.refilled_at = time.monotonic()
+        self.stats = Counter()  # connections, requests, errors, rate_limited
+        self.paths = Counter()
+        self.url = None
+
+    def respond(self, method: str, path: str, query: Dict[str, List[str]], body: bytes) -> Tuple[int, object]:
+        raise NotImplementedError
+
+    def take_token(self) -> bool:
+        if self.behaviour.rate_limit <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.behaviour.burst, self.tokens + (now - self.refilled_at) * self.behaviour.rate_limit)
+        self.refilled_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    async def handle_request(self, method: str, target: str, body: bytes) -> Tuple[int, object, Dict[str, str]]:
+        parsed = urllib.parse.urlsplit(target)
+        self.stats["requests"] += 1
+        self.paths[parsed.path] += 1
+
+        if not self.take_token():
+            self.stats["rate_limited"] += 1
+            return 429, {"error": {"code": 429, "message": "Too many requests"}}, {"Retry-After": "1"}
+        await asyncio.sleep(self.behaviour.latency.sample(self.rng))
+        if self.behaviour.error_rate and self.rng.random() < self.behaviour.error_rate:
+            self.stats["errors"] += 1
+            return self.behaviour.error_status, {"error": {"code": self.behaviour.error_status, "message": "Injected failure"}}, {}
+
+        status, payload = self.respond(method, parsed.path, urllib.parse.parse_qs(parsed.query), body)
+        return status, payload, {}
+
+    async def handle(self, reader, writer):
+        self.stats["connections"] += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target = request_line.decode().split(" ")[:2]
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload, extra_headers = await self.handle_request(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode()
+                head = [
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}",
+                    "Content-Type: application/json",
+                    f"Content-Length: {len(data)}",
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}",
+                ] + [f"{k}: {v}" for k, v in extra_headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.server = await asyncio.start_server(self.handle, host, port)
+        self.url = f"http://{host}:{self.server.sockets[0].getsockname()[1]}"
+        return self.url
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+
+class SolanaRpcStub(StubServer):
+    """JSON-RPC (single and batch) for the balance, holder and scanner calls"""
+
+    name = "solana"
+
+    def __init__(self, behaviour: Optional[StubBehaviour] = None, lamports: int = 12_500_000_000,
+                 token_balances: Optional[Dict[str, float]] = None, holders: int = 20, slot: int = 300_000_000):
+        super().__init__(behaviour)
+        self.lamports = lamports
+        self.token_balances = token_balances or {}  # mint -> ui amount
+        self.holders = holders
+        self.slot = slot
+
+    def call(self, request: dict) -> dict:
+        method = request.get("method")
+        context = {"slot": self.slot}
+        if method == "getBalance":
+            result = {"context": context, "value": self.lamports}
+        elif method == "getTokenAccountsByOwner":
+            result = {"context": context, "value": [
+                {"account": {"data": {"parsed": {"info": {"mint": mint, "tokenAmount": {"uiAmount": amount}}}}}}
+                for mint, amount in self.token_balances.items()
+            ]}
+        elif method == "getTokenLargestAccounts":
+            result = {"context": context, "value": [{"uiAmount": 1000.0}] * self.holders}
+        elif method == "getSignaturesForAddress":
+            result = []
+        elif method == "getTransaction":
+            result = None
+        else:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32601, "message": "Method not found"}}
+        return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+
+    def respond(self, method, path, query, body):
+        payload = json.loads(body or b"{}")
+        if isinstance(payload, list):
+            return 200, [self.call(r) for r in payload]
+        return 200, self.call(payload)
+
+
+class CoinGeckoStub(StubServer):
+    name = "coingecko"
+
+    def __init__(self, behaviour: Optional[StubBehaviour] = None, sol_price: float = 150.0,
+                 token_prices: Optional[Dict[str, float]] = None):
+        super().__init__(behaviour)
+        self.sol_price = sol_price
+        self.token_prices = token_prices or {}  # mint -> usd
+
+    def respond(self, method, path, query, body):
+        if path == "/api/v3/simple/price":
+            return 200, {"solana": {"usd": self.sol_price}}
+        if path == "/api/v3/simple/token_price/solana":
+            mints = query.get("contract_addresses", [""])[0].split(",")
+            return 200, {m.lower(): {"usd": self.token_prices[m]} for m in mints if m in self.token_prices}
+        return 404, {"error": "not found"}
+
+
+class BinanceStub(StubServer):
+    name = "binance"
+
+    def __init__(self, behaviour: Optional[StubBehaviour] = None, sol_price: float = 150.0):
+        super().__init__(behaviour)
+        self.sol_price = sol_price
+
+    def respond(self, method, path, query, body):
+        if path == "/api/v3/ticker/price":
+            return 200, {"symbol": query.get("symbol", ["SOLUSDT"])[0], "price": f"{self.sol_price:.2f}"}
+        return 404, {"code": -1121, "msg": "Invalid symbol."}
+
+
+class CoinbaseStub(StubServer):
+    name = "coinbase"
+
+    def __init__(self, behaviour: Optional[StubBehaviour] = None, sol_price: float = 150.0):
+        super().__init__(behaviour)
+        self.sol_price = sol_price
+
+    def respond(self, method, path, query, body):
+        if path == "/v2/prices/SOL-USD/spot":
+            return 200, {"data": {"base": "SOL", "currency": "USD", "amount": f"{self.sol_price:.2f}"}}
+        return 404, {"errors": [{"id": "not_found", "message": "Not found"}]}
+
+
+class Card2CryptoStub(StubServer):
+    name = "card2crypto"
+
+    def respond(self, method, path, query, body):
+        if path == "/control/wallet.php":
+            return 200, {
+                "address_in": f"enc-{uuid.uuid4().hex}",
+                "polygon_address_in": "0x" + uuid.uuid4().hex[:40].ljust(40, "0"),
+                "callback_url": query.get("callback", [""])[0],
+            }
+        return 404, {"error": "not found"}
+
+
+class StubPack:
+    """
+    All upstream stubs, started together. `behaviour` applies to every stub unless
+    overridden by name (solana, coingecko, binance, coinbase, card2crypto).
+    """
+
+    def __init__(self, behaviour: Optional[StubBehaviour] = None, solana_endpoints: int = 1, **overrides: StubBehaviour):
+        def pick(name: str, offset: int = 0) -> StubBehaviour:
+            chosen = overrides.get(name, behaviour or StubBehaviour())
+            # Same settings, independent RNG stream per stub
+            return StubBehaviour(chosen.latency.spec, chosen.error_rate, chosen.error_status,
+                                 chosen.rate_limit, chosen.burst, chosen.seed + offset)
+
+        self.solana = [SolanaRpcStub(pick("solana", i)) for i in range(solana_endpoints)]
+        self.coingecko = CoinGeckoStub(pick("coingecko", 100))
+        self.binance = BinanceStub(pick("binance", 200))
+        self.card2crypto = Card2CryptoStub(pick("card2crypto", 300))
+        self.coinbase = CoinbaseStub(pick("coinbase", 400))
+
+    @property
+    def stubs(self) -> List[StubServer]:
+        return self.solana + [self.coingecko, self.binance, self.coinbase, self.card2crypto]
+
+    def env(self) -> Dict[str, str]:
+        """Server settings pointing every upstream at the stubs"""
+        return {
+            "SOLANA_RPC_URLS": ",".join(stub.url for stub in self.solana),
+            "COINGECKO_API_BASE": f"{self.coingecko.url}/api/v3",
+            "BINANCE_API_BASE": f"{self.binance.url}/api/v3",
+            "COINBASE_API_BASE": f"{self.coinbase.url}/v2",
+            "CARD2CRYPTO_API_BASE": f"{self.card2crypto.url}/control",
+        }
+
+    def apply(self, module):
+        """Point an already imported server module at the stubs"""
+        env = self.env()
+        module.SOLANA_RPC_ENDPOINTS = env["SOLANA_RPC_URLS"].split(",")
+        for key in ("COINGECKO_API_BASE", "BINANCE_API_BASE", "COINBASE_API_BASE", "CARD2CRYPTO_API_BASE"):
+            setattr(module, key, env[key])
+
+    def report(self):
+        for stub in self.stubs:
+            s = stub.stats
+            print(f"  {stub.name:<12} {stub.url:<24} connections={s['connections']} requests={s['requests']} "
+                  f"errors={s['errors']} rate_limited={s['rate_limited']}")
+
+    async def __aenter__(self):
+        for stub in self.stubs:
+            await stub.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        for stub in self.stubs:
+            await stub.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve local stubs for every backend upstream")
+    parser.add_argument("--latency", default="lognormal:20:0.5", help="latency spec in ms, e.g. fixed:20, uniform:10:50")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="requests per second per stub, 0 = unlimited")
+    parser.add_argument("--burst", type=int, default=None)
+    parser.add_argument("--solana-endpoints", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    behaviour = StubBehaviour(args.latency, args.error_rate, args.error_status, args.rate_limit, args.burst, args.seed)
+
+    async def main():
+        async with StubPack(behaviour, solana_endpoints=args.solana_endpoints) as pack:
+            for key, value in pack.env().items():
+                print(f"export {key}={value}")
+            try:
+                await asyncio.Event().wait()
+            finally:
+                pack.report()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -10,7 +10,7 @@ const api = axios.create({
 export const getConfig = () => api.get('/api/config');
 export const getPresaleProgress = () => api.get('/api/presale/progress');
 export const createPresalePurchase = (data) => api.post('/api/presale/purchase', data);
-export const getPresaleStatus = (id) => api.get(`/api/presale/status/${id}`);
+export const getPresaleStatus = (id, wait = 0) => api.get(`/api/presale/status/${id}`, { params: wait ? { wait } : {} });
 
 export const getAffiliateStats = (wallet) => api.get(`/api/affiliate/${wallet}/stats`);
 export const getAffiliateConfig = () => api.get('/api/affiliate/config');
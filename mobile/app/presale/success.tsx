@@ -28,7 +28,10 @@ export default function PreSaleSuccess() {
     }
 
     try {
-      const response = await axios.get(`${BACKEND_URL}/api/presale/status/${session_id}`);
+      // Long-poll: the backend holds the request until the payment is confirmed or 30s elapse
+      const response = await axios.get(`${BACKEND_URL}/api/presale/status/${session_id}`, {
+        params: { wait: 30 },
+      });
       
       if (response.data.payment_status === 'paid') {
         setPaymentData(response.data);
@@ -36,8 +39,8 @@ export default function PreSaleSuccess() {
       } else if (response.data.status === 'expired') {
         setStatus('error');
       } else {
-        // Continue polling
-        setTimeout(() => pollPaymentStatus(attempt + 1), 2000);
+        // Still pending after the wait, ask again
+        pollPaymentStatus(attempt + 1);
       }
     } catch (error) {
       console.error('Error checking payment status:', error);